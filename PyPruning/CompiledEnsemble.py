@@ -0,0 +1,201 @@
+import numpy as np
+import scipy.sparse
+from joblib import Parallel, delayed
+
+class CompiledEnsemble:
+    ''' A compiled, self-contained representation of a (pruned) ensemble of decision trees.
+
+    All trees are flattened into a single structure-of-arrays model where the nodes of all trees are stored consecutively. The weights of the ensemble members are folded into the leaf values so that the prediction of the ensemble is simply the sum of the leaf values reached in each tree. Prediction evaluates all trees on a batch of data at once via a vectorized traversal which advances all (example, tree) pairs by one level per iteration. Leaves point to themselves, so that pairs which reached a leaf can be dropped from the traversal and simply stay there.
+
+    Compiling an ensemble removes the per-tree Python and validation overhead of calling predict_proba of each scikit-learn tree. Moreover, the compiled ensemble does not require the original estimators anymore and can be stored / loaded via `save` and `load`. Use `PruningClassifier.compile` to compile a pruned ensemble.
+
+    Attributes
+    ----------
+    feature : numpy array of ints
+        The feature used for splitting in each node. Leaves use feature 0 which is never evaluated.
+    threshold : numpy array of floats
+        The threshold used for splitting in each node. Examples with x[feature] <= threshold go to the left child.
+    left : numpy array of ints
+        The (global) index of the left child of each node. Leaves point to themselves.
+    right : numpy array of ints
+        The (global) index of the right child of each node. Leaves point to themselves.
+    missing_left : numpy array of bools
+        True if missing values (NaN) go to the left child of a node.
+    value : numpy array of floats
+        A (n_nodes, C) matrix with the weighted class probabilities of each node.
+    roots : numpy array of ints
+        The (global) index of the root node of each tree.
+    max_depth : int
+        The maximum depth of all trees.
+    classes_ : numpy array
+        The class mapping used for predict.
+    n_jobs : int
+        The number of threads used for prediction.
+    predict_batch_size : int
+        The maximum number of rows which are predicted at once.
+    '''
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, max_depth, classes_, n_jobs = 1, predict_batch_size = 4096):
+        """
+        Creates a new CompiledEnsemble from its flattened arrays. Use `from_estimators` to compile a list of trees.
+        """
+        assert predict_batch_size >= 1, "predict_batch_size must be at-least 1"
+
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = np.asarray(classes_)
+        self.n_jobs = n_jobs
+        self.predict_batch_size = predict_batch_size
+
+    @classmethod
+    def from_estimators(cls, estimators, weights, classes, n_classes, n_jobs = 1, predict_batch_size = 4096):
+        '''
+        Compiles a weighted list of decision trees.
+
+        Parameters
+        ----------
+        estimators : list
+            A list of fitted scikit-learn decision trees (or any estimator offering a single-output tree_ attribute).
+        weights : list of floats
+            The weight of each estimator.
+        classes : numpy array / list of ints
+            The class mapping of the estimators in the order which is returned by predict_proba (see PruningClassifier.prune)
+        n_classes : int
+            The total number of classes.
+        n_jobs : int, default is 1
+            The number of threads used for prediction.
+        predict_batch_size : int, default is 4096
+            The maximum number of rows which are predicted at once.
+
+        Returns
+        -------
+        The CompiledEnsemble
+        '''
+        classes = np.asarray(classes)
+        n_nodes = 0
+        for e in estimators:
+            assert hasattr(e, "tree_"), "Only ensembles of decision trees can be compiled, but {} does not have a tree_ attribute".format(type(e).__name__)
+            assert e.tree_.value.shape[1] == 1, "Only single-output decision trees can be compiled"
+            n_nodes += e.tree_.node_count
+
+        feature = np.zeros(n_nodes, dtype=np.int64)
+        threshold = np.zeros(n_nodes, dtype=np.float64)
+        left = np.zeros(n_nodes, dtype=np.int64)
+        right = np.zeros(n_nodes, dtype=np.int64)
+        missing_left = np.zeros(n_nodes, dtype=bool)
+        value = np.zeros((n_nodes, n_classes), dtype=np.float64)
+        roots = np.zeros(len(estimators), dtype=np.int64)
+        max_depth = 0
+
+        offset = 0
+        for t, (e, w) in enumerate(zip(estimators, weights)):
+            tree = e.tree_
+            nodes = np.arange(offset, offset + tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            roots[t] = offset
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = tree.threshold
+            left[nodes] = np.where(is_leaf, nodes, tree.children_left + offset)
+            right[nodes] = np.where(is_leaf, nodes, tree.children_right + offset)
+            if hasattr(tree, "missing_go_to_left"):
+                missing_left[nodes] = tree.missing_go_to_left.astype(bool)
+
+            # Normalize the leaf values the same way DecisionTreeClassifier.predict_proba does and fold the weight into them
+            tvalue = tree.value[:, 0, :]
+            normalizer = tvalue.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value[offset:offset + tree.node_count, classes.astype(int)] = w * tvalue / normalizer
+
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+
+        return cls(feature, threshold, left, right, missing_left, value, roots, max_depth, classes, n_jobs, predict_batch_size)
+
+    def _predict_batch(self, X):
+        if scipy.sparse.issparse(X):
+            X = X.toarray()
+        # Scikit-learn's trees compare float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        X = X.ravel()
+
+        # Traverse all (example, tree) pairs at once. Pairs which reached a leaf are removed from the active set
+        node = np.tile(self.roots, n_rows)
+        offset = np.repeat(np.arange(n_rows) * n_features, len(self.roots))
+        active = np.arange(len(node))
+        for _ in range(self.max_depth):
+            if len(active) == 0:
+                break
+            anode = node[active]
+            x = X[offset[active] + self.feature[anode]]
+            go_left = np.where(np.isnan(x), self.missing_left[anode], x <= self.threshold[anode])
+            anode = np.where(go_left, self.left[anode], self.right[anode])
+            node[active] = anode
+            active = active[self.left[anode] != anode]
+
+        return self.value[node].reshape(n_rows, len(self.roots), -1).sum(axis=1)
+
+    def predict_proba(self, X):
+        ''' Predict class probabilities using the compiled ensemble.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The samples to be predicted.
+
+        Returns
+        -------
+        y : array, shape (n_samples,C)
+            The predicted class probabilities.
+        '''
+        n_rows = X.shape[0]
+        bounds = [(start, min(start + self.predict_batch_size, n_rows)) for start in range(0, n_rows, self.predict_batch_size)]
+
+        if len(bounds) <= 1:
+            return self._predict_batch(X)
+
+        proba = np.zeros(shape=(n_rows, self.value.shape[1]), dtype=np.float64)
+        def predict(start, end):
+            proba[start:end] = self._predict_batch(X[start:end])
+
+        Parallel(n_jobs=self.n_jobs, backend="threading")(
+            delayed(predict) (start, end) for start, end in bounds
+        )
+        return proba
+
+    def predict(self, X):
+        ''' Predict classes using the compiled ensemble.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The samples to be predicted.
+
+        Returns
+        -------
+        y : array, shape (n_samples,)
+            The predicted classes.
+        '''
+        proba = self.predict_proba(X)
+        return self.classes_.take(proba.argmax(axis=1), axis=0)
+
+    def save(self, path):
+        ''' Stores the compiled ensemble in a compressed `.npz` file under the given path. '''
+        np.savez_compressed(
+            path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right, missing_left=self.missing_left,
+            value=self.value, roots=self.roots, max_depth=self.max_depth, classes_=self.classes_
+        )
+
+    @classmethod
+    def load(cls, path, n_jobs = 1, predict_batch_size = 4096):
+        ''' Loads a compiled ensemble which has been stored via `save`. '''
+        with np.load(path, allow_pickle=False) as f:
+            return cls(
+                f["feature"], f["threshold"], f["left"], f["right"], f["missing_left"], f["value"], f["roots"], f["max_depth"], f["classes_"], n_jobs, predict_batch_size
+            )
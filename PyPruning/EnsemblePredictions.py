@@ -0,0 +1,217 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import scipy.sparse
+
+from .PruningClassifier import infer_classes, collect_proba
+from .Storage import create_proba, chunk_bounds, class_predictions, LabelPredictions, TopKProba
+
+class EnsemblePredictions:
+    ''' The pre-computed predictions of an ensemble on a pruning set which can be shared by multiple pruners.
+
+    Every call to `PruningClassifier.prune` evaluates all estimators on the pruning set. If multiple pruners are applied to the same ensemble and the same pruning set (e.g. to compare different pruning methods), the predictions can be computed once via `EnsemblePredictions.compute` and passed to `prune` via the `predictions` parameter. Pruners which only require the class predictions receive the (cached) `label_predictions()`, all others receive the (M,N,C) tensor `proba`.
+
+    The predictions can be stored on disk via `save` and re-loaded via `load`. Each object carries a key which is computed from the estimators and the pruning set (see `fingerprint`). Use `cached` to only compute the predictions if no matching predictions are stored under a given path.
+
+    Attributes
+    ----------
+    proba : numpy array, numpy memmap, Storage.ChunkedProba, Storage.TopKProba or None
+        The (M,N,C) prediction tensor. This is None if only the class predictions have been stored (see `save`).
+    target : numpy array of ints
+        The N class targets.
+    classes_ : numpy array
+        The class mapping of the estimators in the order which is returned by predict_proba.
+    n_classes_ : int
+        The total number of classes.
+    key : str or None
+        The fingerprint of the estimators and the pruning set the predictions have been computed on.
+    '''
+    def __init__(self, proba, target, classes_, n_classes_, labels = None, key = None):
+        """
+        Creates a new EnsemblePredictions object. Use `compute` to compute the predictions of an ensemble.
+
+        Parameters
+        ----------
+        proba : numpy array, numpy memmap, Storage.ChunkedProba, Storage.TopKProba or None
+            The (M,N,C) prediction tensor. Can be None if labels is given.
+        target : numpy array / list of ints
+            The N class targets.
+        classes_ : numpy array / list of ints
+            The class mapping of the estimators.
+        n_classes_ : int
+            The total number of classes.
+        labels : numpy array, optional
+            The (M,N) matrix of class predictions. If None, it is computed from proba when needed.
+        key : str, optional
+            The fingerprint of the estimators and the pruning set.
+        """
+        assert proba is not None or labels is not None, "Either proba or labels must be supplied"
+
+        self.proba = proba
+        self.target = np.asarray(target)
+        self.classes_ = np.asarray(classes_)
+        self.n_classes_ = int(n_classes_)
+        self.key = key
+        self.labels_ = labels
+        self.label_predictions_ = None
+
+    @classmethod
+    def compute(cls, X, y, estimators, classes = None, n_classes = None, storage = None, storage_path = None, n_jobs = 1, predict_batch_size = None, top_k = 16):
+        '''
+        Evaluates all estimators on the pruning set. See `PruningClassifier.prune` for a description of the parameters.
+
+        Returns
+        -------
+        The EnsemblePredictions
+        '''
+        if classes is None:
+            classes, n_classes = infer_classes(estimators, y)
+
+        proba = create_proba((len(estimators), X.shape[0], n_classes), storage, storage_path, top_k = top_k)
+        collect_proba(estimators, X, proba, classes, n_jobs, predict_batch_size)
+        return cls(proba, y, classes, n_classes, key = EnsemblePredictions.fingerprint(X, y, estimators))
+
+    @classmethod
+    def cached(cls, path, X, y, estimators, **kwargs):
+        '''
+        Loads the predictions stored under path if they have been computed for the same estimators and pruning set. Otherwise, the predictions are computed (see `compute` for the kwargs) and stored under path.
+
+        Returns
+        -------
+        The EnsemblePredictions
+        '''
+        key = EnsemblePredictions.fingerprint(X, y, estimators)
+        if os.path.exists(os.path.join(path, "meta.npz")):
+            predictions = cls.load(path)
+            if predictions.key == key:
+                return predictions
+
+        predictions = cls.compute(X, y, estimators, **kwargs)
+        predictions.save(path)
+        return predictions
+
+    @staticmethod
+    def fingerprint(X, y, estimators):
+        '''
+        Computes a fingerprint of the estimators and the pruning set. The estimators are fingerprinted via their pickled representation.
+
+        Returns
+        -------
+        The fingerprint as hex string.
+        '''
+        h = hashlib.sha1()
+        if scipy.sparse.issparse(X):
+            X = X.tocsr()
+            parts = [X.data, X.indices, X.indptr]
+        else:
+            parts = [np.asarray(X)]
+        for a in parts + [np.asarray(y)]:
+            a = np.ascontiguousarray(a)
+            h.update(str((a.shape, a.dtype.str)).encode())
+            h.update(a.tobytes())
+
+        for e in estimators:
+            h.update(hashlib.sha1(pickle.dumps(e)).digest())
+        return h.hexdigest()
+
+    def matches(self, X, y, estimators):
+        '''
+        Returns True if these predictions have been computed for the given estimators and pruning set.
+        '''
+        return self.key is not None and self.key == EnsemblePredictions.fingerprint(X, y, estimators)
+
+    @property
+    def shape(self):
+        ''' The shape (M,N,C) of the prediction tensor. '''
+        if self.proba is not None:
+            return tuple(self.proba.shape)
+        return (self.labels_.shape[0], self.labels_.shape[1], self.n_classes_)
+
+    def labels(self):
+        '''
+        Returns the (M,N) matrix of class predictions (the argmax over the class axis). It is computed once and then re-used.
+        '''
+        if self.labels_ is None:
+            self.labels_ = class_predictions(self.proba)
+        return self.labels_
+
+    def label_predictions(self):
+        '''
+        Returns the compact Storage.LabelPredictions for pruners which only require the class predictions. It is computed once and then re-used.
+        '''
+        if self.label_predictions_ is None:
+            self.label_predictions_ = LabelPredictions(self.labels(), self.target, self.n_classes_)
+        return self.label_predictions_
+
+    def correctness(self):
+        '''
+        Returns the (M,N) boolean matrix of correct predictions.
+        '''
+        return self.label_predictions().correctness()
+
+    def votes(self):
+        '''
+        Returns the (N,C) matrix with the number of votes for each class (see `Storage.vote_counts`).
+        '''
+        return self.label_predictions().votes()
+
+    def save(self, path, labels_only = False):
+        '''
+        Stores the predictions in the directory path. The prediction tensor is stored as `proba.npy`, the class predictions as `labels.npy` and the targets, the class mapping and the key in `meta.npz`. Memory-mapped and chunked predictions are copied chunk by chunk. For a Storage.TopKProba, the indices and values are stored as `topk_indices.npy` and `topk_values.npy` instead of `proba.npy`.
+
+        Parameters
+        ----------
+        path : str
+            The directory. It is created if it does not exist.
+        labels_only : boolean, default is False
+            If true, only the class predictions are stored. This requires 4*C times less space, but the loaded predictions can then only be used by pruners which only require the class predictions.
+        '''
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "labels.npy"), self.labels())
+
+        proba_path = os.path.join(path, "proba.npy")
+        topk_paths = [os.path.join(path, "topk_indices.npy"), os.path.join(path, "topk_values.npy")]
+        for p in [proba_path] + topk_paths:
+            if os.path.exists(p):
+                os.remove(p)
+
+        if isinstance(self.proba, TopKProba) and not labels_only:
+            np.save(topk_paths[0], self.proba.indices)
+            np.save(topk_paths[1], self.proba.values)
+        elif self.proba is not None and not labels_only:
+            out = np.lib.format.open_memmap(proba_path, mode="w+", dtype=self.proba.dtype, shape=self.shape)
+            for start, end in chunk_bounds(self.proba):
+                out[:, start:end, :] = self.proba[:, start:end, :]
+            out.flush()
+            del out
+
+        np.savez(
+            os.path.join(path, "meta.npz"), target=self.target, classes_=self.classes_, n_classes_=self.n_classes_, key="" if self.key is None else self.key
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode = "r"):
+        '''
+        Loads predictions which have been stored via `save`. By default, the prediction tensor is memory-mapped so that it is only paged in when it is accessed. Use mmap_mode = None to load it into memory.
+
+        Returns
+        -------
+        The EnsemblePredictions
+        '''
+        with np.load(os.path.join(path, "meta.npz"), allow_pickle=False) as meta:
+            target, classes_, n_classes_, key = meta["target"], meta["classes_"], meta["n_classes_"], str(meta["key"])
+
+        proba_path = os.path.join(path, "proba.npy")
+        topk_path = os.path.join(path, "topk_indices.npy")
+        if os.path.exists(proba_path):
+            proba = np.load(proba_path, mmap_mode=mmap_mode)
+        elif os.path.exists(topk_path):
+            indices = np.load(topk_path, mmap_mode=mmap_mode)
+            values = np.load(os.path.join(path, "topk_values.npy"), mmap_mode=mmap_mode)
+            proba = TopKProba.from_arrays(indices, values, int(n_classes_))
+        else:
+            proba = None
+        labels = np.load(os.path.join(path, "labels.npy"))
+        return cls(proba, target, classes_, n_classes_, labels = labels, key = key if len(key) > 0 else None)
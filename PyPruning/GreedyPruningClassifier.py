@@ -1,11 +1,14 @@
 from functools import partial
+import heapq
+import time
 import numpy as np
 from sklearn.metrics import roc_auc_score
 
-from joblib import Parallel,delayed
-from sklearn.utils import axis0_safe_slice
+from joblib import Parallel,delayed, effective_n_jobs
+
+from .PruningClassifier import PruningClassifier, vectorized_metric
+from .Storage import CHUNK_SIZE, argmax_predictions
 
-from .PruningClassifier import PruningClassifier
 def error(i, ensemble_proba, selected_models, target):
     ''' 
     Computes the error of the sub-ensemble including the i-th classifier.  
@@ -19,6 +22,15 @@ def error(i, ensemble_proba, selected_models, target):
     pred = 1.0 / (1 + len(sub_proba)) * (sub_proba.sum(axis=0) + iproba)
     return (pred.argmax(axis=1) != target).mean() 
 
+def error_incremental(candidates, ensemble_proba, selected_models, target, sub_proba):
+    '''
+    Incremental version of `error` which scores all candidates at once. sub_proba is the running (N,C) sum of the predictions of the already selected models.
+    '''
+    pred = argmax_predictions(ensemble_proba, candidates, sub_proba)
+    return (pred != target[np.newaxis, :]).mean(axis=1)
+
+error.incremental = error_incremental
+
 def neg_auc(i, ensemble_proba, selected_models, target):
     ''' 
     Compute the (negative) roc-auc score of the sub-ensemble including the i-th classifier.  
@@ -27,12 +39,28 @@ def neg_auc(i, ensemble_proba, selected_models, target):
     sub_proba = ensemble_proba[selected_models, :, :]
     pred = 1.0 / (1 + len(sub_proba)) * (sub_proba.sum(axis=0) + iproba)
 
-    if(sub_proba.shape[1] == 2):
+    if(pred.shape[1] == 2):
         pred = pred.argmax(axis=1)
         return - 1.0 * roc_auc_score(target, pred)
     else:
         return - 1.0 * roc_auc_score(target, pred, multi_class="ovr")
 
+def neg_auc_incremental(candidates, ensemble_proba, selected_models, target, sub_proba):
+    '''
+    Incremental version of `neg_auc`. The sub-ensemble predictions are taken from the running sum sub_proba, but the roc-auc score itself is still computed once per candidate. 
+    '''
+    scale = 1.0 / (1 + len(selected_models))
+    scores = []
+    for iproba in ensemble_proba[candidates, :, :]:
+        pred = scale * (sub_proba + iproba)
+        if(pred.shape[1] == 2):
+            scores.append(- 1.0 * roc_auc_score(target, pred.argmax(axis=1)))
+        else:
+            scores.append(- 1.0 * roc_auc_score(target, pred, multi_class="ovr"))
+    return np.array(scores)
+
+neg_auc.incremental = neg_auc_incremental
+
 def complementariness(i, ensemble_proba, selected_models, target):
     '''
     Computes the complementariness of the i-th classifier wrt. to the sub-ensemble. A classifier is complementary to the sub-ensemble if it disagrees with the ensemble, but is correct (and the ensemble is wrong)
@@ -47,6 +75,16 @@ def complementariness(i, ensemble_proba, selected_models, target):
     b2 = (sub_proba.sum(axis=0).argmax(axis=1) != target)
     return - 1.0 * np.sum(np.logical_and(b1, b2))
 
+def complementariness_incremental(candidates, ensemble_proba, selected_models, target, sub_proba):
+    '''
+    Incremental version of `complementariness` which scores all candidates at once. sub_proba is the running (N,C) sum of the predictions of the already selected models.
+    '''
+    b1 = (argmax_predictions(ensemble_proba, candidates) == target[np.newaxis, :])
+    b2 = (sub_proba.argmax(axis=1) != target)
+    return - 1.0 * np.logical_and(b1, b2[np.newaxis, :]).sum(axis=1)
+
+complementariness.incremental = complementariness_incremental
+
 def margin_distance(i, ensemble_proba, selected_models, target, p_range = [0, 0.25]):
     '''
     Computes how including the i-th classifiers into the sub-ensemble changes its prediction towards a reference vector.
@@ -75,6 +113,23 @@ def margin_distance(i, ensemble_proba, selected_models, target, p_range = [0, 0.
     p = np.random.uniform(p_range[0], p_range[1], len(target))
     return np.mean((p - c_refs)**2)
 
+def margin_distance_incremental(candidates, ensemble_proba, selected_models, target, sub_proba, p_range = [0, 0.25]):
+    '''
+    Incremental version of `margin_distance` which scores all candidates at once. As in `margin_distance` a new p is sampled for every candidate.
+    '''
+    # The sum of the (mean) signature vectors of the sub-ensemble is shared by all candidates 
+    sub_refs = 0.0
+    if len(selected_models) > 0:
+        sub_refs = np.mean(2 * (argmax_predictions(ensemble_proba, selected_models) == target[np.newaxis, :]) - 1.0, axis=1).sum()
+    
+    i_refs = np.mean(2 * (argmax_predictions(ensemble_proba, candidates) == target[np.newaxis, :]) - 1.0, axis=1)
+    c_refs = (sub_refs + i_refs) / (1 + len(selected_models))
+
+    p = np.random.uniform(p_range[0], p_range[1], (len(candidates), len(target)))
+    return np.mean((p - c_refs[:, np.newaxis])**2, axis=1)
+
+margin_distance.incremental = margin_distance_incremental
+
 def drep(i, ensemble_proba, selected_models, target, rho = 0.25):
     '''
     A multi-class version of a PAC-style bound which includes the diversity of the sub-ensemble. This basically counts the number of different predictions between the i-th classifier and the sub-ensemble.
@@ -100,15 +155,39 @@ def drep(i, ensemble_proba, selected_models, target, rho = 0.25):
 
         gamma = sorted(diffs, key = lambda e: e[1], reverse=False)
         K = int(np.ceil(rho * len(gamma)))
-        topidx = [idx for idx in gamma[:K]]
+        topidx = [idx for idx, _ in gamma[:K]]
 
         if i in topidx:
-            iproba = ensemble_proba[i,:,:].argmax(axis=1)
+            iproba = ensemble_proba[i,:,:]
             pred = 1.0 / (1 + len(sub_ensemble)) * (sub_ensemble.sum(axis=0) + iproba)
             return (pred.argmax(axis=1) != target).mean() 
         else:
             return np.inf
 
+def drep_round(candidates, ensemble_proba, selected_models, target, sub_proba, rho = 0.25):
+    '''
+    Round version of `drep` which scores all remaining candidates at once. The diversity ranking is computed once for all candidates and the error is only evaluated for the top-rho candidates. All other candidates receive a score of infinity. sub_proba is the running (N,C) sum of the predictions of the already selected models.
+    '''
+    if len(selected_models) == 0:
+        return error_incremental(candidates, ensemble_proba, selected_models, target, sub_proba)
+
+    # Count the agreements of each candidate with the sub-ensemble block by block to bound the memory
+    sproba = sub_proba.argmax(axis=1)
+    n_blocks = int(np.ceil(len(candidates) * ensemble_proba.shape[1] * ensemble_proba.shape[2] / CHUNK_SIZE))
+    agreements = np.concatenate([
+        (argmax_predictions(ensemble_proba, c) == sproba[np.newaxis, :]).sum(axis=1) for c in np.array_split(candidates, max(1, n_blocks))
+    ])
+
+    # A stable sort keeps the order of the candidates for ties just as sorted does in drep
+    K = int(np.ceil(rho * len(candidates)))
+    top = np.sort(np.argsort(agreements, kind="stable")[:K])
+
+    scores = np.full(len(candidates), np.inf)
+    scores[top] = error_incremental(np.asarray(candidates)[top], ensemble_proba, selected_models, target, sub_proba)
+    return scores
+
+drep.round = drep_round
+
 class GreedyPruningClassifier(PruningClassifier):
     ''' Greedy / Ordering-based pruning. 
     
@@ -135,6 +214,35 @@ class GreedyPruningClassifier(PruningClassifier):
             return (pred.argmax(axis=1) != target).mean() 
     ```
 
+    Calling the metric once per candidate and round re-computes the sub-ensemble's prediction over and over again. Thus, a metric can additionally offer an incremental form which scores all remaining candidates at once. The incremental form is stored as attribute `incremental` on the metric and receives 5 parameters:
+
+    - `candidates` (numpy array of ints): The classifiers which should be rated
+    - `ensemble_proba` (A (M, N, C) matrix ): All N predictions of all M classifier in the entire ensemble for all C classes
+    - `selected_models` (list of ints): All models which are selected so far
+    - `target` (numpy array): A numpy array of class targets.
+    - `sub_proba` (A (N, C) matrix): The running sum of the predictions of all selected models, i.e. `ensemble_proba[selected_models].sum(axis=0)`. This matrix is updated once per round and must not be changed by the metric.
+
+    It returns a numpy array with one score per candidate. For the error above this is
+
+    ```Python
+        def error_incremental(candidates, ensemble_proba, selected_models, target, sub_proba):
+            pred = ensemble_proba[candidates, :, :] + sub_proba[np.newaxis, :, :]
+            return (pred.argmax(axis=2) != target[np.newaxis, :]).mean(axis=1)
+        
+        error.incremental = error_incremental
+    ```
+
+    If a metric offers an incremental form it is used automatically. Candidates are scored in chunks so that at most `chunk_size` (M, N, C) entries are materialized at once per job.
+
+    Some metrics score a candidate relative to all other remaining candidates. For example, `drep` ranks all candidates by their diversity and only considers the most diverse ones. These metrics can offer a round form, which is stored as attribute `round` on the metric. It receives the same parameters as the incremental form, but is called only once per round with all remaining candidates.
+
+    By default, all remaining candidates are scored in each round (`strategy = "exhaustive"`). For large ensembles two cheaper strategies are available:
+
+    - `strategy = "lazy"`: Lazy greedy selection (Minoux 1978). The gain of a candidate is its score minus the score of the current sub-ensemble. For submodular metrics the gain of a candidate can only grow over the rounds, so that a gain computed in an earlier round is a lower bound of its current gain. All candidates are kept in a priority queue of these bounds and only the top candidates are re-scored until the best candidate has an up-to-date gain. The stale gains are only valid bounds for submodular metrics, for which this selects the same ensemble as the exhaustive search. **None of the metrics of this module is submodular**, including `error` and `complementariness`. For them, the lazy strategy can end with a worse sub-ensemble. For example, on a 128 tree forest on digits with 16 selected trees, `error` ended at 0.091 on the pruning set compared to 0.081 for the exhaustive search. Use it only for your own submodular metrics or compare its result against the exhaustive search by pruning the same ensemble with `strategy = "exhaustive"` and comparing `scores_` (the score of each round) and `n_evaluations_` (the number of metric evaluations) of both pruners.
+    - `strategy = "stochastic"`: Stochastic greedy selection (Mirzasoleiman et al. 2015). In each round only a random subset of (M / n_estimators) * log(1 / epsilon) candidates is scored.
+
+    The number of metric evaluations is stored in `n_evaluations_` and the score of the selected candidate of each round in `scores_`, so that the different strategies can be compared against each other.
+
     Attributes
     ----------
     n_estimators : int, default is 5
@@ -142,9 +250,23 @@ class GreedyPruningClassifier(PruningClassifier):
     metric : function, default is error
         A function that assigns a score (smaller is better) to each classifier which is then used for selecting the next classifier in each round
     n_jobs : int, default is 8
-        The number of threads used for computing the individual metrics for each classifier.
+        The number of threads used for computing the individual metrics for each classifier and the predictions of the estimators.
+    chunk_size : int, default is 2**24
+        The maximum number of prediction entries (candidates x N x C) scored at once by a single job of an incremental metric.
+    backend : str, default is "threading"
+        The joblib backend used for evaluating the metric, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
+    strategy : str, default is "exhaustive"
+        The greedy selection strategy. Should be one of `{"exhaustive", "lazy", "stochastic"}`. "lazy" is only exact for submodular metrics, which the metrics of this module are not.
+    epsilon : float, default is 0.01
+        The approximation parameter of the stochastic strategy. Smaller values score more candidates per round.
+    seed : int, default is None
+        The random seed used by the stochastic strategy.
+    n_evaluations_ : int
+        The total number of metric evaluations (one per candidate and score) during pruning.
+    scores_ : list of floats
+        The score of the selected candidate in each round.
     '''
-    def __init__(self, n_estimators = 5, metric = error, n_jobs = 8, **kwargs):
+    def __init__(self, n_estimators = 5, metric = error, n_jobs = 8, chunk_size = 2**24, backend = "threading", strategy = "exhaustive", epsilon = 0.01, seed = None, **kwargs):
         """
         Creates a new GreedyPruningClassifier.
 
@@ -156,41 +278,161 @@ class GreedyPruningClassifier(PruningClassifier):
         metric : function, default is error
             A function that assigns a score (smaller is better) to each classifier which is then used for selecting the next classifier in each round
         n_jobs : int, default is 8
-            The number of threads used for computing the individual metrics for each classifier.
+            The number of threads used for computing the individual metrics for each classifier and the predictions of the estimators.
+        chunk_size : int, default is 2**24
+            The maximum number of prediction entries (candidates x N x C) scored at once by a single job of an incremental metric.
+        backend : str, default is "threading"
+            The joblib backend used for evaluating the metric, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
+        strategy : str, default is "exhaustive"
+            The greedy selection strategy. "exhaustive" scores all remaining candidates in each round, "stochastic" a random subset of them and "lazy" only re-scores the candidates with the best outdated gains. "lazy" is only exact for submodular metrics, which the metrics of this module (e.g. `error`) are not. Should be one of `{"exhaustive", "lazy", "stochastic"}`.
+        epsilon : float, default is 0.01
+            The approximation parameter of the stochastic strategy. Smaller values score more candidates per round.
+        seed : int, default is None
+            The random seed used by the stochastic strategy.
         kwargs : 
             Any additional kwargs are directly supplied to the metric function via a partial
         """
-        super().__init__()
+        super().__init__(backend = backend)
 
         assert metric is not None, "You did not provide a valid metric for model selection. Please do so"
+        assert chunk_size >= 1, "chunk_size must be at-least 1"
+        assert strategy in ["exhaustive", "lazy", "stochastic"], "Currently only the strategies {{exhaustive, lazy, stochastic}} are supported, but you provided: {}".format(strategy)
+        assert 0 < epsilon < 1, "epsilon must be from (0,1)"
         self.n_estimators = n_estimators
         self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.strategy = strategy
+        self.epsilon = epsilon
+        self.seed = seed
 
         if len(kwargs) > 0:
             self.metric = partial(metric, **kwargs)
         else:
             self.metric = metric
 
-    # I assume that Parallel keeps the order of evaluations regardless of its backend (see eg. https://stackoverflow.com/questions/56659294/does-joblib-parallel-keep-the-original-order-of-data-passed)
-    # But for safty measures we also return the index of the current model
-    def _metric(self, i, ensemble_proba, selected_models, target):
-        return (i, self.metric(i, ensemble_proba, selected_models, target))
+    def _chunks(self, candidates, proba):
+        # Split the candidates so that each job scores at most chunk_size entries at once, but use at-least one chunk per job
+        entries_per_model = max(1, np.prod(proba.shape[1:]))
+        models_per_chunk = max(1, self.chunk_size // entries_per_model)
+        n_chunks = max(effective_n_jobs(self.n_jobs), int(np.ceil(len(candidates) / models_per_chunk)))
+        n_chunks = min(n_chunks, len(candidates))
+        return np.array_split(candidates, n_chunks)
+
+    def _select_exhaustive(self, score, select, n_received):
+        not_seleced_models = np.arange(n_received)
+        for _ in range(self.n_estimators):
+            scores = score(not_seleced_models)
+            best = int(np.argmin(scores))
+            select(not_seleced_models[best], scores[best])
+            not_seleced_models = np.delete(not_seleced_models, best)
+
+    def _select_stochastic(self, score, select, n_received):
+        rng = np.random.RandomState(self.seed)
+        n_samples = int(np.ceil(n_received / self.n_estimators * np.log(1.0 / self.epsilon)))
+        not_seleced_models = np.arange(n_received)
+        for _ in range(self.n_estimators):
+            if n_samples < len(not_seleced_models):
+                candidates = np.sort(rng.choice(not_seleced_models, size=n_samples, replace=False))
+            else:
+                candidates = not_seleced_models
+            scores = score(candidates)
+            best = int(np.argmin(scores))
+            select(candidates[best], scores[best])
+            not_seleced_models = not_seleced_models[not_seleced_models != candidates[best]]
+
+    def _select_lazy(self, score, select, n_received):
+        # The first model has no meaningful gain, hence it is selected exhaustively. Afterwards, the queue holds (gain, model, round) where gain is the gain of model computed in the given round. Ties are broken by the model index as in the exhaustive search
+        scores = score(np.arange(n_received))
+        best = int(np.argmin(scores))
+        current_score = scores[best]
+        select(best, current_score)
+
+        not_seleced_models = np.delete(np.arange(n_received), best)
+        queue = [(s - current_score, i, 1) for i, s in zip(not_seleced_models, score(not_seleced_models))]
+        heapq.heapify(queue)
+        n_batch = effective_n_jobs(self.n_jobs)
+
+        for r in range(1, self.n_estimators):
+            while queue[0][2] != r:
+                # Re-score the top candidates with outdated gains at once, but stop at the first up-to-date candidate
+                stale = []
+                while len(queue) > 0 and queue[0][2] != r and len(stale) < n_batch:
+                    stale.append(heapq.heappop(queue)[1])
+                for i, s in zip(stale, score(np.array(stale))):
+                    heapq.heappush(queue, (s - current_score, i, r))
+
+            gain, best, _ = heapq.heappop(queue)
+            current_score += gain
+            select(best, current_score)
+
+    def _requires_window(self):
+        # The greedy selection depends on the predictions of the already selected models on each example, so there is no summary statistic and the predictions of each chunk are kept
+        return True
+
+    def _update_stream(self, state, proba, target, data):
+        return (state or []) + [(np.asarray(proba), np.asarray(target))]
+
+    def _merge_stream(self, state, other):
+        return state + other
+
+    def _prune_stream(self, state):
+        proba = np.concatenate([p for p, _ in state], axis=1)
+        target = np.concatenate([t for _, t in state])
+        return self.prune_(proba, target)
 
     def prune_(self, proba, target, data = None):
         n_received = len(proba)
         if self.n_estimators >= n_received:
             return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
 
-        not_seleced_models = list(range(n_received))
+        target = np.asarray(target)
+        incremental = vectorized_metric(self.metric, "incremental")
+        round_metric = vectorized_metric(self.metric, "round")
+        assert round_metric is None or self.strategy != "lazy", "The lazy strategy cannot be used with metrics that score all candidates of a round at once, e.g. drep"
         selected_models = [ ]
-
-        for _ in range(self.n_estimators):
-            scores = Parallel(n_jobs=self.n_jobs, backend="threading")(
-                delayed(self._metric) ( i, proba, selected_models, target) for i in not_seleced_models
-            )
-
-            best_model, _ = min(scores, key = lambda e: e[1])
-            not_seleced_models.remove(best_model)
-            selected_models.append(best_model)
-
-        return selected_models, [1.0 / len(selected_models) for _ in selected_models]
\ No newline at end of file
+        self.scores_ = [ ]
+        self.n_evaluations_ = 0
+
+        # Incremental and round metrics receive the running sum of the predictions of all selected models
+        sub_proba = np.zeros(proba.shape[1:], dtype=proba.dtype) if incremental is not None or round_metric is not None else None
+
+        # The start and the number of evaluations at the start of the current round, see stats_
+        current_round = {"start" : time.perf_counter(), "n_evaluations" : 0}
+
+        # The workers are re-used for all rounds, both for the incremental form and for the plain metric
+        with Parallel(n_jobs=self.n_jobs, backend=self.backend) as parallel:
+            def score(candidates):
+                self.n_evaluations_ += len(candidates)
+                if round_metric is not None:
+                    self.stats_.n_metric_evaluations += len(candidates)
+                    return round_metric(candidates, proba, selected_models, target, sub_proba)
+                elif incremental is not None:
+                    self.stats_.n_metric_evaluations += len(candidates)
+                    scores = parallel(
+                        delayed(incremental) (c, proba, selected_models, target, sub_proba) for c in self._chunks(candidates, proba)
+                    )
+                    return np.concatenate(scores)
+                else:
+                    # Parallel keeps the order of evaluations regardless of its backend (see eg. https://stackoverflow.com/questions/56659294/does-joblib-parallel-keep-the-original-order-of-data-passed)
+                    return np.array(self._evaluate_metric(self.metric, [(i,) for i in candidates], proba, selected_models, target, parallel=parallel))
+
+            def select(best, best_score):
+                selected_models.append(int(best))
+                self.scores_.append(float(best_score))
+                if sub_proba is not None:
+                    sub_proba[...] += proba[best, :, :]
+
+                self._event("round", {
+                    "round" : len(selected_models) - 1, "model" : int(best), "score" : float(best_score), 
+                    "n_evaluations" : self.n_evaluations_ - current_round["n_evaluations"], "duration" : time.perf_counter() - current_round["start"]
+                })
+                current_round["start"], current_round["n_evaluations"] = time.perf_counter(), self.n_evaluations_
+
+            if self.strategy == "lazy":
+                self._select_lazy(score, select, n_received)
+            elif self.strategy == "stochastic":
+                self._select_stochastic(score, select, n_received)
+            else:
+                self._select_exhaustive(score, select, n_received)
+
+        return selected_models, [1.0 / len(selected_models) for _ in selected_models]
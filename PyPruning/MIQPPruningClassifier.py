@@ -1,15 +1,222 @@
 from functools import partial
+import time
 import numpy as np
 from sklearn import metrics
 import cvxpy as cp
 from cvxpy import atoms
-from joblib import Parallel,delayed
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 from sklearn.metrics import pairwise
 
-from .PruningClassifier import PruningClassifier
+from .PruningClassifier import PruningClassifier, vectorized_metric, metric_representation, update_stream, merge_stream, decay_stream, stream_scores
+from .Storage import LabelPredictions, CHUNK_SIZE
 
 from .RankPruningClassifier import *
 
+# The solvers available in cvxpy which support mixed-integer quadratic programs
+MIQP_SOLVERS = ["CPLEX", "COPT", "GUROBI", "MOSEK", "SCIP", "XPRESS"]
+
+def miqp_solver_installed():
+    ''' Returns True if cvxpy can access a solver which supports mixed-integer quadratic programs. '''
+    return len(set(MIQP_SOLVERS) & set(cp.installed_solvers())) > 0
+
+def time_limit_options(solver, seconds):
+    ''' Returns the keyword arguments for cvxpy's solve which limit the runtime of the given MIQP solver to the given number of seconds. '''
+    if solver in ["GUROBI", "COPT"]:
+        return {"TimeLimit" : seconds}
+    elif solver == "CPLEX":
+        return {"cplex_params" : {"timelimit" : seconds}}
+    elif solver == "MOSEK":
+        return {"mosek_params" : {"MSK_DPAR_OPTIMIZER_MAX_TIME" : seconds, "MSK_DPAR_MIO_MAX_TIME" : seconds}}
+    elif solver == "SCIP":
+        return {"scip_params" : {"limits/time" : seconds}}
+    elif solver == "XPRESS":
+        return {"maxtime" : -max(1, int(np.ceil(seconds)))}
+    return {}
+
+class LowRankMatrix:
+    ''' A symmetric (M,M) matrix whose off-diagonal is given by the low-rank factors U and V and whose diagonal is stored explicitly.
+
+    The matrix is P[i,j] = 0.5 * (U[i] V[j]^T + V[i] U[j]^T) for i != j and P[i,i] = diagonal[i]. It requires O(M * rank) memory and a product P x takes O(M * rank) time. The MIQP solvers only access the pairwise matrix via products, its diagonal and sub-matrices (see `pairwise_block`), so that they can work on a LowRankMatrix instead of the dense (M,M) matrix.
+
+    Attributes
+    ----------
+    U : numpy array
+        The (M,rank) left factor.
+    V : numpy array
+        The (M,rank) right factor.
+    diagonal_ : numpy array
+        The M diagonal entries.
+    '''
+    def __init__(self, U, V, diagonal):
+        self.U = np.asarray(U, dtype=np.float64)
+        self.V = np.asarray(V, dtype=np.float64)
+        self.diagonal_ = np.asarray(diagonal, dtype=np.float64)
+        # The diagonal of the low-rank part which is replaced by diagonal_
+        self.correction_ = self.diagonal_ - (self.U * self.V).sum(axis=1)
+
+    @property
+    def shape(self):
+        return (len(self.diagonal_), len(self.diagonal_))
+
+    @property
+    def nbytes(self):
+        return self.U.nbytes + self.V.nbytes + 2 * self.diagonal_.nbytes
+
+    def diagonal(self):
+        return self.diagonal_
+
+    def add_diagonal(self, value):
+        ''' Returns the LowRankMatrix P + value * I. '''
+        return LowRankMatrix(self.U, self.V, self.diagonal_ + value)
+
+    def __matmul__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        correction = self.correction_ if x.ndim == 1 else self.correction_[:, np.newaxis]
+        return 0.5 * (self.U @ (self.V.T @ x) + self.V @ (self.U.T @ x)) + correction * x
+
+    def block(self, rows, cols):
+        ''' Returns the dense sub-matrix P[rows][:, cols]. '''
+        B = 0.5 * (self.U[rows] @ self.V[cols].T + self.V[rows] @ self.U[cols].T)
+        same = np.asarray(rows)[:, np.newaxis] == np.asarray(cols)[np.newaxis, :]
+        r, c = np.nonzero(same)
+        B[r, c] = self.diagonal_[np.asarray(rows)[r]]
+        return B
+
+    def eigenvalue_bounds(self):
+        ''' Returns a lower and an upper bound of the eigenvalues of P. The low-rank part has at most 2 * rank non-zero eigenvalues, which are computed exactly. The bounds follow from Weyl's inequality for the sum of the low-rank part and the diagonal correction. '''
+        # 0.5 * (U V^T + V U^T) = W B W^T with W = [U V] and B = 0.5 * [[0, I], [I, 0]]. For W = Q R, its non-zero eigenvalues are those of R B R^T
+        rank = self.U.shape[1]
+        R = np.linalg.qr(np.hstack([self.U, self.V]))[1]
+        B = np.zeros((2 * rank, 2 * rank))
+        B[:rank, rank:] = B[rank:, :rank] = 0.5 * np.eye(rank)
+        eigenvalues = np.linalg.eigvalsh(R @ B @ R.T)
+        if R.shape[0] < len(self.diagonal_):
+            eigenvalues = np.append(eigenvalues, 0.0)
+        return eigenvalues.min() + self.correction_.min(), eigenvalues.max() + self.correction_.max()
+
+    def toarray(self):
+        ''' Returns the dense (M,M) matrix. '''
+        P = 0.5 * (self.U @ self.V.T + self.V @ self.U.T)
+        np.fill_diagonal(P, self.diagonal_)
+        return P
+
+def knn_matrix(rows, n, n_neighbors):
+    '''
+    Sparsifies a symmetric (n,n) pairwise matrix by keeping its diagonal and the n_neighbors off-diagonal entries with the largest magnitude in each row. An entry which is kept in row i or in row j is kept in both to keep the matrix symmetric, so that each row has at least n_neighbors off-diagonal entries. The matrix is computed block by block via rows(start, end), which returns the dense rows start,...,end-1. Thus, only O(n * n_neighbors) memory is required.
+
+    Returns
+    -------
+    The sparse matrix as scipy.sparse.csr_matrix
+    '''
+    k = min(n_neighbors, n - 1)
+    block = max(1, CHUNK_SIZE // max(1, 8 * n))
+    diagonal, I, J, values = np.zeros(n), [], [], []
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        B = np.asarray(rows(start, end), dtype=np.float64)
+        r = np.arange(end - start)
+        diagonal[start:end] = B[r, start + r]
+        if k > 0:
+            magnitude = np.abs(B)
+            magnitude[r, start + r] = -1.0
+            cols = np.argpartition(-magnitude, k - 1, axis=1)[:, :k]
+            I.append(np.repeat(np.arange(start, end), k))
+            J.append(cols.ravel())
+            values.append(B[r[:, np.newaxis], cols].ravel())
+
+    P = scipy.sparse.diags(diagonal, format="csr")
+    if k > 0:
+        I, J, values = np.concatenate(I), np.concatenate(J), np.concatenate(values)
+        keys, first = np.unique(np.concatenate([I * n + J, J * n + I]), return_index=True)
+        P = P + scipy.sparse.csr_matrix((np.concatenate([values, values])[first], (keys // n, keys % n)), shape=(n, n))
+    return P
+
+def pairwise_block(P, rows, cols):
+    ''' Returns the dense sub-matrix P[rows][:, cols] of a dense, sparse or low-rank pairwise matrix P. '''
+    if isinstance(P, LowRankMatrix):
+        return P.block(rows, cols)
+    elif scipy.sparse.issparse(P):
+        return P[rows][:, cols].toarray()
+    else:
+        return P[np.ix_(rows, cols)]
+
+def pairwise_column(P, i):
+    ''' Returns the i-th column of a dense, sparse or low-rank pairwise matrix P, which equals its i-th row as P is symmetric. '''
+    if isinstance(P, LowRankMatrix):
+        return P.block(np.array([i]), np.arange(P.shape[0]))[0]
+    elif scipy.sparse.issparse(P):
+        return P.getrow(i).toarray().ravel()
+    else:
+        return P[:, i]
+
+def add_diagonal(P, value):
+    ''' Returns P + value * I for a dense, sparse or low-rank pairwise matrix P. '''
+    if isinstance(P, LowRankMatrix):
+        return P.add_diagonal(value)
+    elif scipy.sparse.issparse(P):
+        return (P + value * scipy.sparse.identity(P.shape[0], format="csr")).tocsr()
+    else:
+        return P + value * np.eye(P.shape[0])
+
+def pairwise_nbytes(P):
+    ''' Returns the number of bytes occupied by a dense, sparse or low-rank pairwise matrix P. '''
+    if scipy.sparse.issparse(P):
+        return P.data.nbytes + P.indices.nbytes + P.indptr.nbytes
+    return P.nbytes
+
+def eigenvalue_bounds(P):
+    ''' Returns a lower and an upper bound of the eigenvalues of a dense, sparse or low-rank pairwise matrix P. For sparse matrices, these are the extreme eigenvalues computed via Lanczos iterations or the Gershgorin bounds if they do not converge. '''
+    if isinstance(P, LowRankMatrix):
+        return P.eigenvalue_bounds()
+    elif scipy.sparse.issparse(P):
+        diagonal = P.diagonal()
+        radius = np.asarray(abs(P).sum(axis=1)).ravel() - np.abs(diagonal)
+        lower, upper = (diagonal - radius).min(), (diagonal + radius).max()
+        try:
+            # The Gershgorin bounds are often loose, hence the extreme eigenvalues are computed via Lanczos iterations (with a small safety margin). The smallest eigenvalue of P is computed as largest eigenvalue of upper * I - P, which converges much faster. 
+            largest = scipy.sparse.linalg.eigsh(P, k=1, which="LA", tol=1e-6, return_eigenvectors=False)[0]
+            flipped = scipy.sparse.linalg.LinearOperator(P.shape, matvec=lambda x: upper * x - P @ x, dtype=np.float64)
+            smallest = upper - scipy.sparse.linalg.eigsh(flipped, k=1, which="LA", tol=1e-6, return_eigenvectors=False)[0]
+            margin = 1e-5 * max(1.0, abs(upper))
+            return max(lower, smallest - margin), min(upper, largest + margin)
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            return lower, upper
+    else:
+        eigenvalues = scipy.linalg.eigvalsh(P)
+        return eigenvalues.min(), eigenvalues.max()
+
+def psd_shift(P):
+    ''' Returns the smallest shift s >= 0 (up to a small margin) so that P + s * I is positive semi-definite. For sparse and low-rank matrices, the shift is derived from a lower bound of the smallest eigenvalue (see `eigenvalue_bounds`) and thus might be larger. '''
+    if not isinstance(P, np.ndarray):
+        margin = 1e-9 * max(1.0, np.abs(P.diagonal()).max())
+        return max(0.0, margin - float(eigenvalue_bounds(P)[0]))
+
+    margin = 1e-9 * max(1.0, np.abs(P).max())
+    try:
+        # A Cholesky decomposition is much cheaper than computing the smallest eigenvalue and succeeds for most pairwise matrices, which are Gram matrices
+        np.linalg.cholesky(P + margin * np.eye(len(P)))
+        return margin
+    except np.linalg.LinAlgError:
+        return max(0.0, margin - float(scipy.linalg.eigh(P, subset_by_index=[0, 0], eigvals_only=True)[0]))
+
+def capped_simplex_projection(v, k):
+    ''' Projects v onto {w in [0,1]^M : sum(w) = k}. The projection is clip(v - tau, 0, 1) for the threshold tau with sum k, which is found by bisection. '''
+    lower, upper = v.min() - 1.0, v.max()
+    for _ in range(100):
+        tau = 0.5 * (lower + upper)
+        if np.clip(v - tau, 0.0, 1.0).sum() > k:
+            lower = tau
+        else:
+            upper = tau
+    return np.clip(v - 0.5 * (lower + upper), 0.0, 1.0)
+
+def subset_objective(idx, q, P, alpha):
+    ''' Computes the MIQP objective (1 - alpha) * q^T w + alpha * w^T P w of the selection w given by the indices idx. '''
+    idx = np.asarray(idx, dtype=np.int64)
+    return float((1.0 - alpha) * q[idx].sum() + alpha * pairwise_block(P, idx, idx).sum())
+
 def combined(i, j, ensemble_proba, target, weights = [1.0 / 5.0 for _ in range(5)]):
     '''
     Computes a (weighted) combination of 5 different measures for a pair of classifiers. The original paper also optimizes the weights of this combination using an evolutionary approach and cross-validation. Per default, we use equal weights here. If you want to change this value you can use `partial` to set the weights to different values (e.g. [0.1, 0.1, 0.1, 0.5, 0.2]) before creating a new MIQPPruningClassifier:
@@ -80,6 +287,50 @@ def combined(i, j, ensemble_proba, target, weights = [1.0 / 5.0 for _ in range(5
     # all weighted; disagreement times (-1) so that all metrics are minimized
     return weights[0] * (dis * -1.0) + weights[1] * Q + weights[2] * rho + weights[3] * kappa + weights[4] * df
 
+def combined_rows(predictions, target, start, end, weights = [1.0 / 5.0 for _ in range(5)]):
+    '''
+    Computes the rows start,...,end-1 of `combined_matrix`, which only requires O((end - start) * M) memory.
+    '''
+    m = predictions.shape[1]
+    n_correct = predictions.n_correct().astype(np.float64)
+
+    a = predictions.co_correct(start, end).astype(np.float64)
+    b = n_correct[start:end,np.newaxis] - a
+    c = n_correct[np.newaxis,:] - a
+    d = m - a - b - c
+
+    # 1) disagreement measure 
+    dis = (b+c) / m
+
+    # 2) qstatistic
+    Q_denom = (a*d) + (b*c)
+    Q = ((a*d) - (b*c)) / np.where(Q_denom == 0, 1.0, Q_denom)
+
+    # 3) correlation measure
+    rho_denom = (a+b)*(a+c)*(c+d)*(b+d)
+    rho = ((a*d) - (b*c)) / np.where(rho_denom == 0, 0.001, np.sqrt(rho_denom))
+
+    # 4) kappa statistic
+    kappa1 = (a+d) / m
+    kappa2 = ( ((a+b)*(a+c)) + ((c+d)*(b+d)) ) / (m*m)
+    kappa2[kappa2 == 1] -= 0.001
+    kappa = (kappa1 - kappa2) / (1 - kappa2)
+
+    # 5) doublefault measure
+    df = d / m
+
+    return weights[0] * (dis * -1.0) + weights[1] * Q + weights[2] * rho + weights[3] * kappa + weights[4] * df
+
+def combined_matrix(predictions, target, weights = [1.0 / 5.0 for _ in range(5)]):
+    '''
+    Matrix version of `combined` which computes the values of all pairs at once. The counts a, b, c and d of all pairs are derived from the number of common correct predictions, which are computed via popcounts over the correctness bitsets.
+    '''
+    return combined_rows(predictions, target, 0, predictions.shape[0], weights)
+
+combined_matrix.stream = "pairwise"
+combined.matrix = combined_matrix
+combined.rows = combined_rows
+
 # # Paper:   Effective pruning of neural network classifier ensembles
 # # Authors: Lazarevic et al. 2001
 # #
@@ -135,6 +386,46 @@ def combined_error(i, j, ensemble_proba, target):
         combined = ierr * jerr
         return 0.5 * (combined / Gi + combined / Gj).sum()
 
+def combined_error_matrix(predictions, target):
+    '''
+    Matrix version of `combined_error` which computes the values of all pairs at once. The pairwise errors are computed via popcounts over the error bitsets, which is the same as the Gram matrix E E^T of the (M,N) error matrix E. Classifiers without any error do not have any pairwise errors and thus receive 0 on the off-diagonal.
+    '''
+    return combined_error_rows(predictions, target, 0, predictions.shape[0])
+
+def _n_errors(predictions):
+    # The number of errors of each classifier, which is the diagonal of co_errors()
+    return predictions.shape[1] - predictions.n_correct().astype(np.float64)
+
+def combined_error_rows(predictions, target, start, end):
+    '''
+    Computes the rows start,...,end-1 of `combined_error_matrix`, which only requires O((end - start) * M) memory.
+    '''
+    n_errors = _n_errors(predictions)
+    G = n_errors.copy()
+    G[G == 0] = 1.0
+
+    co_errors = predictions.co_errors(start, end).astype(np.float64)
+    P = 0.5 * (co_errors / G[start:end,np.newaxis] + co_errors / G[np.newaxis,:])
+    rows = np.arange(end - start)
+    P[rows, start + rows] = n_errors[start:end] / predictions.shape[1]
+    return P
+
+def combined_error_factors(predictions, target, rank):
+    '''
+    Low-rank version of `combined_error_matrix`. The pairwise errors are the Gram matrix E E^T of the (M,N) error matrix E, which is approximated by A A^T with a (M,rank) matrix A (see `Storage.LabelPredictions.error_factors`). Since P[i,j] = 0.5 * (E E^T)[i,j] * (1 / G[i] + 1 / G[j]), the off-diagonal of P is 0.5 * (U V^T + V U^T) with U = diag(1 / G) A and V = A. The diagonal is exact.
+    '''
+    n_errors = _n_errors(predictions)
+    G = n_errors.copy()
+    G[G == 0] = 1.0
+
+    A = predictions.error_factors(rank)
+    return LowRankMatrix(A / G[:,np.newaxis], A, n_errors / predictions.shape[1])
+
+combined_error_matrix.stream = "pairwise"
+combined_error.matrix = combined_error_matrix
+combined_error.rows = combined_error_rows
+combined_error.factors = combined_error_factors
+
     # if i == j:
     #     return (ierr*jerr).mean()
     # else:
@@ -193,10 +484,28 @@ class MIQPPruningClassifier(PruningClassifier):
     
     If you set `alpha = 0` or choose the pairwise metric that simply returns 0 a MIQPPruningClassifier should produce the same solution as a RankPruningClassifier does. 
 
+    Calling the pairwise_metric for each of the M(M+1)/2 pairs is slow for larger ensembles. Thus, a pairwise_metric can additionally offer a matrix form which computes the entire (M,M) matrix at once. The matrix form is stored as attribute `matrix` on the pairwise_metric and receives two parameters:
+
+    - `predictions` (`Storage.LabelPredictions`): The class predictions (argmax of ensemble_proba) of all M classifier on all N examples stored as (M,N) matrix `predictions.predictions` and a bitset of correct predictions `predictions.correct`
+    - `target` (numpy array): A numpy array of class targets.
+
+    For example, the number of common errors of each pair can be computed via
+
+    ```Python
+        def co_errors_matrix(predictions, target):
+            return predictions.co_errors()
+    ```
+
+    If the pairwise_metric offers a matrix form it is used automatically. Similarly, the batch form of a single_metric (see RankPruningClassifier) is also used automatically. If all metrics only require the class predictions, the full (M,N,C) prediction tensor is never computed during pruning. If both metrics can be computed chunk by chunk (see `PruningClassifier.metric_stream`), the ensemble can also be pruned on a stream of data via `prune_stream`. This is the case for `combined` and `combined_error`, which only require the pairwise counts of correct predictions.
+
     **Important:** All metrics are _minimized_. If you implement your own metric make sure that it assigns smaller values to better classifiers.
     
     This code uses `cvxpy` to access a wide variety of MQIP solver. For more information on how to configure your solver and interpret its output in case of failures please have a look at the cvxpy documentation https://www.cvxpy.org/tutorial/advanced/index.html#solve-method-options.
 
+    The MIQP is NP-hard and an exact solver can run for a very long time on larger ensembles. If a near-optimal solution is good enough, solver = "relaxation" solves the convex relaxation over w in [0,1]^M with sum(w) = K with any QP solver of cvxpy (e.g. OSQP or Clarabel) and rounds its solution (see `_solve_relaxation`). The objective of the relaxation is a lower bound of the MIQP objective. The difference to the objective of the rounded solution bounds how far it is from the optimum and is reported as gap in `stats_.solver`. Thus, there is also a heuristic solver which only uses numpy: A greedy initialization is improved by swapping selected and non-selected estimators followed by a tabu search (see `_solve_heuristic`). It stops after time_limit seconds and reports the best objective found so far in `stats_.solver` (each new best solution is passed as "incumbent" event to the callback). By default, cvxpy is used if a solver which supports MIQPs is installed (see `MIQP_SOLVERS`) and the heuristic otherwise. When cvxpy is used, the heuristic solution is its starting point (warm start) and the fallback if cvxpy fails or returns a worse solution, e.g. because it hit its time limit. The time which is left of time_limit after the heuristic is passed as time limit to the MIQP solver. 
+
+    The dense (M,M) matrix P requires O(M^2) memory, e.g. 800 MB for M = 10000. For larger ensembles, pairwise_form = "lowrank" stores P as `LowRankMatrix` with rank columns per estimator. This requires a pairwise_metric with a factors form, which receives the LabelPredictions, the target and the rank. For example, `combined_error` approximates the Gram matrix of the error indicators via a randomized eigendecomposition (see `combined_error_factors`). Alternatively, pairwise_form = "knn" only keeps the n_neighbors largest entries (by magnitude) in each row of P as scipy.sparse matrix (see `knn_matrix`). If the pairwise_metric offers a rows form, which receives the LabelPredictions, the target and the range start, end of rows to compute, P is never stored densely. This is the case for `combined` and `combined_error`. Both forms only approximate P, unless rank + 10 >= M or n_neighbors >= M - 1. They are used by the heuristic solver and by solver = "relaxation", which then solves the relaxation via accelerated projected gradient descent using only products with P. Its lower bound is the Frank-Wolfe bound of the last iterate, which is valid for the compact P even if the iterations have not converged. Exact solutions via cvxpy require the dense P.
+
     Attributes
     ----------
     n_estimators : int, default is 5
@@ -212,10 +521,32 @@ class MIQPPruningClassifier(PruningClassifier):
     verbose : boolean, default is False
         If true, more information from the MQIP solver is printed. 
     n_jobs : int, default is 8
-        The number of threads used for computing the metrics. This does not have any effect on the number of threads used by the MQIP solver.
+        The number of threads used for computing the metrics and the predictions of the estimators. This does not have any effect on the number of threads used by the MQIP solver.
+    backend : str, default is "threading"
+        The joblib backend used for evaluating the metrics, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
+    solver : str, default is "auto"
+        The solver of the MIQP. Should be one of {"auto", "cvxpy", "heuristic", "relaxation"}.
+    time_limit : float, default is None
+        The time limit of the heuristic solver in seconds. If None, it stops after tabu_iter non-improving swaps.
+    tabu_iter : int, default is 100
+        The maximum number of non-improving swaps of the tabu search of the heuristic solver. 
+    solver_options : dict, default is None
+        Additional keyword arguments for cvxpy's solve, e.g. {"solver" : "GUROBI", "TimeLimit" : 60}.
+    rounding : str, default is "topk"
+        The rounding of the relaxed solution. Should be one of {"topk", "randomized"}.
+    n_rounding : int, default is 10
+        The number of randomized roundings.
+    seed : int, default is None
+        The random seed of the randomized rounding.
+    pairwise_form : str, default is "dense"
+        The representation of the pairwise matrix P. Should be one of {"dense", "lowrank", "knn"}.
+    rank : int, default is 64
+        The rank of P if pairwise_form = "lowrank".
+    n_neighbors : int, default is 32
+        The number of off-diagonal entries kept per row of P if pairwise_form = "knn".
     '''
 
-    def __init__(self, n_estimators = 5, single_metric = None, pairwise_metric = combined_error, alpha = 1, eps = 1e-2, verbose = False, n_jobs = 8, **kwargs):
+    def __init__(self, n_estimators = 5, single_metric = None, pairwise_metric = combined_error, alpha = 1, eps = 1e-2, verbose = False, n_jobs = 8, backend = "threading", solver = "auto", time_limit = None, tabu_iter = 100, solver_options = None, rounding = "topk", n_rounding = 10, seed = None, pairwise_form = "dense", rank = 64, n_neighbors = 32, **kwargs):
         """ 
         Creates a new MIQPPruningClassifier.
 
@@ -235,14 +566,45 @@ class MIQPPruningClassifier(PruningClassifier):
         verbose : boolean, default is False
             If true, more information from the MQIP solver is printed. 
         n_jobs : int, default is 8
-            The number of threads used for computing the metrics. This does not have any effect on the number of threads used by the MQIP solver.
+            The number of threads used for computing the metrics and the predictions of the estimators. This does not have any effect on the number of threads used by the MQIP solver.
+        backend : str, default is "threading"
+            The joblib backend used for evaluating the metrics, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
+        solver : str, default is "auto"
+            The solver of the MIQP. "cvxpy" solves the MIQP exactly, starting from the solution of the heuristic, "heuristic" only uses the heuristic and "auto" uses cvxpy if a solver which supports MIQPs is installed and the heuristic otherwise. "relaxation" solves the convex relaxation of the MIQP and rounds its solution.
+        time_limit : float, default is None
+            The time limit of the heuristic solver in seconds. If None, it stops after tabu_iter non-improving swaps. If cvxpy is used, the time which is left after the heuristic is passed as time limit to the MIQP solver.
+        tabu_iter : int, default is 100
+            The maximum number of non-improving swaps of the tabu search of the heuristic solver. Use 0 for a pure local search.
+        solver_options : dict, default is None
+            Additional keyword arguments for cvxpy's solve, e.g. {"solver" : "GUROBI", "TimeLimit" : 60}.
+        rounding : str, default is "topk"
+            The rounding of the relaxed solution for solver = "relaxation". "topk" selects the K estimators with the largest relaxed weights and "randomized" draws n_rounding selections of K estimators with probabilities proportional to the relaxed weights. Each rounded selection is repaired by a local search and the best one is kept.
+        n_rounding : int, default is 10
+            The number of randomized roundings.
+        seed : int, default is None
+            The random seed of the randomized rounding.
+        pairwise_form : str, default is "dense"
+            The representation of the pairwise matrix P. "dense" stores the (M,M) matrix, "lowrank" stores a `LowRankMatrix` computed by the factors form of the pairwise_metric and "knn" stores a sparse matrix with the n_neighbors largest entries of each row. The compact forms cannot be used with solver = "cvxpy".
+        rank : int, default is 64
+            The rank of P if pairwise_form = "lowrank".
+        n_neighbors : int, default is 32
+            The number of off-diagonal entries kept per row of P if pairwise_form = "knn".
         kwargs : 
             Any additional kwargs are directly supplied to single_metric function and pairwise_metric function via partials
         """
-        super().__init__()
+        super().__init__(backend = backend)
         
         assert 0 <= alpha <= 1, "l_reg should be from [0,1], but you supplied {}".format(alpha)
         assert eps >= 0, "Eps should be >= 0, but you supplied".format(eps)
+        assert solver in ["auto", "cvxpy", "heuristic", "relaxation"], "Currently only the solvers {{auto, cvxpy, heuristic, relaxation}} are supported, but you provided: {}".format(solver)
+        assert rounding in ["topk", "randomized"], "Currently only the roundings {{topk, randomized}} are supported, but you provided: {}".format(rounding)
+        assert n_rounding >= 1, "n_rounding must be at-least 1"
+        assert time_limit is None or time_limit >= 0, "time_limit must be None or >= 0"
+        assert tabu_iter >= 0, "tabu_iter must be >= 0"
+        assert pairwise_form in ["dense", "lowrank", "knn"], "Currently only the pairwise forms {{dense, lowrank, knn}} are supported, but you provided: {}".format(pairwise_form)
+        assert pairwise_form == "dense" or solver != "cvxpy", "solver = 'cvxpy' requires pairwise_form = 'dense'"
+        assert rank >= 1, "rank must be at-least 1"
+        assert n_neighbors >= 0, "n_neighbors must be >= 0"
 
         assert pairwise_metric is not None or single_metric is not None, "You did not provide a single_metric or pairwise_metric. Please provide at-least one of them"
 
@@ -267,55 +629,370 @@ class MIQPPruningClassifier(PruningClassifier):
         self.alpha = alpha
         self.verbose = verbose
         self.eps = eps
+        self.solver = solver
+        self.time_limit = time_limit
+        self.tabu_iter = tabu_iter
+        self.solver_options = solver_options
+        self.rounding = rounding
+        self.n_rounding = n_rounding
+        self.seed = seed
+        self.pairwise_form = pairwise_form
+        self.rank = rank
+        self.n_neighbors = n_neighbors
+
+        if pairwise_form == "lowrank" and self.alpha > 0:
+            assert vectorized_metric(self.pairwise_metric, "factors") is not None, "pairwise_form = 'lowrank' requires a pairwise_metric with a factors form such as combined_error"
+
+    def _representation(self):
+        single_labels = self.alpha == 1 or metric_representation(vectorized_metric(self.single_metric, "batch")) == "labels"
+        pairwise_labels = self.alpha == 0 or vectorized_metric(self.pairwise_metric, "matrix") is not None
+        return "labels" if single_labels and pairwise_labels else "proba"
 
     def prune_(self, proba, target, data = None):
         n_received = len(proba)
         if self.n_estimators >= n_received:
             return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
 
+        # Compute the class predictions at most once, if any metric requires them
+        labels = proba if isinstance(proba, LabelPredictions) else None
+
         if self.alpha < 1:
-            single_scores = Parallel(n_jobs=self.n_jobs, backend="threading")(
-                delayed(self.single_metric) (i, proba, target) for i in range(n_received)
-            )
-            q = np.array(single_scores)
+            batch = vectorized_metric(self.single_metric, "batch")
+            if batch is not None and metric_representation(batch) == "labels":
+                labels = LabelPredictions.from_proba(proba, target) if labels is None else labels
+                q = batch(labels, np.asarray(target))
+                self.stats_.n_metric_evaluations += n_received
+            elif batch is not None:
+                q = batch(proba, np.asarray(target))
+                self.stats_.n_metric_evaluations += n_received
+            else:
+                q = np.array(self._evaluate_metric(self.single_metric, [(i,) for i in range(n_received)], proba, target))
         else:
             q = np.zeros((n_received,1))
 
         if self.alpha > 0:
-            pairwise_scores = Parallel(n_jobs=self.n_jobs, backend="threading")(
-                delayed(self.pairwise_metric) (i, j, proba, target) for i in range(n_received) for j in range(i, n_received)
-            )
-
-            # TODO This is probably easier and quicker with some fancy numpy operations
-            P = np.zeros((n_received,n_received))
-            s = 0
-            for i in range(n_received):
-                for j in range(i, n_received):
-                    if i == j:
-                        P[i,j] = pairwise_scores[s]
-                    else:
-                        P[i,j] = pairwise_scores[s]
-                        P[j,i] = pairwise_scores[s]
-                    s += 1
-            P += self.eps * np.eye(n_received)
+            matrix = vectorized_metric(self.pairwise_metric, "matrix")
+            rows = vectorized_metric(self.pairwise_metric, "rows")
+            if self.pairwise_form == "lowrank":
+                labels = LabelPredictions.from_proba(proba, target) if labels is None else labels
+                P = vectorized_metric(self.pairwise_metric, "factors")(labels, np.asarray(target), self.rank)
+                self.stats_.n_metric_evaluations += n_received
+            elif self.pairwise_form == "knn" and rows is not None:
+                labels = LabelPredictions.from_proba(proba, target) if labels is None else labels
+                P = knn_matrix(lambda start, end: rows(labels, np.asarray(target), start, end), n_received, self.n_neighbors)
+                self.stats_.n_metric_evaluations += n_received * (n_received + 1) // 2
+            elif matrix is not None:
+                labels = LabelPredictions.from_proba(proba, target) if labels is None else labels
+                P = matrix(labels, np.asarray(target))
+                self.stats_.n_metric_evaluations += n_received * (n_received + 1) // 2
+            else:
+                pairwise_scores = self._evaluate_metric(self.pairwise_metric, [(i, j) for i in range(n_received) for j in range(i, n_received)], proba, target)
+
+                # Fill the upper triangle (including the diagonal) row by row and mirror it to the lower triangle
+                P = np.zeros((n_received,n_received))
+                P[np.triu_indices(n_received)] = pairwise_scores
+                P = P + np.triu(P, 1).T
+
+            if self.pairwise_form == "knn" and isinstance(P, np.ndarray):
+                # Without a rows form, the dense matrix is sparsified afterwards
+                P = knn_matrix(lambda start, end: P[start:end], n_received, self.n_neighbors)
+            P = add_diagonal(P, self.eps)
+
+        else:
+            P = self._zero_pairwise(n_received)
+
+        return self._solve(q, P)
+
+    def _zero_pairwise(self, n_received):
+        if self.pairwise_form == "dense":
+            return np.zeros((n_received,n_received))
+        return scipy.sparse.csr_matrix((n_received,n_received))
+
+    def _update_stream(self, state, proba, target, data):
+        q_state, P_state = (None, None) if state is None else state[1:]
+        if self.alpha < 1:
+            q_state = update_stream(q_state, vectorized_metric(self.single_metric, "batch"), proba, target)
+        if self.alpha > 0:
+            P_state = update_stream(P_state, vectorized_metric(self.pairwise_metric, "matrix"), proba, target)
+        return len(proba), q_state, P_state
+
+    def _merge_stream(self, state, other):
+        return state[0], merge_stream(state[1], other[1]), merge_stream(state[2], other[2])
+
+    def _decay_stream(self, state, factor):
+        return state[0], decay_stream(state[1], factor), decay_stream(state[2], factor)
+
+    def _prune_stream(self, state):
+        n_received, q_state, P_state = state
+        if self.n_estimators >= n_received:
+            return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
 
+        if self.alpha < 1:
+            q = stream_scores(q_state, vectorized_metric(self.single_metric, "batch"))
+            self.stats_.n_metric_evaluations += n_received
+        else:
+            q = np.zeros((n_received,1))
+        if self.alpha > 0:
+            assert self.pairwise_form != "lowrank", "pairwise_form = 'lowrank' requires the class predictions and cannot be used on streams. Use pairwise_form = 'knn' instead"
+            rows = vectorized_metric(self.pairwise_metric, "rows")
+            if self.pairwise_form == "knn" and rows is not None:
+                P = knn_matrix(lambda start, end: rows(P_state, None, start, end), n_received, self.n_neighbors)
+            elif self.pairwise_form == "knn":
+                P = stream_scores(P_state, vectorized_metric(self.pairwise_metric, "matrix"))
+                P = knn_matrix(lambda start, end: P[start:end], n_received, self.n_neighbors)
+            else:
+                P = stream_scores(P_state, vectorized_metric(self.pairwise_metric, "matrix"))
+            P = add_diagonal(P, self.eps)
+            self.stats_.n_metric_evaluations += n_received * (n_received + 1) // 2
         else:
-            P = np.zeros((n_received,n_received))
+            P = self._zero_pairwise(n_received)
+        return self._solve(q, P)
+
+    def _solve(self, q, P):
+        ''' Solves the MIQP for the single scores q and the pairwise matrix P with the chosen solver. Returns the indices and weights of the selected estimators, see `prune_`. '''
+        q = np.asarray(q, dtype=np.float64).reshape(-1)
+        if self.pairwise_form == "dense":
+            P = np.asarray(P, dtype=np.float64)
+        solver = self.solver
+        if solver == "auto":
+            solver = "cvxpy" if self.pairwise_form == "dense" and miqp_solver_installed() else "heuristic"
+
+        start = time.perf_counter()
+        if solver == "relaxation":
+            selected, info = self._solve_relaxation(q, P, start)
+        else:
+            selected, objective, status, n_iter = self._solve_heuristic(q, P, start)
+            info = {"solver" : "heuristic", "status" : status, "objective" : float(objective), "n_iter" : n_iter}
+            if solver == "cvxpy":
+                selected, info = self._solve_cvxpy(q, P, selected, info, start)
+        info.update(duration = time.perf_counter() - start, pairwise_form = self.pairwise_form, pairwise_bytes = pairwise_nbytes(P))
+        self._event("solver", info)
+
+        return list(selected), [1.0 / len(selected) for _ in selected]
+
+    def _solve_heuristic(self, q, P, start):
+        ''' 
+        Solves the MIQP heuristically. The solution is initialized greedily and then improved by `_swap_search`. The greedy initialization is always finished, so that a feasible solution is returned even if time_limit is exceeded. 
+
+        Returns the indices of the best selection found, its objective, the status ("converged" or "time_limit") and the number of swaps.
+        '''
+        n_received, alpha = P.shape[0], self.alpha
+        a = (1.0 - alpha) * q
+        diag = P.diagonal()
+
+        # g[i] is the sum of P[i,j] over all selected j. Adding i to the selection changes the objective by a[i] + alpha * (P[i,i] + 2 g[i])
+        selected = np.zeros(n_received, dtype=bool)
+        g = np.zeros(n_received)
+        for _ in range(self.n_estimators):
+            gain = a + alpha * (diag + 2.0 * g)
+            gain[selected] = np.inf
+            i = int(np.argmin(gain))
+            selected[i] = True
+            g += pairwise_column(P, i)
+
+        return self._swap_search(q, P, selected, start, self.tabu_iter)
+
+    def _swap_search(self, q, P, selected, start, tabu_iter):
+        '''
+        Improves the selection (a boolean mask) by swapping a selected with a non-selected estimator as long as this improves the objective (best-improvement local search). Once no swap improves the objective, a tabu search continues with the best swap which does not move a recently swapped estimator (unless it leads to a new best solution) for at most tabu_iter non-improving swaps. The search stops early once time_limit is exceeded.
+
+        Returns the indices of the best selection found, its objective, the status ("converged" or "time_limit") and the number of swaps.
+        '''
+        n_received, alpha = P.shape[0], self.alpha
+        a = (1.0 - alpha) * q
+        diag = P.diagonal()
+        deadline = None if self.time_limit is None else start + self.time_limit
+        tol = 1e-9 * max(1.0, np.abs(diag).max(), np.abs(a).max())
+
+        selected = selected.copy()
+        g = P @ selected.astype(np.float64)
+        objective = a[selected].sum() + alpha * g[selected].sum()
+        best, best_objective = selected.copy(), objective
+        self._event("incumbent", {"objective" : float(best_objective), "time" : time.perf_counter() - start})
+
+        tenure = max(1, min(self.n_estimators, n_received - self.n_estimators) // 2)
+        tabu_until = np.zeros(n_received, dtype=np.int64)
+        n_iter, n_tabu, status = 0, 0, "converged"
+        while deadline is None or time.perf_counter() < deadline:
+            inside, outside = np.flatnonzero(selected), np.flatnonzero(~selected)
+            if len(outside) == 0:
+                break
+
+            # The change of the objective for swapping inside[r] with outside[c]
+            remove = -a[inside] - alpha * (2.0 * g[inside] - diag[inside])
+            add = a[outside] + alpha * (2.0 * g[outside] + diag[outside])
+            delta = remove[:, np.newaxis] + add[np.newaxis, :] - 2.0 * alpha * pairwise_block(P, inside, outside)
+
+            tabu = (tabu_until[inside] > n_iter)[:, np.newaxis] | (tabu_until[outside] > n_iter)[np.newaxis, :]
+            delta[tabu & (objective + delta >= best_objective - tol)] = np.inf
+            r, c = np.unravel_index(np.argmin(delta), delta.shape)
+            if not np.isfinite(delta[r, c]):
+                break
+            if delta[r, c] >= -tol:
+                if n_tabu >= tabu_iter:
+                    break
+                n_tabu += 1
+
+            i, j = inside[r], outside[c]
+            selected[i], selected[j] = False, True
+            g += pairwise_column(P, j) - pairwise_column(P, i)
+            objective += delta[r, c]
+            tabu_until[i] = tabu_until[j] = n_iter + 1 + tenure
+            n_iter += 1
+
+            if objective < best_objective - tol:
+                best, best_objective = selected.copy(), objective
+                self._event("incumbent", {"objective" : float(best_objective), "time" : time.perf_counter() - start})
+        else:
+            status = "time_limit"
+
+        best = np.flatnonzero(best)
+        return best, subset_objective(best, q, P, alpha), status, n_iter
+
+    def _solve_relaxation(self, q, P, start):
+        '''
+        Solves the convex relaxation of the MIQP over w in [0,1]^M with sum(w) = K and rounds its solution. Each rounded selection is repaired by a local search (see `_swap_search`) and the best one is kept. The relaxation is convex if P is positive semi-definite. Otherwise, the smallest eigenvalue is subtracted from the diagonal of P, which does not change the MIQP since w^T w = K for all feasible w. A dense P is passed to a QP solver of cvxpy (see `_relax_cvxpy`), whereas a sparse or low-rank P is only accessed via products (see `_relax_gradient`). If the QP cannot be solved, the heuristic solver is used instead.
+
+        Returns the indices of the selected estimators and the solver info with the objective of the relaxation (relaxed_objective), which is a lower bound of the MIQP objective, and the absolute and relative gap between the objective and this bound.
+        '''
+        n_received, alpha = P.shape[0], self.alpha
+        shift = psd_shift(P) if alpha > 0 else 0.0
+
+        if isinstance(P, np.ndarray):
+            relaxation = self._relax_cvxpy(q, P, shift)
+        else:
+            relaxation = self._relax_gradient(q, P, shift, start)
+        x, relaxed_objective, qp_solver, qp_status = relaxation
+        if x is None:
+            selected, objective, status, n_iter = self._solve_heuristic(q, P, start)
+            return selected, {"solver" : "heuristic", "qp_solver" : qp_solver, "status" : "the relaxation could not be solved ({}), using the heuristic solution".format(qp_status), "objective" : float(objective), "n_iter" : n_iter}
+        if self.rounding == "topk":
+            roundings = [np.argsort(-x, kind="stable")[:self.n_estimators]]
+        else:
+            rng = np.random.RandomState(self.seed)
+            p = (x + 1e-12) / (x + 1e-12).sum()
+            roundings = [rng.choice(n_received, size=self.n_estimators, replace=False, p=p) for _ in range(self.n_rounding)]
+
+        best, best_objective, status, n_iter = None, np.inf, "converged", 0
+        for idx in roundings:
+            mask = np.zeros(n_received, dtype=bool)
+            mask[idx] = True
+            selected, objective, status, n_repair = self._swap_search(q, P, mask, start, 0)
+            n_iter += n_repair
+            if objective < best_objective:
+                best, best_objective = selected, objective
+
+        relaxed_objective = relaxed_objective - alpha * shift * self.n_estimators
+        gap = best_objective - relaxed_objective
+        return best, {
+            "solver" : "relaxation", "qp_solver" : qp_solver, "status" : qp_status, "objective" : best_objective, "n_iter" : n_iter,
+            "relaxed_objective" : relaxed_objective, "gap" : gap, "relative_gap" : gap / max(abs(relaxed_objective), 1e-12)
+        }
+
+    def _relax_cvxpy(self, q, P, shift):
+        ''' Solves the relaxation for the dense P + shift * I with cvxpy. Returns the relaxed solution, its objective, the name of the QP solver and its status. If the QP cannot be solved, the relaxed solution is None and the status describes the failure. '''
+        n_received, alpha = P.shape[0], self.alpha
+        w = cp.Variable(n_received)
+        objective = (1.0 - alpha) * q @ w
+        if alpha > 0:
+            objective = objective + alpha * cp.quad_form(w, cp.psd_wrap(P + shift * np.eye(n_received)))
+        prob = cp.Problem(cp.Minimize(objective), [w >= 0, w <= 1, cp.sum(w) == self.n_estimators])
+        options = {} if self.solver_options is None else self.solver_options
+        try:
+            prob.solve(verbose=self.verbose, **options)
+        except cp.error.SolverError:
+            return None, None, options.get("solver"), "cvxpy failed with SolverError"
+        if w.value is None:
+            return None, None, prob.solver_stats.solver_name, "cvxpy returned no solution ({})".format(prob.status)
+        return np.clip(w.value, 0.0, 1.0), float(prob.value), prob.solver_stats.solver_name, prob.status
+
+    def _relax_gradient(self, q, P, shift, start, max_iter = 1000, tol = 1e-6):
+        ''' 
+        Solves the relaxation for the sparse or low-rank P + shift * I via accelerated projected gradient descent (FISTA) with step size 1 / L, where L is an upper bound of the eigenvalues of the Hessian (see `eigenvalue_bounds`). Each iteration requires one product with P and one projection onto the feasible set (see `capped_simplex_projection`). The objective of the relaxation is bounded from below via the Frank-Wolfe bound f(x) + min_s grad f(x)^T (s - x), where the minimum over the feasible set selects the K smallest entries of the gradient. This bound is valid for any feasible x. The iterations stop once the gap between f(x) and the best bound is below tol (relative to f(x)), after max_iter iterations or once time_limit is exceeded.
+
+        Returns the relaxed solution, the best lower bound of the relaxation, the name of the QP solver and its status.
+        '''
+        n_received, alpha, K = P.shape[0], self.alpha, self.n_estimators
+        deadline = None if self.time_limit is None else start + self.time_limit
+        a = (1.0 - alpha) * q
+        L = 2.0 * alpha * (max(0.0, eigenvalue_bounds(P)[1]) + shift) if alpha > 0 else 0.0
+        L = L if L > 0 else 1.0
+
+        def gradient(w):
+            Pw = P @ w + shift * w
+            return a + 2.0 * alpha * Pw, a @ w + alpha * w @ Pw
+
+        x = y = np.full(n_received, K / n_received)
+        t, lower_bound, status = 1.0, -np.inf, "max_iter"
+        for it in range(max_iter):
+            x_next = capped_simplex_projection(y - gradient(y)[0] / L, K)
+            t_next = 0.5 * (1.0 + np.sqrt(1.0 + 4.0 * t * t))
+            y = x_next + ((t - 1.0) / t_next) * (x_next - x)
+            x, t = x_next, t_next
+
+            grad, objective = gradient(x)
+            lower_bound = max(lower_bound, objective + np.partition(grad, K - 1)[:K].sum() - grad @ x)
+            if objective - lower_bound <= tol * max(1.0, abs(objective)):
+                status = "optimal"
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                status = "time_limit"
+                break
+        return x, float(lower_bound), "projected_gradient", status
+
+    def _solve_cvxpy(self, q, P, selected, info, start):
+        ''' 
+        Solves the MIQP with cvxpy, starting from the heuristic solution selected. As in `_solve_relaxation`, P is shifted to be positive semi-definite, which only adds a constant to the objective of all feasible w. If time_limit is set, the time which is left after the heuristic is passed as time limit to the MIQP solver (see `time_limit_options`). Returns the better of both solutions and the updated solver info. 
+        '''
+        n_received = P.shape[0]
+        info = dict(info, heuristic_objective = info["objective"])
+        options = {} if self.solver_options is None else dict(self.solver_options)
+        if self.time_limit is not None:
+            remaining = self.time_limit - (time.perf_counter() - start)
+            if remaining <= 0:
+                info["status"] = "time_limit reached by the heuristic, using the heuristic solution"
+                return selected, info
+            installed = [s for s in MIQP_SOLVERS if s in cp.installed_solvers()]
+            if "solver" not in options and len(installed) > 0:
+                options["solver"] = installed[0]
+            options = dict(time_limit_options(options.get("solver"), remaining), **options)
 
         w = cp.Variable(n_received, boolean=True)
-        
+        if self.alpha > 0:
+            quadratic = cp.quad_form(w, cp.psd_wrap(P + psd_shift(P) * np.eye(n_received)))
+
         if self.alpha == 1:
-            objective = cp.quad_form(w, P) 
+            objective = quadratic
         elif self.alpha == 0:
             objective = q.T @ w
         else:
-            objective = cp.pos((1.0 - self.alpha)) * q.T @ w + cp.pos(self.alpha) * cp.quad_form(w, P)
+            objective = cp.pos((1.0 - self.alpha)) * q.T @ w + cp.pos(self.alpha) * quadratic
 
         prob = cp.Problem(cp.Minimize(objective), [
             atoms.affine.sum.sum(w) == self.n_estimators,
         ]) 
-        prob.solve(verbose=self.verbose)
-        selected = [i for i in range(n_received) if w.value[i]]
-        weights = [1.0/len(selected) for _ in selected]
 
-        return selected, weights
+        # Solvers which support warm starts begin with the heuristic solution
+        x0 = np.zeros(n_received)
+        x0[selected] = 1.0
+        w.value = x0
+
+        try:
+            prob.solve(verbose=self.verbose, warm_start=True, **options)
+        except (cp.error.SolverError, cp.error.DCPError) as e:
+            info["status"] = "cvxpy failed with {}, using the heuristic solution".format(type(e).__name__)
+            return selected, info
+
+        cselected = np.flatnonzero(w.value > 0.5) if w.value is not None else []
+        if len(cselected) != self.n_estimators:
+            info["status"] = "cvxpy returned no solution ({}), using the heuristic solution".format(prob.status)
+            return selected, info
+
+        # A solver which stopped early (e.g. due to its time limit) might return a worse solution than the heuristic
+        cobjective = subset_objective(cselected, q, P, self.alpha)
+        if cobjective > info["objective"]:
+            info["status"] = "cvxpy solution ({}) is worse, using the heuristic solution".format(prob.status)
+            return selected, info
+
+        info.update(solver = prob.solver_stats.solver_name, status = prob.status, objective = cobjective)
+        return cselected, info
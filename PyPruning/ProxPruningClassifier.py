@@ -1,5 +1,6 @@
+import copy
 import numpy as np
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, effective_n_jobs
 import numbers
 import time
 from sklearn import ensemble
@@ -10,7 +11,8 @@ from sklearn.metrics import accuracy_score
 from scipy.special import softmax
 from sklearn.tree import DecisionTreeClassifier
 
-from .PruningClassifier import PruningClassifier
+from .PruningClassifier import PruningClassifier, PruningStats
+from .Storage import chunk_bounds, TopKProba
 
 # Modified from https://stackoverflow.com/questions/38157972/how-to-implement-mini-batch-gradient-descent-in-python
 def create_mini_batches(inputs, targets, data, batch_size, shuffle=False):
@@ -34,16 +36,51 @@ def create_mini_batches(inputs, targets, data, batch_size, shuffle=False):
 def to_prob_simplex(x):
     if x is None or len(x) == 0:
         return x
-    sorted_x = np.sort(x)
-    x_sum = sorted_x[0]
-    l = 1.0 - sorted_x[0]
-    for i in range(1,len(sorted_x)):
-        x_sum += sorted_x[i]
-        tmp = 1.0 / (i + 1.0) * (1.0 - x_sum)
-        if (sorted_x[i] + tmp) > 0:
-            l = tmp 
-    
-    return [max(xi + l, 0.0) for xi in x]
+    x = np.asarray(x, dtype=np.float64)
+    sorted_x = np.sort(x)[::-1]
+    tmp = (1.0 - np.cumsum(sorted_x)) / np.arange(1, len(x) + 1)
+    rho = np.nonzero(sorted_x + tmp > 0)[0][-1]
+    return np.maximum(x + tmp[rho], 0.0)
+
+class PruningPath:
+    ''' The solutions of ProxPruningClassifier for a sequence of regularization strengths as computed by `ProxPruningClassifier.prune_path`.
+
+    Attributes
+    ----------
+    l_ensemble_regs : numpy array
+        The K values of l_ensemble_reg in the order they have been solved.
+    weights : numpy array
+        A (K, M) matrix with the weights of all M estimators for each value of l_ensemble_reg.
+    num_trees : numpy array
+        The number of estimators with a nonzero weight for each value of l_ensemble_reg.
+    num_parameters : numpy array
+        The total number of nodes of the estimators with a nonzero weight for each value of l_ensemble_reg.
+    loss : numpy array
+        The mean loss (without regularizer) on the pruning data for each value of l_ensemble_reg.
+    accuracy : numpy array
+        The accuracy on the pruning data for each value of l_ensemble_reg.
+    '''
+    def __init__(self, pruner, estimators, l_ensemble_regs, weights, num_trees, num_parameters, loss, accuracy):
+        self.pruner = pruner
+        self.estimators = estimators
+        self.l_ensemble_regs = np.asarray(l_ensemble_regs)
+        self.weights = np.asarray(weights)
+        self.num_trees = np.asarray(num_trees)
+        self.num_parameters = np.asarray(num_parameters)
+        self.loss = np.asarray(loss)
+        self.accuracy = np.asarray(accuracy)
+
+    def __len__(self):
+        return len(self.l_ensemble_regs)
+
+    def select(self, i):
+        ''' Returns a copy of the ProxPruningClassifier which uses the pruned ensemble of the i-th point on the path. '''
+        idx = np.nonzero(self.weights[i] > 0)[0]
+        pruner = copy.copy(self.pruner)
+        pruner.l_ensemble_reg = self.l_ensemble_regs[i]
+        pruner.estimators_ = [copy.deepcopy(self.estimators[j]) for j in idx]
+        pruner.weights_ = list(self.weights[i, idx])
+        return pruner
 
 class ProxPruningClassifier(PruningClassifier):
     """ (Heterogeneous) Pruning via Proximal Gradient Descent
@@ -52,7 +89,7 @@ class ProxPruningClassifier(PruningClassifier):
     $$
         \\arg\\min_w L \\left(\sum_{i=1}^M w_i h_i(x), y\\right) + \\lambda \\sum_{i=1}^K w_i R(h_i) 
     $$
-    via (stochastic) proximal gradient descent. Currently the `{mse, cross-entropy, hinge2}` are supported. In addition to the loss functions two types of regularizer can be chosen:
+    via (stochastic) proximal gradient descent or via full-batch accelerated proximal gradient descent (FISTA) with backtracking. Currently the `{mse, cross-entropy, hinge2}` are supported. In addition to the loss functions two types of regularizer can be chosen:
 
     - `ensemble_regularizer`: This regularizer tries to remove as many members as possible from the ensemble as possible. If you want to select exactly K elements you can choose the `hard-L0` constraint. Otherwise "soft variations" of this in the form of `L0` and `L1` regularization are also available.
     - `tree_regularizer`: This regularizer tries to choose smaller trees with fewer nodes over larger ones. This regularizer is basically the number of nodes present in a tree.
@@ -76,13 +113,21 @@ class ProxPruningClassifier(PruningClassifier):
     batch_size: int
         The batch sized used for SGD
     epochs : int
-        The number of epochs SGD is run.
+        The number of epochs SGD is run. For the `fista` optimizer this is the maximum number of iterations.
+    optimizer : str, default is "sgd"
+        The optimizer. Should be one of `{"sgd", "fista"}`. `sgd` performs stochastic proximal gradient descent over mini-batches. `fista` performs full-batch accelerated proximal gradient descent with a backtracking line search, where `step_size` is the initial step size. The gradients are computed as matrix-vector products over row blocks of the predictions which are distributed across n_jobs threads. `fista` does not support `update_leaves`.
+    tol : float, default is 1e-5
+        The tolerance of the `fista` optimizer. The optimization stops early if the relative change of the weights between two iterations is below tol.
     verbose : boolean
         If true, shows a progress bar via tqdm and some statistics
     update_leaves : boolean
         If true, then leave nodes of each tree are also updated via SGD.
     out_path: str
         If set, stores a file called epoch_$i.npy with the statistics for epoch $i under the given path.
+    n_jobs : int, default is 1
+        The number of threads used for computing the predictions of the estimators and the full-batch gradients of the `fista` optimizer.
+    n_iter_ : int
+        The number of iterations performed by the `fista` optimizer.
     estimators_ : list of objects
         The list of estimators which are used to built the ensemble. Each estimator must offer a predict_proba method.
     weights_ : np.array of floats
@@ -102,7 +147,10 @@ class ProxPruningClassifier(PruningClassifier):
         verbose = False, 
         update_leaves = False,
         out_path = None,
-        eval_every_epochs = None):
+        eval_every_epochs = None,
+        n_jobs = 1,
+        optimizer = "sgd",
+        tol = 1e-5):
 
         assert loss in ["mse","cross-entropy","hinge2"], "Currently only {{mse, cross-entropy, hinge2}} loss is supported"
         assert ensemble_regularizer is None or ensemble_regularizer in ["none","L0", "L1", "hard-L1"], "Currently only {{none,L0, L1, hard-L1}} the ensemble regularizer is supported"
@@ -110,11 +158,14 @@ class ProxPruningClassifier(PruningClassifier):
         assert tree_regularizer is None or tree_regularizer in ["node"], "Currently only {{none, node}} regularizer is supported for tree the regularizer."
         assert batch_size >= 1, "batch_size must be at-least 1"
         assert epochs >= 1, "epochs must be at-least 1"
+        assert optimizer in ["sgd", "fista"], "Currently only {{sgd, fista}} optimizer is supported"
+        assert optimizer == "sgd" or not update_leaves, "update_leaves is only supported by the sgd optimizer"
+        assert tol >= 0, "tol must be greater or equal to 0"
 
         if ensemble_regularizer == "hard-L1":
             assert l_ensemble_reg >= 1 or l_ensemble_reg == 0, "You chose ensemble_regularizer = hard-L1, but set 0 < l_ensemble_reg < 1 which does not really makes sense. If hard-L1 is set, then l_ensemble_reg is the maximum number of estimators in the pruned ensemble, thus likely an integer value >= 1."
 
-        super().__init__()
+        super().__init__(n_jobs = n_jobs)
         
         self.loss = loss
         self.step_size = step_size
@@ -129,41 +180,100 @@ class ProxPruningClassifier(PruningClassifier):
         self.update_leaves = update_leaves
         self.out_path = out_path
         self.eval_every_epochs = eval_every_epochs
+        self.optimizer = optimizer
+        self.tol = tol
+
+    def _mutates_estimators(self):
+        # Updating the leaves changes the trees
+        return self.update_leaves
+
+    def _leaves(self, data):
+        ''' Computes the (N,M) matrix with the index of the leaf each example reaches in each tree. '''
+        leaves = np.zeros(shape=(data.shape[0], len(self.estimators_)), dtype=np.intp)
+        def apply(i, h):
+            leaves[:, i] = h.apply(data)
+
+        Parallel(n_jobs=self.n_jobs, backend="threading")(
+            delayed(apply) (i, h) for i, h in enumerate(self.estimators_)
+        )
+        return leaves
+
+    def _leaf_proba(self, leaves):
+        ''' Gathers the predictions of all trees from their current leaf values given the (N,M) leaf-index matrix. The values are normalized the same way DecisionTreeClassifier.predict_proba does. '''
+        classes = self.classes_.astype(int)
+        proba = np.zeros(shape=(len(self.estimators_), leaves.shape[0], self.n_classes_), dtype=np.float32)
+        for i, h in enumerate(self.estimators_):
+            value = h.tree_.value[leaves[:, i], 0, :]
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba[i][:, classes] = value / normalizer
+        return proba
+
+    def prox(self, w, step_size = None):
+        ''' Applies the proximal operator of the ensemble_regularizer for the given step_size (default is self.step_size) to the weights w and (if set) projects the support of the result onto the probability simplex. '''
+        if step_size is None:
+            step_size = self.step_size
 
-    def next(self, proba, target, data):
-        # If we update the leaves, then proba also changes and we need to recompute them. Otherwise we can just use the pre-computed probas
-        if self.update_leaves:
-            proba = self._individual_proba(data)
-        else:
-            proba = np.swapaxes(proba, 0, 1)
-
-        output = np.array([w * p for w,p in zip(proba, self.weights_)]).sum(axis=0)
+        if self.ensemble_regularizer == "L0":
+            tmp = np.sqrt(2 * self.l_ensemble_reg * step_size)
+            w = np.where(np.abs(w) < tmp, 0.0, w)
+        elif self.ensemble_regularizer == "L1":
+            w = np.sign(w) * np.maximum(np.abs(w) - step_size*self.l_ensemble_reg, 0)
+        elif self.ensemble_regularizer == "hard-L1":
+            top_K = np.argsort(w)[-self.l_ensemble_reg:]
+            mask = np.zeros(len(w), dtype=bool)
+            mask[top_K] = True
+            w = np.where(mask, w, 0.0)
 
-        batch_size = output.shape[0]
-        accuracy = (output.argmax(axis=1) == target) * 100.0
-        n_trees = [self.num_trees() for _ in range(batch_size)]
-        n_param = [self.num_parameters() for _ in range(batch_size)]
-        
-        # Compute the appropriate loss. 
+        # If set, normalize the weights. Note that we use the support of w for the projection onto the probability simplex
+        # as described in http://proceedings.mlr.press/v28/kyrillidis13.pdf
+        # Thus, we first need to extract the nonzero weights, project these and then copy them back into corresponding array
+        if self.normalize_weights and len(w) > 0:
+            nonzero_idx = np.nonzero(w)[0]
+            nonzero_w = w[nonzero_idx]
+            w = np.zeros(len(w))
+            if len(nonzero_idx) > 0:
+                w[nonzero_idx] = to_prob_simplex(nonzero_w)
+        return w
+
+    def _loss(self, output, target):
+        ''' Computes the element-wise loss of the (N,C) ensemble output and its derivative with respect to the output. '''
+        target_one_hot = self._one_hot[target]
         if self.loss == "mse":
-            target_one_hot = np.array( [ [1.0 if y == i else 0.0 for i in range(self.n_classes_)] for y in target] )
-            loss = (output - target_one_hot) * (output - target_one_hot)
-            loss_deriv = 2 * (output - target_one_hot)
+            diff = output - target_one_hot
+            loss = diff * diff
+            loss_deriv = 2 * diff
         elif self.loss == "cross-entropy":
-            target_one_hot = np.array( [ [1.0 if y == i else 0.0 for i in range(self.n_classes_)] for y in target] )
             p = softmax(output, axis=1)
             loss = -target_one_hot*np.log(p + 1e-7)
-            m = target.shape[0]
-            loss_deriv = softmax(output, axis=1)
-            loss_deriv[range(m),target_one_hot.argmax(axis=1)] -= 1
+            loss_deriv = p - target_one_hot
         elif self.loss == "hinge2":
-            target_one_hot = np.array( [ [1.0 if y == i else -1.0 for i in range(self.n_classes_)] for y in target] )
-            zeros = np.zeros_like(target_one_hot)
-            loss = np.maximum(1.0 - target_one_hot * output, zeros)**2
-            loss_deriv = - 2 * target_one_hot * np.maximum(1.0 - target_one_hot * output, zeros) 
+            target_one_hot = 2.0 * target_one_hot - 1.0
+            margin = np.maximum(1.0 - target_one_hot * output, 0.0)
+            loss = margin**2
+            loss_deriv = - 2 * target_one_hot * margin
         else:
             raise "Currently only the losses {{cross-entropy, mse, hinge2}} are supported, but you provided: {}".format(self.loss)
+        return loss, loss_deriv
+
+    def next(self, proba, target, data, leaves = None):
+        # proba has shape (B,M,C).
+        # If we update the leaves, then proba also changes and we need to recompute them. Otherwise we can just use the pre-computed probas.
+        # The leaf an example reaches never changes (only the leaf values do), hence prune_ computes the leaf indices once and passes them here
+        if self.update_leaves:
+            if leaves is None:
+                leaves = self._leaves(data)
+            proba = np.swapaxes(self._leaf_proba(leaves), 0, 1)
+
+        output = np.einsum("bmc,m->bc", proba, self.weights_)
+
+        batch_size = output.shape[0]
+        accuracy = (output.argmax(axis=1) == target) * 100.0
+        n_trees = np.full(batch_size, self.num_trees())
+        n_param = np.full(batch_size, self.num_parameters())
         
+        # Compute the appropriate loss. 
+        loss, loss_deriv = self._loss(output, target)
         loss = np.sum(np.mean(loss,axis=1))
         
         if self.ensemble_regularizer == "L0":
@@ -172,13 +282,12 @@ class ProxPruningClassifier(PruningClassifier):
             loss += self.l_ensemble_reg * np.linalg.norm(self.weights_,1)
 
         # Compute the gradients for the loss
-        directions = np.mean(proba*loss_deriv,axis=(1,2))
+        directions = np.einsum("bmc,bc->m", proba, loss_deriv) / (proba.shape[0] * proba.shape[2])
 
         # Compute the appropriate regularizer
         if self.tree_regularizer == "node" and self.l_tree_reg > 0:
-            loss += self.l_tree_reg * np.sum( [ (w * est.tree_.node_count) for w, est in zip(self.weights_, self.estimators_)] )
-            
-            node_deriv = self.l_tree_reg * np.array([ est.tree_.node_count for est in self.estimators_])
+            loss += self.l_tree_reg * np.dot(self.weights_, self._node_counts)
+            node_deriv = self.l_tree_reg * self._node_counts
         else:
             node_deriv = 0
 
@@ -186,55 +295,167 @@ class ProxPruningClassifier(PruningClassifier):
         tmp_w = self.weights_ - self.step_size*directions - self.step_size*node_deriv
         
         if self.update_leaves:
-            # compute direction per tree
-            # tree_deriv = proba*loss_deriv
+            # Scatter the gradient of each example into the leaf it reaches. Examples reaching the same leaf accumulate their gradients
             for i, h in enumerate(self.estimators_):
-                tree_grad = (self.weights_[i] * loss_deriv)[:,np.newaxis,:]
-                # find idx
-                idx = h.apply(data)
-                h.tree_.value[idx] = h.tree_.value[idx] - self.step_size * tree_grad[:,:,h.classes_.astype(int)]
-                # update model
-                #h.tree_.value[idx] = h.tree_.value[idx] - self.step_size*h.tree_.value[idx]*tree_deriv[i,:,np.newaxis]
-                
-                #step = self.step_size*tree_deriv[i,:,np.newaxis]
-                #h.tree_.value[idx] = h.tree_.value[idx] - step[:,:,self.classes_.astype(int)]
-
-        if self.ensemble_regularizer == "L0":
-            tmp = np.sqrt(2 * self.l_ensemble_reg * self.step_size)
-            tmp_w = np.array([0 if abs(w) < tmp else w for w in tmp_w])
-        elif self.ensemble_regularizer == "L1":
-            sign = np.sign(tmp_w)
-            tmp_w = np.abs(tmp_w) - self.step_size*self.l_ensemble_reg
-            tmp_w = sign*np.maximum(tmp_w,0)
-        elif self.ensemble_regularizer == "hard-L1":
-            top_K = np.argsort(tmp_w)[-self.l_ensemble_reg:]
-            tmp_w = np.array([w if i in top_K else 0 for i,w in enumerate(tmp_w)])
+                tree_grad = self.weights_[i] * loss_deriv[:, h.classes_.astype(int)]
+                np.add.at(h.tree_.value[:, 0, :], leaves[:, i], -self.step_size * tree_grad)
 
-        # If set, normalize the weights. Note that we use the support of tmp_w for the projection onto the probability simplex
-        # as described in http://proceedings.mlr.press/v28/kyrillidis13.pdf
-        # Thus, we first need to extract the nonzero weights, project these and then copy them back into corresponding array
-        
-        if self.normalize_weights and len(tmp_w) > 0:
-            nonzero_idx = np.nonzero(tmp_w)[0]
-            nonzero_w = tmp_w[nonzero_idx]
-            nonzero_w = to_prob_simplex(nonzero_w)
-            self.weights_ = np.zeros((len(tmp_w)))
-            for i,w in zip(nonzero_idx, nonzero_w):
-                self.weights_[i] = w
-        else:
-            self.weights_ = tmp_w
+        self.weights_ = self.prox(tmp_w)
         
         return {"loss":loss, "accuracy": accuracy, "num_trees": n_trees, "num_parameters" : n_param}
 
+    def _row_blocks(self, proba):
+        ''' Splits the examples into row blocks for the full-batch gradients. Each chunk of the predictions (see Storage.chunk_bounds) is split into one block per thread. '''
+        n_jobs = effective_n_jobs(self.n_jobs)
+        blocks = []
+        for start, end in chunk_bounds(proba):
+            step = max(1, int(np.ceil((end - start) / n_jobs)))
+            blocks.extend((s, min(s + step, end)) for s in range(start, end, step))
+        return blocks
+
+    def _full_output(self, proba, w, blocks, parallel):
+        ''' Computes the (N,C) output of the ensemble with weights w as one matrix-vector product per row block. '''
+        n_models, n_examples, n_classes = proba.shape
+        output = np.zeros(shape=(n_examples, n_classes), dtype=np.float64)
+        def compute(start, end):
+            if isinstance(proba, TopKProba):
+                output[start:end] = proba.dot(w, start, end)
+                return
+            P = np.asarray(proba[:, start:end, :]).reshape(n_models, -1)
+            output[start:end] = (w.astype(P.dtype) @ P).reshape(end - start, n_classes)
+
+        parallel(delayed(compute) (start, end) for start, end in blocks)
+        return output
+
+    def _full_directions(self, proba, loss_deriv, blocks, parallel):
+        ''' Computes the gradient of the mean loss with respect to the weights as one matrix-vector product per row block. '''
+        n_models, n_examples, n_classes = proba.shape
+        def compute(start, end):
+            if isinstance(proba, TopKProba):
+                return proba.rdot(loss_deriv[start:end], start, end)
+            P = np.asarray(proba[:, start:end, :]).reshape(n_models, -1)
+            return P @ loss_deriv[start:end].astype(P.dtype).ravel()
+
+        directions = parallel(delayed(compute) (start, end) for start, end in blocks)
+        return np.sum(directions, axis=0, dtype=np.float64) / (n_examples * n_classes)
+
+    def _prune_fista(self, proba, target):
+        ''' Full-batch accelerated proximal gradient descent (FISTA) with backtracking, see Beck and Teboulle "A Fast Iterative Shrinkage-Thresholding Algorithm for Linear Inverse Problems" 2009. '''
+        blocks = self._row_blocks(proba)
+        if self.tree_regularizer == "node" and self.l_tree_reg > 0:
+            node_deriv = self.l_tree_reg * self._node_counts
+        else:
+            node_deriv = np.zeros(len(self.weights_))
+
+        # The smooth part of the objective, i.e. the mean loss and the node regularizer, given the output of the ensemble
+        def objective(w, output):
+            loss, loss_deriv = self._loss(output, target)
+            return loss.mean() + np.dot(w, node_deriv), loss_deriv
+
+        x = self.weights_
+        y = x
+        t = 1.0
+        L = 1.0 / self.step_size
+        self.n_iter_ = 0
+
+        # The thread pool is re-used for all iterations
+        with Parallel(n_jobs=self.n_jobs, backend="threading") as parallel, tqdm(total=self.epochs, ncols=150, disable = not self.verbose) as pbar:
+            # The output is linear in the weights. Hence the output for the extrapolated point y is a combination of the outputs of the last two iterates and does not need another pass over the predictions
+            output_x = self._full_output(proba, x, blocks, parallel)
+            output_y = output_x
+            for _ in range(self.epochs):
+                start_time = time.perf_counter()
+                fy, loss_deriv = objective(y, output_y)
+                grad = self._full_directions(proba, loss_deriv, blocks, parallel) + node_deriv
+
+                # Backtracking: Decrease the step size until the quadratic upper bound holds at the new point
+                while True:
+                    x_new = self.prox(y - grad / L, 1.0 / L)
+                    diff = x_new - y
+                    output_new = self._full_output(proba, x_new, blocks, parallel)
+                    fx, _ = objective(x_new, output_new)
+                    if fx <= fy + np.dot(grad, diff) + L / 2.0 * np.dot(diff, diff) or L > 1e12:
+                        break
+                    L *= 2.0
+
+                t_new = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+                beta = (t - 1.0) / t_new
+                y = x_new + beta * (x_new - x)
+                output_y = output_new + beta * (output_new - output_x)
+                change = np.linalg.norm(x_new - x) / max(1.0, np.linalg.norm(x))
+                x, output_x = x_new, output_new
+                t = t_new
+                self.n_iter_ += 1
+                self._event("epoch", {"epoch" : self.n_iter_ - 1, "duration" : time.perf_counter() - start_time, "loss" : float(fx), "step_size" : 1.0 / L})
+
+                pbar.update(1)
+                if self.verbose:
+                    pbar.set_description("loss {:2.4f} num_trees {} step_size {:2.6f}".format(fx, np.count_nonzero(x), 1.0 / L))
+
+                if change <= self.tol:
+                    break
+
+        self.weights_ = x
+
+    def prune_path(self, X, y, estimators, l_ensemble_regs, classes = None, n_classes = None, storage = None, storage_path = None, predictions = None, top_k = 16):
+        '''
+        Computes the pruned ensembles for a sequence of regularization strengths. The predictions of the estimators are computed only once and each solution is used as the starting point for the next value of l_ensemble_reg (warm start). For hard-L1 the values are the number of estimators K. Warm starts work best if the values are ordered from weak to strong regularization, e.g. increasing l_ensemble_reg for L0 / L1 and decreasing K for hard-L1. 
+
+        This classifier is not changed, use `PruningPath.select` to get a pruned ensemble for a point on the path. Updating the leaves is not supported.
+
+        Parameters
+        ----------
+        X, y, estimators, classes, n_classes, storage, storage_path, predictions, top_k
+            See `PruningClassifier.prune`.
+        l_ensemble_regs : list of floats
+            The values of l_ensemble_reg which are solved in the given order.
+
+        Returns
+        -------
+        The PruningPath with the solution for each value in l_ensemble_regs.
+        '''
+        assert not self.update_leaves, "prune_path does not support update_leaves"
+
+        # The copy shares the report with this classifier
+        self.stats_ = PruningStats()
+        pruner = copy.copy(self)
+        proba = pruner._prepare(X, y, estimators, classes, n_classes, storage, storage_path, predictions, top_k)
+        pruner.estimators_ = estimators
+        target = np.asarray(y)
+
+        weights = np.full(len(estimators), 1.0 / len(estimators))
+        path_weights, num_trees, num_parameters, loss, accuracy = [], [], [], [], []
+        for l_reg in l_ensemble_regs:
+            pruner.l_ensemble_reg = l_reg
+            pruner._optimize(proba, target, X, weights)
+            weights = pruner.weights_
+
+            with Parallel(n_jobs=self.n_jobs, backend="threading") as parallel:
+                output = pruner._full_output(proba, weights, pruner._row_blocks(proba), parallel)
+            path_weights.append(weights.copy())
+            num_trees.append(pruner.num_trees())
+            num_parameters.append(pruner.num_parameters())
+            loss.append(pruner._loss(output, target)[0].mean())
+            accuracy.append((output.argmax(axis=1) == target).mean())
+
+        return PruningPath(pruner, estimators, l_ensemble_regs, path_weights, num_trees, num_parameters, loss, accuracy)
+
     def num_trees(self):
         return np.count_nonzero(self.weights_)
 
     def num_parameters(self):
-        return sum( [ est.tree_.node_count if w != 0 else 0 for w, est in zip(self.weights_, self.estimators_)] )
+        return int(self._node_counts[self.weights_ != 0].sum())
 
     def prune_(self, proba, target, data):
-        proba = np.swapaxes(proba, 0, 1)
-        self.weights_ = np.array([1.0 / proba.shape[1] for _ in range(proba.shape[1])])
+        return self._optimize(proba, target, data, np.full(proba.shape[0], 1.0 / proba.shape[0]))
+
+    def _init_optimization(self, weights):
+        ''' Sets the initial weights and prepares the estimators for training. '''
+        self.weights_ = np.array(weights, dtype=np.float64)
+
+        # The one-hot encoding of the labels and the size of each tree do not change during training
+        self._one_hot = np.eye(self.n_classes_)
+        self._node_counts = np.array([est.tree_.node_count for est in self.estimators_])
 
         if self.update_leaves:
             # SKlearn stores the raw counts instead of probabilities. For SGD its better to have the 
@@ -244,50 +465,97 @@ class ProxPruningClassifier(PruningClassifier):
             for tree in self.estimators_:
                 tree.tree_.value[:] = tree.tree_.value / tree.tree_.value.sum(axis=(1,2))[:,np.newaxis,np.newaxis]
 
-        for epoch in range(self.epochs):
+    def _update_stream(self, state, proba, target, data):
+        # Each chunk is used for a single pass of mini-batch updates. The full-batch optimizer would require multiple passes over the stream
+        assert self.optimizer == "sgd", "Pruning on a stream of data is only supported for optimizer = sgd"
+        # The state are the weights of all estimators, so that partial_prune can continue the optimization from them (warm start)
+        if state is None:
+            self._init_optimization(np.full(len(proba), 1.0 / len(proba)))
+        else:
+            self.weights_ = np.array(state, dtype=np.float64)
+
+        leaves = self._leaves(data) if self.update_leaves else None
+        cproba = np.swapaxes(np.asarray(proba), 0, 1)
+        target = np.asarray(target)
+        for bproba, btarget, bidx in create_mini_batches(cproba, target, np.arange(len(target)), self.batch_size, True):
+            self.next(bproba, btarget, data[bidx], None if leaves is None else leaves[bidx])
+        return self.weights_.copy()
+
+    def _prune_stream(self, state):
+        return [i for i in range(len(state)) if state[i] > 0], [w for w in state if w > 0]
+
+    def _optimize(self, proba, target, data, weights):
+        ''' Optimizes the weights of all estimators starting from the given weights. Returns the indices and weights of the selected estimators, see `prune_`. '''
+        n_examples = proba.shape[1]
+        self._init_optimization(weights)
 
-            mini_batches = create_mini_batches(proba, target, data, self.batch_size, True) 
+        if self.optimizer == "fista":
+            self._prune_fista(proba, np.asarray(target))
+            return [i for i in range(len(self.weights_)) if self.weights_[i] > 0], [w for w in self.weights_ if w > 0]
+
+        # The leaves reached by each example do not change during training, so we compute them once instead of traversing all trees for each mini-batch
+        leaves = self._leaves(data) if self.update_leaves else None
+
+        # Memory-mapped or chunked predictions are processed chunk by chunk in a random order so that only one chunk is resident at a time. Regular numpy arrays are a single chunk.
+        bounds = chunk_bounds(proba)
+        target = np.asarray(target)
+
+        for epoch in range(self.epochs):
+            epoch_start = time.perf_counter()
 
             times = []
             total_time = 0
             metrics = {}
             example_cnt = 0
 
-            with tqdm(total=proba.shape[0], ncols=150, disable = not self.verbose) as pbar:
-                for batch in mini_batches:
-                    bproba, btarget, bdata = batch 
-
-                    # Update Model                    
-                    start_time = time.time()
-                    batch_metrics = self.next(bproba, btarget, bdata)
-                    batch_time = time.time() - start_time
-
-                    # Extract statistics
-                    for key,val in batch_metrics.items():
-                        metrics[key] = np.concatenate( (metrics.get(key,[]), val), axis=None )
-                        metrics[key + "_sum"] = metrics.get( key + "_sum",0) + np.sum(val)
-
-                    example_cnt += bproba.shape[0]
-                    pbar.update(bproba.shape[0])
-                    
-                    # TODO ADD times to metrics and write it to disk
-                    times.append(batch_time)
-                    total_time += batch_time
-
-                    m_str = ""
-                    for key,val in metrics.items():
-                        if "_sum" in key:
-                            m_str += "{} {:2.4f} ".format(key.split("_sum")[0], val / example_cnt)
+            with tqdm(total=n_examples, ncols=150, disable = not self.verbose) as pbar:
+                chunk_order = np.random.permutation(len(bounds)) if len(bounds) > 1 else [0]
+                for chunk in chunk_order:
+                    start, end = bounds[chunk]
+                    cproba = np.swapaxes(np.asarray(proba[:, start:end, :]), 0, 1)
+                    mini_batches = create_mini_batches(cproba, target[start:end], np.arange(start, end), self.batch_size, True) 
+                    for batch in mini_batches:
+                        bproba, btarget, bidx = batch 
+
+                        # Update Model                    
+                        start_time = time.time()
+                        batch_metrics = self.next(bproba, btarget, data[bidx], None if leaves is None else leaves[bidx])
+                        batch_time = time.time() - start_time
+
+                        # Extract statistics
+                        for key,val in batch_metrics.items():
+                            metrics.setdefault(key, []).append(val)
+                            metrics[key + "_sum"] = metrics.get( key + "_sum",0) + np.sum(val)
+
+                        example_cnt += bproba.shape[0]
+                        pbar.update(bproba.shape[0])
                     
-                    desc = '[{}/{}] {} time_item {:2.4f}'.format(
-                        epoch, 
-                        self.epochs-1, 
-                        m_str,
-                        total_time / example_cnt
-                    )
-                    pbar.set_description(desc)
+                        # TODO ADD times to metrics and write it to disk
+                        times.append(batch_time)
+                        total_time += batch_time
+
+                        if self.verbose:
+                            m_str = ""
+                            for key,val in metrics.items():
+                                if "_sum" in key:
+                                    m_str += "{} {:2.4f} ".format(key.split("_sum")[0], val / example_cnt)
+                        
+                            desc = '[{}/{}] {} time_item {:2.4f}'.format(
+                                epoch, 
+                                self.epochs-1, 
+                                m_str,
+                                total_time / example_cnt
+                            )
+                            pbar.set_description(desc)
                 
                 if self.eval_every_epochs is not None and epoch % self.eval_every_epochs == 0 and self.out_path is not None:
+                    # The per-batch statistics are collected in lists and only concatenated once per epoch
+                    metrics = {key : np.concatenate(val, axis=None) if isinstance(val, list) else val for key, val in metrics.items()}
                     np.save(os.path.join(self.out_path, "epoch_{}.npy".format(epoch)), metrics, allow_pickle=True)
+
+            self._event("epoch", {
+                "epoch" : epoch, "duration" : time.perf_counter() - epoch_start, "n_examples" : example_cnt, 
+                "loss" : float(metrics["loss_sum"] / example_cnt), "accuracy" : float(metrics["accuracy_sum"] / example_cnt), "num_trees" : int(self.num_trees())
+            })
     
         return [i for i in range(len(self.weights_)) if self.weights_[i] > 0], [w for w in self.weights_ if w > 0]
@@ -1,12 +1,235 @@
-from abc import ABC, abstractmethod 
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 import copy
+from functools import partial
+import threading
+import time
 
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
 
 from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 
 from sklearn.base import BaseEstimator, ClassifierMixin
 
+from .Storage import create_proba, label_dtype, shared_proba, proba_nbytes, LabelPredictions, LabelStatistics
+from .CompiledEnsemble import CompiledEnsemble
+
+def vectorized_metric(metric, form):
+    '''
+    Returns the vectorized form of a metric or None if the metric does not offer one. Metrics announce a vectorized form by storing it as an attribute on the function itself, e.g. `error.incremental = error_incremental`. If the metric is a `partial` (e.g. because kwargs were supplied to the pruner) then the same keyword arguments are also bound to the vectorized form.
+
+    Parameters
+    ----------
+    metric : function or partial
+        The metric as given to the pruner.
+    form : str
+        The name of the vectorized form, e.g. "incremental"
+
+    Returns
+    -------
+    The vectorized form of the metric or None.
+    '''
+    if isinstance(metric, partial):
+        # Positional arguments of the per-model metric do not map onto the vectorized signature
+        if len(metric.args) > 0:
+            return None
+        vmetric = vectorized_metric(metric.func, form)
+        if vmetric is None:
+            return None
+        return partial(vmetric, **metric.keywords)
+    else:
+        return getattr(metric, form, None)
+
+def metric_representation(vmetric):
+    '''
+    Returns the representation of the predictions a vectorized metric works on. This is "labels" if the metric only requires the class predictions and thus receives a `Storage.LabelPredictions` object and "proba" (the default) if it requires the full (M,N,C) prediction tensor. 
+    '''
+    if vmetric is None:
+        return "proba"
+    if isinstance(vmetric, partial):
+        return metric_representation(vmetric.func)
+    return getattr(vmetric, "representation", "proba")
+
+def metric_stream(vmetric):
+    '''
+    Returns how a vectorized metric can be computed on a stream of pruning data (see `PruningClassifier.prune_stream`) or None if it cannot. Metrics announce this by setting the attribute `stream` on their vectorized form:
+
+    - "sum": The scores on the entire pruning set are the sum of the scores on each chunk.
+    - "counts": The metric only uses the per-classifier counts of a `Storage.LabelPredictions` object (n_correct and class_counts) and the number of examples.
+    - "pairwise": The metric additionally uses the pairwise counts (co_correct, co_errors and agreements).
+
+    In the latter two cases the metric receives a `Storage.LabelStatistics` object and target = None after all chunks have been processed.
+    '''
+    if vmetric is None:
+        return None
+    if isinstance(vmetric, partial):
+        return metric_stream(vmetric.func)
+    return getattr(vmetric, "stream", None)
+
+def update_stream(state, vmetric, predictions, target):
+    '''
+    Accumulates the statistics of the vectorized metric vmetric on the predictions of a chunk of pruning data, see `metric_stream`. state is None for the first chunk and the returned state has to be passed to the call for the next chunk.
+    '''
+    stream = metric_stream(vmetric)
+    assert stream is not None, "The metric {} cannot be computed on a stream of pruning data".format(getattr(vmetric, "__name__", vmetric))
+
+    if metric_representation(vmetric) == "labels" and not isinstance(predictions, LabelPredictions):
+        predictions = LabelPredictions.from_proba(predictions, target)
+
+    if stream == "sum":
+        scores = vmetric(predictions, target)
+        return scores if state is None else state + scores
+    else:
+        if state is None:
+            state = LabelStatistics(len(predictions), predictions.shape[2], pairwise = stream == "pairwise")
+        state.update(predictions)
+        return state
+
+def merge_stream(state, other):
+    '''
+    Merges two states of `update_stream` which have been accumulated on different chunks. Either state may be None.
+    '''
+    if state is None or other is None:
+        return other if state is None else state
+    if isinstance(state, LabelStatistics):
+        return state.merge(other)
+    return state + other
+
+def decay_stream(state, factor):
+    '''
+    Weights all examples of a state of `update_stream` by factor, e.g. to let old examples decay.
+    '''
+    if state is None:
+        return None
+    if isinstance(state, LabelStatistics):
+        return state.scale(factor)
+    return factor * state
+
+def stream_scores(state, vmetric):
+    '''
+    Computes the scores of the vectorized metric vmetric from the state which has been accumulated via `update_stream`.
+    '''
+    if metric_stream(vmetric) == "sum":
+        return state
+    return vmetric(state, None)
+
+def infer_classes(estimators, y):
+    '''
+    Infers the class mapping and the number of classes from the `classes_` and `n_classes_` fields of the estimators. See `PruningClassifier.prune` for details.
+
+    Returns
+    -------
+    classes_, n_classes_
+    '''
+    classes = [e.n_classes_ for e in estimators]
+    if (len(set(classes)) > 1):
+        raise RuntimeError("Detected a different number of classes for each learner. Please make sure that all learners have their n_classes_ field set to the same value. Alternatively, you may supply a list of classes via the classes parameter to avoid this error.")
+        #self.n_classes_ = max(classes)
+    
+    if len(set(y)) > classes[0]:
+        raise RuntimeError("Detected more classes in the pruning set then the estimators were originally trained on. This usually results in errors or unpredicted classification errors. You can supply a list of classes via the classes parameter. Classes should be arrays / lists containing all possible class labels starting from 0 to C, where C is the number of classes. Please make sure that these are integers as they will be interpreted as such.")
+
+    return estimators[0].classes_, classes[0]
+
+def collect_proba(estimators, X, out, classes, n_jobs = 1, predict_batch_size = None):
+    ''' Computes the predictions of each estimator and writes them directly into the pre-allocated out. The estimators are evaluated on batches of predict_batch_size rows by n_jobs threads.
+
+    Parameters
+    ----------
+    estimators : list
+        The M estimators which should be evaluated.
+    X : array-like or sparse matrix, shape (n_samples, n_features)
+        The samples to be predicted.
+    out : numpy array, numpy memmap, Storage.ChunkedProba or Storage.TopKProba
+        The zero-initialized (M, n_samples, C) tensor for the class probabilities. If out is a (M, n_samples) matrix, only the class predictions (argmax) are stored.
+    classes : numpy array / list of ints
+        The class mapping of the estimators in the order which is returned by predict_proba.
+    n_jobs : int, default is 1
+        The number of threads.
+    predict_batch_size : int, default is None
+        The maximum number of rows which are predicted at once. If None, all rows are predicted at once.
+
+    Returns
+    -------
+    out
+    '''
+    classes = np.asarray(classes).astype(int)
+    n_rows = X.shape[0]
+    batch_size = n_rows if predict_batch_size is None else predict_batch_size
+
+    # Okay this is a bit crazy, but has its reasons. Not every estimator might have received all labels during training. This can happen in ExtraTrees, but also in RF, especially with unfavorable cross validation splits or large class imbalances. In this case predict_proba returns vectors with less than n_classes entries. 
+    # Thus, we copy all predictions to the corresponding locations based on classes. This **should** be correct for numeric classes staring by 0 and also anything which is mapped via the SKLearns LabelEncoder.  
+    def collect(i, e, start, end):
+        iproba = e.predict_proba(X[start:end])
+        if out.ndim == 2:
+            out[i, start:end] = classes[iproba.argmax(axis=1)]
+        elif isinstance(out, np.ndarray):
+            out[i, start:end, classes] = iproba.T
+        else:
+            tmp = np.zeros(shape=(end - start, out.shape[2]), dtype=out.dtype)
+            tmp[:, classes] = iproba
+            out[i, start:end] = tmp
+
+    Parallel(n_jobs=n_jobs, backend="threading")(
+        delayed(collect) (i, e, start, min(start + batch_size, n_rows)) for i, e in enumerate(estimators) for start in range(0, n_rows, batch_size)
+    )
+    return out
+
+class PruningStats:
+    ''' A profiling report of the last call of `prune`, `prune_stream` or `partial_prune` (or `ProxPruningClassifier.prune_path`) of a pruner, which is stored in its `stats_` field. It only requires a few timer calls per phase, greedy round, epoch and solver call and is always collected.
+
+    Attributes
+    ----------
+    phases : dict
+        The total duration in seconds of each phase. "predict" is the computation of the predictions of the estimators, "share" the copy of the predictions into shared memory for process-based backends, "copy" the copying of estimators, "prune" the actual pruning (`prune_` or `_prune_stream`) and "update" the accumulation of the statistics of the chunks of a stream.
+    n_metric_evaluations : int
+        The number of metric evaluations, e.g. the number of (sub-ensemble) scores for single metrics and the number of pairs for pairwise metrics. Vectorized metrics count one evaluation per scored model or pair.
+    peak_tensor_bytes : int
+        The size of the largest prediction tensor (or class predictions) pruned on, see `Storage.proba_nbytes`.
+    rounds : list of dicts
+        One entry per round of the `GreedyPruningClassifier` with the selected model, its score, the number of metric evaluations and the duration of the round.
+    epochs : list of dicts
+        One entry per epoch (sgd) or iteration (fista) of the `ProxPruningClassifier` with its duration and the loss.
+    solver : dict or None
+        The solver, its status, the objective and the duration of the solve of the `MIQPPruningClassifier`.
+    '''
+    def __init__(self):
+        self.phases = {}
+        self.n_metric_evaluations = 0
+        self.peak_tensor_bytes = 0
+        self.rounds = []
+        self.epochs = []
+        self.solver = None
+
+    def record(self, event, info):
+        ''' Adds an event (see `PruningClassifier.callback`) to the report. '''
+        if event == "phase":
+            self.phases[info["phase"]] = self.phases.get(info["phase"], 0.0) + info["duration"]
+        elif event == "round":
+            self.rounds.append(info)
+        elif event == "epoch":
+            self.epochs.append(info)
+        elif event == "solver":
+            self.solver = info
+
+    def to_dict(self):
+        ''' Returns the report as a dict, e.g. for logging it as JSON. '''
+        return {
+            "phases" : dict(self.phases),
+            "n_metric_evaluations" : self.n_metric_evaluations,
+            "peak_tensor_bytes" : self.peak_tensor_bytes,
+            "rounds" : list(self.rounds),
+            "epochs" : list(self.epochs),
+            "solver" : self.solver
+        }
+
+    def __repr__(self):
+        return "PruningStats({})".format(self.to_dict())
+
+def _evaluate_block(metric, keys, args):
+    return [metric(*key, *args) for key in keys]
+
 class PruningClassifier(ABC): 
     ''' This abstract class forms the basis of all pruning methods and offers a unified interface. New pruning methods must extend this class and implement the prune_ method as detailed below. 
 
@@ -18,22 +241,41 @@ class PruningClassifier(ABC):
         A list of estimators
     n_classes_ : int 
         The number of classes the pruned ensemble supports.
+    n_jobs : int, default is 1
+        The number of threads used for computing the predictions of the estimators during pruning and prediction. Note that scikit-learn's trees release the GIL during prediction.
+    predict_batch_size : int, default is None
+        If set, the predictions of the estimators are computed on batches of at most predict_batch_size rows. If None, all rows are predicted at once.
+    backend : str, default is "threading"
+        The joblib backend used for evaluating the pruning metrics, e.g. "threading", "loky" or "multiprocessing". Most metrics hold the GIL, so a process-based backend such as "loky" scales better with n_jobs. In this case the predictions are placed into a memory-mapped file once (see `Storage.shared_proba`) which is shared by all worker processes instead of being pickled for each task. The predictions of the estimators are always computed with threads.
+    stats_ : PruningStats
+        The profiling report of the last pruning call, e.g. the duration of each phase and the number of metric evaluations.
+    callback : callable, default is None
+        If set, callback(event, info) is called during pruning for each event which is recorded in stats_. The events are "phase" after each phase with info = {"phase" : name, "duration" : seconds}, "round" after each round of the `GreedyPruningClassifier`, "epoch" after each epoch of the `ProxPruningClassifier` and "solver" after the solve of the `MIQPPruningClassifier`, where info is the dict which is added to stats_. Additionally, the heuristic solver of the `MIQPPruningClassifier` passes each new best solution as "incumbent" event with its objective and the time since the start of the solve, which is not recorded in stats_.
     '''
-    def __init__(self):
+    def __init__(self, n_jobs = 1, predict_batch_size = None, backend = "threading"):
+        assert predict_batch_size is None or predict_batch_size >= 1, "predict_batch_size must be None or at-least 1"
+
         self.weights_ = None
         self.estimators_ = None
         self.n_classes_ = None
+        self.base_estimators_ = None
+        self.partial_window_ = None
+        self.stats_ = PruningStats()
+        self.callback = None
+        self.n_jobs = n_jobs
+        self.predict_batch_size = predict_batch_size
+        self.backend = backend
 
 
     @abstractmethod
     def prune_(self, proba, target, data = None):
         '''
-        Prunes the ensemble using the ensemble predictions proba and the pruning data targets / data. If the pruning method requires access to the original ensemble members you can access these via self.estimators_. Note that self.estimators_ is already a deep-copy of the estimators so you are also free to change the estimators in this list if you want to.
+        Prunes the ensemble using the ensemble predictions proba and the pruning data targets / data. If the pruning method requires access to the original ensemble members you can access these via self.estimators_. Note that self.estimators_ only holds references to the original estimators unless `_mutates_estimators` returns True, in which case it is a deep-copy of the estimators and you are free to change the estimators in this list.
 
         Parameters
         ----------
         proba : numpy matrix
-            A (N,M,C) matrix which contains the individual predictions of each ensemble member on the pruning data. Each ensemble prediction is generated via predict_proba. N is size of the pruning data, M the size of the base ensemble and C is the number of classes
+            A (M,N,C) matrix which contains the individual predictions of each ensemble member on the pruning data. Each ensemble prediction is generated via predict_proba. N is size of the pruning data, M the size of the base ensemble and C is the number of classes. Depending on the storage used in `prune` this is either a regular numpy array, a numpy memmap, a `Storage.ChunkedProba` or a `Storage.TopKProba`. Use `Storage.chunk_bounds` to process the latter three in N-chunks with bounded memory.
         
         target: numpy array of ints 
             A numpy array or list of N integers where each integer represents the class for each example. Classes should start with 0, so that for C classes the integer 0,1,...,C-1 are used
@@ -51,8 +293,99 @@ class PruningClassifier(ABC):
             The individual weights for each selected classifier. The size of this array should match the size of idx (and not the size of the original base ensemble). 
         '''
         pass
+
+    def _evaluate_metric(self, metric, keys, *args, parallel = None):
+        '''
+        Evaluates metric(*key, *args) for each key in keys with n_jobs workers of the chosen backend. The keys are split into blocks and each task evaluates a whole block, so that the arguments are only transferred once per block.
+
+        Parameters
+        ----------
+        metric : function
+            The metric. For process-based backends it must be picklable, e.g. a module-level function or a partial of it.
+        keys : list of tuples
+            The leading arguments of each evaluation, e.g. [(i,) for i in range(M)] or the pairs [(i,j), ...]
+        args : 
+            The remaining arguments which are the same for all evaluations, e.g. the predictions and the targets.
+        parallel : joblib.Parallel, optional
+            An already running pool of workers, e.g. to re-use the same workers over multiple calls. If None, a new pool with n_jobs workers of the chosen backend is started.
+
+        Returns
+        -------
+        A list with the result of each evaluation in the order of keys.
+        '''
+        self.stats_.n_metric_evaluations += len(keys)
+        n_blocks = min(len(keys), 4 * effective_n_jobs(self.n_jobs))
+        if n_blocks == 0:
+            return []
+        blocks = np.array_split(np.arange(len(keys)), n_blocks)
+        parallel = Parallel(n_jobs=self.n_jobs, backend=self.backend) if parallel is None else parallel
+        results = parallel(
+            delayed(_evaluate_block) (metric, [keys[k] for k in block], args) for block in blocks
+        )
+        return [r for block in results for r in block]
+
+    def _event(self, event, info):
+        ''' Records an event in stats_ and passes it to the callback. '''
+        self.stats_.record(event, info)
+        if self.callback is not None:
+            self.callback(event, info)
+
+    @contextmanager
+    def _phase(self, name):
+        ''' Measures the duration of the enclosed code as phase name, see `PruningStats`. '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._event("phase", {"phase" : name, "duration" : time.perf_counter() - start})
+
+    def _mutates_estimators(self):
+        '''
+        Returns True if `prune_` changes the estimators in self.estimators_. In this case, `prune` passes a deep-copy of all estimators to `prune_`. Otherwise, `prune_` receives references to the original estimators and only the selected estimators are copied afterwards. Defaults to False.
+        '''
+        return False
+
+    def _representation(self):
+        '''
+        Returns the representation of the predictions `prune_` works on. This is either "proba" (the default) for the full (M,N,C) prediction tensor or "labels" if all metrics of the pruner only use the class predictions. In the latter case, `prune_` receives a `Storage.LabelPredictions` object in place of proba and the full prediction tensor is never materialized.
+        '''
+        return "proba"
     
-    def prune(self, X, y, estimators, classes = None, n_classes = None):
+    def _prepare(self, X, y, estimators, classes = None, n_classes = None, storage = None, storage_path = None, predictions = None, top_k = 16):
+        ''' Sets the class mapping and computes the predictions of all estimators which are passed to `prune_`. See `prune` for a description of the parameters. '''
+        if predictions is not None:
+            assert predictions.shape[:2] == (len(estimators), X.shape[0]), "The predictions have shape {}, but {} estimators and {} examples were supplied".format(predictions.shape, len(estimators), X.shape[0])
+            assert np.array_equal(predictions.target, y), "The predictions were computed for different targets"
+
+        if classes is None:
+            if predictions is not None:
+                self.classes_, self.n_classes_ = predictions.classes_, predictions.n_classes_
+            else:
+                self.classes_, self.n_classes_ = infer_classes(estimators, y)
+        else:
+            self.classes_ = classes
+            self.n_classes_ = n_classes
+
+        with self._phase("predict"):
+            if predictions is not None:
+                if self._representation() == "labels":
+                    proba = predictions.label_predictions()
+                else:
+                    assert predictions.proba is not None, "This pruner requires the full prediction tensor, but the predictions only contain the class predictions"
+                    proba = predictions.proba
+            elif self._representation() == "labels":
+                # Only store the class predictions of each estimator. Note that the storage is not required for this
+                labels = np.zeros(shape=(len(estimators), X.shape[0]), dtype=label_dtype(self.n_classes_))
+                self._collect_proba(estimators, X, labels)
+                proba = LabelPredictions(labels, y, self.n_classes_)
+            else:
+                proba = create_proba((len(estimators), X.shape[0], self.n_classes_), storage, storage_path, top_k = top_k)
+                self._collect_proba(estimators, X, proba)
+
+        self.stats_.peak_tensor_bytes = max(self.stats_.peak_tensor_bytes, proba_nbytes(proba))
+        return proba
+
+    def prune(self, X, y, estimators, classes = None, n_classes = None, storage = None, storage_path = None, predictions = None, copy_estimators = True, top_k = 16):
         '''
         Prunes the given ensemble on the supplied dataset. There are a few assumptions placed on the behavior of the individual classifiers in `estimators`. If you use scikit-learn classifier and any classifier implementing their interface they should work without a problem. The detailed assumptions are listed below:
          
@@ -60,7 +393,7 @@ class PruningClassifier(ABC):
         - `n_classes_`: Each estimator should offer a field on the number of classes it has been trained on. Ideally, this should be the same for all classifier in the ensemble but might differ e.g. due to different bootstrap samples. This field is not accessed if you manually supply `n_classes` as parameter to this function
         - `classes_`: Each estimator should offer a class mapping which shows the order of classes returned by predict_proba. Usually this should simply be [0,1,2,3,4] for 5 classes, but if your classifier returns class probabilities in a different order, e.g. [2,1,0,3,4] you should store this order in `classes_`. This field is not accessed if you manually supply `classes` as parameter to this function
 
-        For pruning this function calls `predict_proba` on each classifier in `estimators` and then calls `prune_` of the implementing class. After pruning, it extracts the selected classifiers from `estimators` with their corresponding weight and stores them in `self.weights_` and `self.estimators_`
+        For pruning this function calls `predict_proba` on each classifier in `estimators` and then calls `prune_` of the implementing class. After pruning, it extracts the selected classifiers from `estimators` with their corresponding weight and stores them in `self.weights_` and `self.estimators_`. Only the selected classifiers are copied, unless the pruner changes the estimators during pruning (see `_mutates_estimators`) in which case all estimators are copied beforehand.
 
         Parameters
         ----------
@@ -79,47 +412,210 @@ class PruningClassifier(ABC):
         n_classes: int
             The total number of classes. Usually, this it should be n_classes = len(classes). However, sometimes estimators are only fitted on a subset of data (e.g. during cross validation or bootstrapping) and the prune set might contain classes which are not in the original training set and vice-versa. In this case its best to supply n_classes beforehand. 
 
+        storage: str, optional
+            The storage backend of the (M,N,C) prediction tensor passed to `prune_`. Should be one of `{None, "memmap", "chunks", "topk"}`. None keeps the predictions in memory. "memmap" writes them into a single memory-mapped file and "chunks" into a directory of N-chunk files which are memory-mapped on access. Use the latter two if the predictions do not fit into memory. "topk" only keeps the top_k largest probabilities of each prediction in memory (see `Storage.TopKProba`). Use this for problems with many classes where each prediction only puts mass on a few classes.
+
+        storage_path: str, optional
+            The file ("memmap") or directory ("chunks") in which the predictions are stored. If None, a temporary file / directory is used which is removed after pruning. 
+
+        predictions: EnsemblePredictions, optional
+            The pre-computed predictions of the estimators on X (see `EnsemblePredictions.compute`). If set, the estimators are not evaluated on X and storage / storage_path are ignored. Use this to run multiple pruners on the same ensemble and pruning set with a single inference pass.
+
+        copy_estimators: boolean, default is True
+            If true, the pruned ensemble contains deep-copies of the selected estimators. If false, it contains references to the original estimators which avoids copying but means that changes to the original estimators are reflected in the pruned ensemble. This has no effect for pruners which change the estimators (see `_mutates_estimators`), as these always work on copies.
+
+        top_k: int, default is 16
+            The number of probabilities stored per prediction if storage = "topk".
+
         Returns
         -------
         The pruned ensemble.
         '''
-        if classes is None:
-            classes = [e.n_classes_ for e in estimators]
-            if (len(set(classes)) > 1):
-                raise RuntimeError("Detected a different number of classes for each learner. Please make sure that all learners have their n_classes_ field set to the same value. Alternatively, you may supply a list of classes via the classes parameter to avoid this error.")
-                #self.n_classes_ = max(classes)
-            else:
-                self.classes_ = estimators[0].classes_
-                self.n_classes_ = classes[0]
-            
-            if len(set(y)) > self.n_classes_:
-                raise RuntimeError("Detected more classes in the pruning set then the estimators were originally trained on. This usually results in errors or unpredicted classification errors. You can supply a list of classes via the classes parameter. Classes should be arrays / lists containing all possible class labels starting from 0 to C, where C is the number of classes. Please make sure that these are integers as they will be interpreted as such.")
-        else:
-            self.classes_ = classes
-            self.n_classes_ = n_classes
+        self.stats_ = PruningStats()
+        proba = self._prepare(X, y, estimators, classes, n_classes, storage, storage_path, predictions, top_k)
+        if self.backend not in ["threading", "sequential"]:
+            # Worker processes should map the predictions instead of receiving a pickled copy for each task
+            with self._phase("share"):
+                proba = shared_proba(proba)
 
-        # Okay this is a bit crazy, but has its reasons. This basically implements the for-loop below, but also takes care of the case where a single estimator did not receive all the labels. In this case predict_proba returns vectors with less than n_classes entries. This can happen in ExtraTrees, but also in RF, especially with unfavorable cross validation splits or large class imbalances. 
-        # Anyway, this code construct the desired matrix and copies all predictions to the corresponding locations based on e.classes_. This **should** be correct for numeric classes staring by 0 and also anything which is mapped via the SKLearns LabelEncoder.  
-        proba = np.zeros(shape=(len(estimators), X.shape[0], self.n_classes_), dtype=np.float32)
-        for i, e in enumerate(estimators):
-            proba[i, :, self.classes_.astype(int)] = e.predict_proba(X).T
-
-        # proba = []
-        # for h in estimators:
-        #     proba.append(h.predict_proba(X))
-        # proba = np.array(proba)
-
-        self.estimators_ = copy.deepcopy(estimators)
-        idx, weights = self.prune_(proba, y, X)        
-        estimators_ = []
-        for i in idx:
-            estimators_.append(self.estimators_[i])
+        # Copying large ensembles is expensive. Thus we only copy all estimators if the pruner changes them and otherwise only copy the selected ones
+        self.estimators_ = self._copy_estimators(estimators)
+        with self._phase("prune"):
+            idx, weights = self.prune_(proba, y, X)        
+        self._select(idx, weights, copy_estimators)
+        
+        return self
+
+    def _select(self, idx, weights, copy_estimators = True):
+        ''' Keeps the selected estimators with their weights after pruning. See `prune` for details on copy_estimators. '''
+        estimators_ = [self.estimators_[i] for i in idx]
+        if copy_estimators and not self._mutates_estimators():
+            with self._phase("copy"):
+                estimators_ = copy.deepcopy(estimators_)
         
         self.estimators_ = estimators_
         self.weights_ = weights 
+
+    def _copy_estimators(self, estimators):
+        ''' Returns a deep-copy of the estimators if the pruner changes them (see `_mutates_estimators`) and a list of references otherwise. '''
+        if self._mutates_estimators():
+            with self._phase("copy"):
+                return copy.deepcopy(estimators)
+        return list(estimators)
+
+    def prune_stream(self, chunks, estimators, classes = None, n_classes = None, copy_estimators = True):
+        '''
+        Prunes the given ensemble on a stream of pruning data, e.g. if the pruning set is too large to be kept in memory. The estimators are evaluated on one chunk at a time and the pruner only accumulates the statistics it requires from each chunk (see `_update_stream`), so that neither the pruning set nor the predictions of all estimators on it are materialized. Not every pruner supports this.
+
+        Parameters
+        ----------
+        chunks : iterable
+            An iterable of (X, y) tuples, where X is a (n, d) matrix of examples and y are the corresponding n targets. 
+        estimators, classes, n_classes, copy_estimators
+            See `prune`.
+
+        Returns
+        -------
+        The pruned ensemble.
+        '''
+        if self._requires_window():
+            raise NotImplementedError("{} keeps the predictions of each chunk and thus does not support pruning on a stream of data. Use partial_prune with a window instead".format(type(self).__name__))
+
+        self.stats_ = PruningStats()
+        self.estimators_ = self._copy_estimators(estimators)
+        state = None
+        for X, y in chunks:
+            y = np.asarray(y)
+            proba = self._prepare(X, y, self.estimators_, classes, n_classes)
+            with self._phase("update"):
+                state = self._update_stream(state, proba, y, X)
+        assert state is not None, "The stream did not contain any pruning data"
+
+        with self._phase("prune"):
+            idx, weights = self._prune_stream(state)
+        self._select(idx, weights, copy_estimators)
         
         return self
 
+    def partial_prune(self, X, y, estimators = None, classes = None, n_classes = None, window = None, decay = None, copy_estimators = True):
+        '''
+        Updates the pruned ensemble with a new chunk of pruning data, e.g. if new labelled data arrives over time. The first call requires the estimators of the base ensemble, which are kept in `base_estimators_` and re-used by subsequent calls. Each call only evaluates the estimators on the new chunk and adds its statistics to the statistics of all previous chunks (see `prune_stream`), from which the pruned ensemble is then re-computed. Pass the estimators again to start over, e.g. to switch between calls with and without a window.
+
+        By default all chunks are weighted equally. Old chunks can age out via a sliding window or an exponential decay. Which of these a pruner supports depends on its statistics: `RankPruningClassifier` and `MIQPPruningClassifier` support both, `GreedyPruningClassifier` keeps the predictions of each chunk and thus requires a window and `ProxPruningClassifier` continues its stochastic gradient descent from the current weights (warm start), which tracks changes in the data by itself and supports neither.
+
+        Parameters
+        ----------
+        X : numpy matrix
+            A (n, d) matrix with the new pruning examples.
+        y : numpy array / list of ints
+            The n targets of the new pruning examples.
+        estimators : list, optional
+            The base ensemble. Must be given on the first call.
+        classes, n_classes, copy_estimators
+            See `prune`.
+        window : int, optional
+            If set, only the statistics of the last window chunks (including the new one) are used.
+        decay : float, optional
+            If set, the statistics of all previous chunks are weighted by decay before the new chunk is added. 
+
+        Returns
+        -------
+        The pruned ensemble.
+        '''
+        assert window is None or decay is None, "Please use either a sliding window or a decay, but not both"
+        assert window is None or window >= 1, "window must be at-least 1"
+        assert decay is None or 0 <= decay <= 1, "decay must be from [0,1]"
+        assert window is not None or not self._requires_window(), "{} keeps the predictions of each chunk and thus requires a window".format(type(self).__name__)
+        assert window is None or self._supports_window(), "{} does not support sliding windows".format(type(self).__name__)
+        assert decay is None or self._supports_decay(), "{} does not support decays".format(type(self).__name__)
+        assert estimators is not None or self.base_estimators_ is not None, "The first call of partial_prune requires the estimators of the base ensemble"
+        # Windowed calls keep the statistics of each chunk, all other calls a single running statistic. These cannot be converted into each other
+        assert estimators is not None or (window is not None) == self.partial_window_, "partial_prune has been called {} a window before. Pass the estimators again to start over".format("with" if self.partial_window_ else "without")
+
+        self.stats_ = PruningStats()
+        if estimators is not None:
+            self.base_estimators_ = self._copy_estimators(estimators)
+            self.partial_state_ = None
+            self.partial_chunks_ = []
+            self.partial_window_ = window is not None
+
+        y = np.asarray(y)
+        self.estimators_ = self.base_estimators_
+        proba = self._prepare(X, y, self.estimators_, classes, n_classes)
+
+        with self._phase("update"):
+            if window is not None:
+                # Keep the statistics of each chunk separately so that the oldest chunk can be dropped
+                self.partial_chunks_ = (self.partial_chunks_ + [self._update_stream(None, proba, y, X)])[-window:]
+                state = self.partial_chunks_[0]
+                for chunk in self.partial_chunks_[1:]:
+                    state = self._merge_stream(state, chunk)
+            else:
+                state = self.partial_state_
+                if decay is not None and state is not None:
+                    state = self._decay_stream(state, decay)
+                state = self._update_stream(state, proba, y, X)
+                self.partial_state_ = state
+
+        with self._phase("prune"):
+            idx, weights = self._prune_stream(state)
+        self._select(idx, weights, copy_estimators)
+
+        return self
+
+    def _requires_window(self):
+        '''
+        Returns True if the statistics of `_update_stream` grow with each chunk, e.g. because the predictions of each chunk are kept. Such pruners do not support `prune_stream` and require a window in `partial_prune` so that their memory stays bounded.
+        '''
+        return False
+
+    def _supports_window(self):
+        ''' Returns True if the pruner supports sliding windows in `partial_prune`, i.e. if it implements `_merge_stream`. '''
+        return type(self)._merge_stream is not PruningClassifier._merge_stream
+
+    def _supports_decay(self):
+        ''' Returns True if the pruner supports decays in `partial_prune`, i.e. if it implements `_decay_stream`. '''
+        return type(self)._decay_stream is not PruningClassifier._decay_stream
+
+    def _merge_stream(self, state, other):
+        '''
+        Merges the statistics of `_update_stream` of two disjoint sets of chunks. Required for sliding windows in `partial_prune`.
+        '''
+        raise NotImplementedError("{} does not support sliding windows".format(type(self).__name__))
+
+    def _decay_stream(self, state, factor):
+        '''
+        Weights the statistics of `_update_stream` of all chunks so far by factor. Required for decays in `partial_prune`.
+        '''
+        raise NotImplementedError("{} does not support decays".format(type(self).__name__))
+
+    def _update_stream(self, state, proba, target, data):
+        '''
+        Accumulates the statistics required for pruning on a stream of data (see `prune_stream`) from a single chunk. Pruners which support streams override this and `_prune_stream`.
+
+        Parameters
+        ----------
+        state : 
+            The statistics accumulated so far or None for the first chunk.
+        proba, target, data :
+            The predictions, targets and examples of the chunk, see `prune_`.
+
+        Returns
+        -------
+        The updated statistics.
+        '''
+        raise NotImplementedError("{} does not support pruning on a stream of data".format(type(self).__name__))
+
+    def _prune_stream(self, state):
+        '''
+        Prunes the ensemble given the statistics accumulated via `_update_stream`. Returns the indices and weights of the selected estimators, see `prune_`.
+        '''
+        raise NotImplementedError("{} does not support pruning on a stream of data".format(type(self).__name__))
+
+    def _collect_proba(self, estimators, X, out):
+        ''' Computes the predictions of each estimator and writes them directly into the pre-allocated out using the class mapping, n_jobs and predict_batch_size of this pruner. See `collect_proba` for details. '''
+        return collect_proba(estimators, X, out, self.classes_, self.n_jobs, self.predict_batch_size)
+
     def _individual_proba(self, X):
         ''' Predict class probabilities for each individual learner in the ensemble without considering the weights.
 
@@ -134,17 +630,12 @@ class PruningClassifier(ABC):
             The predicted class probabilities for each learner.
         '''
         assert self.estimators_ is not None, "Call prune before calling predict_proba!"
-        all_proba = []
-
-        for e in self.estimators_:
-            tmp = np.zeros(shape=(X.shape[0], self.n_classes_), dtype=np.float32)
-            tmp[:, self.classes_.astype(int)] += e.predict_proba(X)
-            all_proba.append(tmp)
 
-        if len(all_proba) == 0:
+        if len(self.estimators_) == 0:
             return np.zeros(shape=(1, X.shape[0], self.n_classes_), dtype=np.float32)
         else:
-            return np.array(all_proba)
+            all_proba = np.zeros(shape=(len(self.estimators_), X.shape[0], self.n_classes_), dtype=np.float32)
+            return self._collect_proba(self.estimators_, X, all_proba)
 
     def predict_proba(self, X):
         ''' Predict class probabilities using the pruned model.
@@ -159,11 +650,40 @@ class PruningClassifier(ABC):
         y : array, shape (n_samples,C)
             The predicted class probabilities. 
         '''
-        all_proba = self._individual_proba(X)
-        scaled_prob = np.array([w * p for w,p in zip(all_proba, self.weights_)])
-        combined_proba = np.sum(scaled_prob, axis=0)
+        assert self.estimators_ is not None, "Call prune before calling predict_proba!"
+
+        # Instead of storing the predictions of each member we directly accumulate the weighted predictions. Thus, only a single (n_samples,C) matrix is allocated regardless of the number of members and only a single predict_batch_size chunk of each member's prediction is alive at once.
+        classes = self.classes_.astype(int)
+        n_rows = X.shape[0]
+        batch_size = n_rows if self.predict_batch_size is None else self.predict_batch_size
+        combined_proba = np.zeros(shape=(n_rows, self.n_classes_), dtype=np.float64)
+        lock = threading.Lock()
+
+        def accumulate(e, w, start, end):
+            iproba = w * e.predict_proba(X[start:end])
+            with lock:
+                combined_proba[start:end, classes] += iproba
+
+        Parallel(n_jobs=self.n_jobs, backend="threading")(
+            delayed(accumulate) (e, w, start, min(start + batch_size, n_rows)) for e, w in zip(self.estimators_, self.weights_) for start in range(0, n_rows, batch_size)
+        )
         return combined_proba
 
+    def compile(self, predict_batch_size = 4096):
+        ''' Compiles the pruned ensemble of decision trees into a single flat-array model with a vectorized traversal which evaluates all trees on a batch at once. The weights of the pruned ensemble are folded into the leaf values. The compiled model does not require the original estimators anymore and uses the same number of threads (n_jobs) as this classifier. See `CompiledEnsemble` for details. 
+
+        Parameters
+        ----------
+        predict_batch_size : int, default is 4096
+            The maximum number of rows which are predicted at once by the compiled model. 
+
+        Returns
+        -------
+        The CompiledEnsemble.
+        '''
+        assert self.estimators_ is not None, "Call prune before calling compile!"
+        return CompiledEnsemble.from_estimators(self.estimators_, self.weights_, self.classes_, self.n_classes_, self.n_jobs, predict_batch_size)
+
     def predict(self, X):
         ''' Predict classes using the pruned model.
 
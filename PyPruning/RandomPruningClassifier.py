@@ -12,9 +12,11 @@ class RandomPruningClassifier(PruningClassifier):
         The number of estimators which should be selected.
     seed : int, optional, default is None
         The random seed for the random selection
+    n_jobs : int, default is 1
+        The number of threads used for computing the predictions of the estimators.
     '''
 
-    def __init__(self, n_estimators = 5, seed = None):
+    def __init__(self, n_estimators = 5, seed = None, n_jobs = 1):
         """
         Creates a new RandomPruningClassifier.
 
@@ -25,15 +27,31 @@ class RandomPruningClassifier(PruningClassifier):
             The number of estimators which should be selected.
         seed : int, optional, default is None
             The random seed for the random selection
+        n_jobs : int, default is 1
+            The number of threads used for computing the predictions of the estimators.
         """
-        super().__init__()
+        super().__init__(n_jobs = n_jobs)
         self.n_estimators = n_estimators
         self.seed = seed
 
     def prune_(self, proba, target, data = None):
+        return self._prune_random(len(proba))
+
+    def _update_stream(self, state, proba, target, data):
+        return len(proba)
+
+    def _merge_stream(self, state, other):
+        return other
+
+    def _decay_stream(self, state, factor):
+        return state
+
+    def _prune_stream(self, state):
+        return self._prune_random(state)
+
+    def _prune_random(self, n_received):
         # TODO  It seems that numpy changed the way it handles randomization. We should maybe adapt their new interface
         np.random.seed(self.seed)
-        n_received = len(proba)
         if self.n_estimators >= n_received:
             return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
         else:
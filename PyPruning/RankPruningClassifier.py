@@ -5,9 +5,9 @@ from sklearn.metrics import roc_auc_score, cohen_kappa_score
 
 from scipy import spatial
 
-from joblib import Parallel,delayed
 
-from .PruningClassifier import PruningClassifier
+from .PruningClassifier import PruningClassifier, vectorized_metric, metric_representation, update_stream, merge_stream, decay_stream, stream_scores
+from .Storage import chunk_bounds, LabelPredictions
 
 def individual_margin_diversity(i, ensemble_proba, target, alpha = 0.2):
     '''
@@ -64,6 +64,42 @@ def individual_margin_diversity(i, ensemble_proba, target, alpha = 0.2):
             MDM = MDM + (alpha*fm) + ((1-alpha)*fd)
     return - 1.0 * MDM
 
+def individual_margin_diversity_batch(predictions, target, alpha = 0.2):
+    '''
+    Batch version of `individual_margin_diversity` which scores all classifiers at once. It only requires the class predictions and thus receives a LabelPredictions object.
+    
+    For a correct prediction the margin and the diversity only depend on the example and not on the classifier itself. Thus, we compute both once for each example and sum them over all examples which are correctly classified by the respective classifier.
+    '''
+    n = predictions.shape[1]
+    MDM = np.zeros(predictions.shape[0])
+
+    for start, end in chunk_bounds(predictions):
+        ctarget = target[start:end]
+        V = predictions.votes(start, end)
+
+        rows = np.arange(end - start)
+        vtarget = V[rows, ctarget]
+        vmax = V.max(axis=1)
+        vsecond = np.sort(V, axis=1)[:,-2]
+
+        margin = np.where(
+            ctarget == V.argmax(axis=1),
+            np.where(vsecond == vmax, vtarget - (vsecond - 1), vtarget - vsecond),
+            vtarget - vmax
+        ) / n
+        margin[margin == 0] = 0.01
+
+        # If no classifier is correct on an example it does not contribute to any score. Skip these to avoid log(0)
+        has_correct = vtarget > 0
+        MD = np.zeros(end - start)
+        MD[has_correct] = alpha*np.log(np.abs(margin[has_correct])) + (1-alpha)*np.log(vtarget[has_correct] / n)
+
+        MDM += predictions.correctness(start, end) @ MD
+    return - 1.0 * MDM
+
+individual_margin_diversity_batch.representation = "labels"
+individual_margin_diversity.batch = individual_margin_diversity_batch
+
 def individual_contribution(i, ensemble_proba, target):
     '''
     Compute the individual contributions of each classifier wrt. the entire ensemble. Return the negative contribution due to the minimization.
@@ -103,6 +139,37 @@ def individual_contribution(i, ensemble_proba, target):
             IC = IC + (V[j, target[j]]  -  V[j, predictions[j]] - np.max(V[j,:]) )
     return - 1.0 * IC
 
+def individual_contribution_batch(predictions, target):
+    '''
+    Batch version of `individual_contribution` which scores all classifiers at once. It only requires the class predictions and thus receives a LabelPredictions object. 
+    
+    The contributions of correct predictions only depend on the example, whereas wrong predictions additionally depend on the number of votes for the (wrongly) predicted class.
+    '''
+    IC = np.zeros(predictions.shape[0])
+
+    for start, end in chunk_bounds(predictions):
+        cpredictions = predictions.predictions[:, start:end]
+        ctarget = target[start:end]
+        V = predictions.votes(start, end)
+
+        rows = np.arange(end - start)
+        vtarget = V[rows, ctarget]
+        vmax = V.max(axis=1)
+        vsecond = np.sort(V, axis=1)[:,-2]
+
+        # case 1 (minority group) and case 2 (majority group)
+        IC_correct = np.where(ctarget != V.argmax(axis=1), 2*vmax - vtarget, vsecond)
+        
+        # case 3 (wrong prediction)
+        IC_wrong = vtarget[np.newaxis,:] - V[rows[np.newaxis,:], cpredictions] - vmax[np.newaxis,:]
+
+        IC += np.where(predictions.correctness(start, end), IC_correct[np.newaxis,:], IC_wrong).sum(axis=1)
+    return - 1.0 * IC
+
+individual_contribution_batch.representation = "labels"
+individual_contribution_batch.stream = "sum"
+individual_contribution.batch = individual_contribution_batch
+
 def individual_error(i, ensemble_proba, target):
     ''' 
     Compute the error for the individual classifier. If I read it correctly, then the following paper proposed this method. Although the paper is not super clear on this.
@@ -113,6 +180,17 @@ def individual_error(i, ensemble_proba, target):
     iproba = ensemble_proba[i,:,:]
     return (iproba.argmax(axis=1) != target).mean()
 
+def individual_error_batch(predictions, target):
+    '''
+    Batch version of `individual_error` which scores all classifiers at once. It only requires the class predictions and thus receives a LabelPredictions object.
+    '''
+    n = predictions.shape[1]
+    return (n - predictions.n_correct()) / n
+
+individual_error_batch.representation = "labels"
+individual_error_batch.stream = "counts"
+individual_error.batch = individual_error_batch
+
 def error_ambiguity(i, ensemble_proba, target):
     '''
     Compute the error for the individual classifier according to the ambiguity decomposition. I am fairly sure that this implementation is correct, however, the paper is not super clear on what they do from an algorithmic point of view. From what I can tell is, that the authors compute the ambiguity scores for each classifier only once and then "greedily" pick the best K models. 
@@ -138,6 +216,29 @@ def error_ambiguity(i, ensemble_proba, target):
     np.put_along_axis(bitmask, target[:,None], 1.0, 1)
     return (bitmask * A + (1.0 - bitmask) * B).sum() + sqdiff.sum()
 
+def error_ambiguity_batch(ensemble_proba, target):
+    '''
+    Batch version of `error_ambiguity` which scores all classifiers at once.
+    '''
+    C = ensemble_proba.shape[2]
+    scores = np.zeros(ensemble_proba.shape[0])
+
+    for start, end in chunk_bounds(ensemble_proba):
+        cproba = np.asarray(ensemble_proba[:, start:end, :])
+        all_proba = cproba.mean(axis=0)
+        sqdiff = ((cproba - all_proba[np.newaxis,:,:])**2).sum(axis=(1,2))
+
+        A = 1.0 / C**2 * np.exp(- 1.0 / C * cproba)
+        B = 1.0 / C**2 * (1.0 / (C-1))**2 * np.exp(1.0 / C * 1.0 / (C-1) * cproba)
+
+        bitmask = np.zeros(cproba.shape[1:])
+        np.put_along_axis(bitmask, target[start:end,None], 1.0, 1)
+        scores += (bitmask[np.newaxis,:,:] * A + (1.0 - bitmask[np.newaxis,:,:]) * B).sum(axis=(1,2)) + sqdiff
+    return scores
+
+error_ambiguity_batch.stream = "sum"
+error_ambiguity.batch = error_ambiguity_batch
+
     # for j in range(iproba.shape[0]):
     #     for c in range(C):
     #         if target[j] == c:
@@ -158,6 +259,14 @@ def individual_neg_auc(i, ensemble_proba, target):
     else:
         return - 1.0 * roc_auc_score(target, iproba, multi_class="ovr")
 
+def individual_neg_auc_batch(ensemble_proba, target):
+    '''
+    Batch version of `individual_neg_auc`. The roc auc score is still computed once per classifier, but without dispatching each classifier as a separate job.
+    '''
+    return np.array([individual_neg_auc(i, ensemble_proba, target) for i in range(ensemble_proba.shape[0])])
+
+individual_neg_auc.batch = individual_neg_auc_batch
+
 def individual_kappa_statistic(i, ensemble_proba, target):
     ''' 
     Compute the Cohen-Kappa statistic for the individual classifier with respect to the entire ensemble.
@@ -180,6 +289,28 @@ def individual_kappa_statistic(i, ensemble_proba, target):
                     scores.append(score)
     return min(scores)
 
+def individual_kappa_statistic_batch(predictions, target):
+    '''
+    Batch version of `individual_kappa_statistic` which scores all classifiers at once. It only requires the class predictions and thus receives a LabelPredictions object. 
+    
+    The Cohen-Kappa statistic of a pair is (p_o - p_e) / (1 - p_e), where the observed agreement p_o and the expected agreement p_e are computed for all pairs from the number of agreements of each pair and the class frequencies of each classifier.
+    '''
+    n = predictions.shape[1]
+    p_o = predictions.agreements() / n
+    frequencies = predictions.class_counts() / n
+    p_e = frequencies @ frequencies.T
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        kappa = (p_o - p_e) / (1.0 - p_e)
+    kappa[np.isnan(kappa)] = 0.0
+    np.fill_diagonal(kappa, np.inf)
+
+    return kappa.min(axis=1)
+
+individual_kappa_statistic_batch.representation = "labels"
+individual_kappa_statistic_batch.stream = "pairwise"
+individual_kappa_statistic.batch = individual_kappa_statistic_batch
+
 def reference_vector(i, ensemble_proba, target):
     '''
     Compare how close the individual predictions is to the entire ensemble's prediction by using the cosine similary
@@ -198,6 +329,25 @@ def reference_vector(i, ensemble_proba, target):
     ref = 2 * (ensemble_proba.mean(axis=0).argmax(axis=1) == target) - 1.0
     ipred = 2 * (ensemble_proba[i,:].argmax(axis=1) == target) - 1.0
     return 1.0 - spatial.distance.cosine(ref, ipred)
+
+def reference_vector_batch(ensemble_proba, target):
+    '''
+    Batch version of `reference_vector` which scores all classifiers at once.
+    '''
+    dot = np.zeros(ensemble_proba.shape[0])
+    ipred_norm = np.zeros(ensemble_proba.shape[0])
+    ref_norm = 0.0
+
+    for start, end in chunk_bounds(ensemble_proba):
+        cproba = np.asarray(ensemble_proba[:, start:end, :])
+        ref = 2 * (cproba.mean(axis=0).argmax(axis=1) == target[start:end]) - 1.0
+        ipred = 2 * (cproba.argmax(axis=2) == target[np.newaxis,start:end]) - 1.0
+        dot += ipred @ ref
+        ipred_norm += (ipred**2).sum(axis=1)
+        ref_norm += (ref**2).sum()
+    return dot / (np.sqrt(ipred_norm) * np.sqrt(ref_norm))
+
+reference_vector.batch = reference_vector_batch
     # ref /= np.linalg.norm(ref)
     # ipred /= np.linalg.norm(ipred)
     #return np.dot(ref, ipred)
@@ -219,6 +369,31 @@ class RankPruningClassifier(PruningClassifier):
             return (iproba.argmax(axis=1) != target).mean()
     ```
 
+    Calling the metric once per classifier often re-computes the same quantities (e.g. the votes of the entire ensemble) over and over again. Thus, a metric can additionally offer a batch form which scores all classifiers at once. The batch form is stored as attribute `batch` on the metric, receives `ensemble_proba` and `target` (as numpy array) and returns a numpy array with one score per classifier:
+
+    ```Python
+        def individual_error_batch(ensemble_proba, target):
+            return (ensemble_proba.argmax(axis=2) != target[np.newaxis,:]).mean(axis=1)
+        
+        individual_error.batch = individual_error_batch
+    ```
+
+    If a metric offers a batch form it is used automatically. Batch forms which only require the class predictions of each classifier can additionally set `representation = "labels"`. In this case, they receive a compact `Storage.LabelPredictions` object in place of `ensemble_proba` and the full (M,N,C) prediction tensor is never computed during pruning:
+
+    ```Python
+        def individual_error_batch(predictions, target):
+            n = predictions.shape[1]
+            return (n - predictions.n_correct()) / n
+        
+        individual_error_batch.representation = "labels"
+    ```
+
+    Batch forms which can be computed chunk by chunk can additionally set `stream` (see `PruningClassifier.metric_stream`) which allows pruning on a stream of data via `prune_stream`. For example, the individual error only requires the number of correct predictions of each classifier:
+
+    ```Python
+        individual_error_batch.stream = "counts"
+    ```
+
     **Important** The classifiers are sorted in ascending order and the first n_estimators are selected. Differently put, the metric is always minimized.
 
     Attributes
@@ -228,9 +403,11 @@ class RankPruningClassifier(PruningClassifier):
     metric : function, default is individual_error 
         A function that assigns a score to each classifier which is then used for sorting
     n_jobs : int, default is 8
-        The number of threads used for computing the individual metrics for each classifier.
+        The number of threads used for computing the individual metrics for each classifier and the predictions of the estimators.
+    backend : str, default is "threading"
+        The joblib backend used for evaluating the metric, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
     '''
-    def __init__(self, n_estimators = 5, metric = individual_error, n_jobs = 8, **kwargs):
+    def __init__(self, n_estimators = 5, metric = individual_error, n_jobs = 8, backend = "threading", **kwargs):
         """
         Creates a new RankPruningClassifier.
 
@@ -242,11 +419,13 @@ class RankPruningClassifier(PruningClassifier):
         metric : function, default is individual_error 
             A function that assigns a score to each classifier which is then used for sorting
         n_jobs : int, default is 8
-            The number of threads used for computing the individual metrics for each classifier.
+            The number of threads used for computing the individual metrics for each classifier and the predictions of the estimators.
+        backend : str, default is "threading"
+            The joblib backend used for evaluating the metric, see `PruningClassifier`. Use "loky" to evaluate the metric in multiple processes.
         kwargs : 
             Any additional kwargs are directly supplied to the metric function via a partial
         """
-        super().__init__()
+        super().__init__(backend = backend)
 
         assert metric is not None, "You must provide a valid metric!"
         self.n_estimators = n_estimators
@@ -257,15 +436,40 @@ class RankPruningClassifier(PruningClassifier):
         else:
             self.metric = metric
 
+    def _representation(self):
+        return metric_representation(vectorized_metric(self.metric, "batch"))
+
     def prune_(self, proba, target, data = None):
         n_received = len(proba)
         if self.n_estimators >= n_received:
             return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
         
-        single_scores = Parallel(n_jobs=self.n_jobs, backend="threading")(
-            delayed(self.metric) (i, proba, target) for i in range(n_received)
-        )
-        single_scores = np.array(single_scores)
+        batch = vectorized_metric(self.metric, "batch")
+        if batch is not None:
+            if metric_representation(batch) == "labels" and not isinstance(proba, LabelPredictions):
+                proba = LabelPredictions.from_proba(proba, target)
+            single_scores = batch(proba, np.asarray(target))
+            self.stats_.n_metric_evaluations += n_received
+        else:
+            single_scores = np.array(self._evaluate_metric(self.metric, [(i,) for i in range(n_received)], proba, target))
+
+        return np.argpartition(single_scores, self.n_estimators)[:self.n_estimators], [1.0 / self.n_estimators for _ in range(self.n_estimators)]
+        
+
+    def _update_stream(self, state, proba, target, data):
+        return update_stream(state, vectorized_metric(self.metric, "batch"), proba, target)
+
+    def _merge_stream(self, state, other):
+        return merge_stream(state, other)
+
+    def _decay_stream(self, state, factor):
+        return decay_stream(state, factor)
+
+    def _prune_stream(self, state):
+        single_scores = stream_scores(state, vectorized_metric(self.metric, "batch"))
+        n_received = len(single_scores)
+        self.stats_.n_metric_evaluations += n_received
+        if self.n_estimators >= n_received:
+            return range(0, n_received), [1.0 / n_received for _ in range(n_received)]
 
         return np.argpartition(single_scores, self.n_estimators)[:self.n_estimators], [1.0 / self.n_estimators for _ in range(self.n_estimators)]
-        
\ No newline at end of file
@@ -0,0 +1,705 @@
+import copy
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+# The default number of entries (M x N x C) of a single chunk, which is roughly 64 MB for float32
+CHUNK_SIZE = 2**24
+
+class ChunkedProba:
+    ''' A lazily paged (M,N,C) prediction tensor which is stored in a directory of chunk files.
+
+    The N examples are split into consecutive chunks and each chunk is stored as a separate (M,n,C) `.npy` file which is memory-mapped on access. Thus, only the chunks which are currently accessed are resident in memory. A ChunkedProba supports the basic numpy indexing required by the pruning metrics, e.g. `proba[i]`, `proba[i,:,:]`, `proba[selected_models, :, :]` or `proba[:, start:end, :]`. Use `chunk_bounds` to iterate over it in N-chunks.
+
+    Attributes
+    ----------
+    path : str
+        The directory in which the chunk files are stored.
+    shape : tuple of ints
+        The shape (M,N,C) of the prediction tensor.
+    dtype : numpy dtype
+        The dtype of the predictions.
+    bounds : list of tuples
+        The (start, end) indices of the examples stored in each chunk.
+    '''
+    def __init__(self, path, shape, dtype = np.float32, chunk_size = CHUNK_SIZE, mode = "w+"):
+        """
+        Creates a new ChunkedProba or opens an existing one.
+
+        Parameters
+        ----------
+        path : str or None
+            The directory in which the chunk files are stored. If None, a temporary directory is created which is removed once this object is garbage collected.
+        shape : tuple of ints
+            The shape (M,N,C) of the prediction tensor.
+        dtype : numpy dtype, default is np.float32
+            The dtype of the predictions.
+        chunk_size : int, default is CHUNK_SIZE
+            The maximum number of entries stored in a single chunk file.
+        mode : str, default is "w+"
+            "w+" creates new (zero-initialized) chunk files, "r" and "r+" open existing files.
+        """
+        assert len(shape) == 3, "ChunkedProba expects a shape (M,N,C), but you supplied {}".format(shape)
+        assert chunk_size >= 1, "chunk_size must be at-least 1"
+
+        if path is None:
+            path = tempfile.mkdtemp(prefix="pypruning_")
+            weakref.finalize(self, shutil.rmtree, path, True)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        m, n, c = self.shape
+        rows = max(1, chunk_size // max(1, m * c))
+        self.bounds = [(start, min(start + rows, n)) for start in range(0, n, rows)]
+        self.chunks_ = [
+            np.lib.format.open_memmap(os.path.join(path, "chunk_{}.npy".format(k)), mode=mode, dtype=self.dtype, shape=(m, end - start, c))
+            for k, (start, end) in enumerate(self.bounds)
+        ]
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype = None, copy = None):
+        # This materializes the entire tensor and should only be used as a last resort
+        proba = self[:, :, :]
+        return proba if dtype is None else proba.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        assert len(key) <= 3 and not any(k is Ellipsis for k in key), "ChunkedProba only supports indexing of the form [models, rows, classes]"
+        models, rows, classes = key + (slice(None),) * (3 - len(key))
+
+        if isinstance(rows, slice):
+            start, end, step = rows.indices(self.shape[1])
+            if step == 1:
+                blocks = []
+                for (cstart, cend), chunk in zip(self.bounds, self.chunks_):
+                    if cend > start and cstart < end:
+                        blocks.append(np.asarray(chunk[:, max(start, cstart) - cstart:min(end, cend) - cstart, :][models]))
+                if len(blocks) == 0:
+                    return np.zeros((self.shape[0], 0, self.shape[2]), dtype=self.dtype)[models][..., classes]
+                # models might have removed the first axis, so examples are either on axis 0 or axis 1
+                axis = 0 if np.ndim(blocks[0]) == 2 else 1
+                return np.concatenate(blocks, axis=axis)[..., classes]
+            rows = np.arange(start, end, step)
+
+        scalar_row = np.ndim(rows) == 0
+        rows = np.atleast_1d(np.asarray(rows)) % self.shape[1]
+        chunk_ids = np.searchsorted([cstart for cstart, _ in self.bounds], rows, side="right") - 1
+
+        out = np.zeros((self.shape[0], len(rows), self.shape[2]), dtype=self.dtype)
+        for k in np.unique(chunk_ids):
+            mask = chunk_ids == k
+            out[:, mask, :] = self.chunks_[k][:, rows[mask] - self.bounds[k][0], :]
+        if scalar_row:
+            out = out[:, 0, :]
+        return out[models][..., classes]
+
+    def __setitem__(self, key, value):
+        i, rows = key if isinstance(key, tuple) else (key, slice(None))
+        assert np.ndim(i) == 0 and isinstance(rows, slice), "ChunkedProba only supports writing consecutive predictions of a single model at once, e.g. proba[i] = p or proba[i, start:end] = p"
+        start, end, step = rows.indices(self.shape[1])
+        assert step == 1, "ChunkedProba only supports writing consecutive predictions of a single model at once, e.g. proba[i] = p or proba[i, start:end] = p"
+
+        value = np.asarray(value)
+        for (cstart, cend), chunk in zip(self.bounds, self.chunks_):
+            if cend > start and cstart < end:
+                lstart, lend = max(start, cstart), min(end, cend)
+                chunk[i, lstart - cstart:lend - cstart] = value[lstart - start:lend - start]
+
+    def flush(self):
+        ''' Writes all changes to disk. '''
+        for chunk in self.chunks_:
+            chunk.flush()
+
+class TopKProba:
+    ''' A sparse (M,N,C) prediction tensor which only stores the k largest class probabilities of each prediction.
+
+    For problems with many classes, each prediction (e.g. of a leaf of a decision tree) typically puts its mass on only a handful of classes. Thus, a TopKProba stores a (M,N,k) matrix of class indices and a (M,N,k) matrix of the corresponding probabilities. The entries of each prediction are sorted by decreasing probability and increasing class, so that the first entry is the argmax of the prediction. If k is at-least the number of non-zero probabilities of each prediction, this representation is exact. Otherwise, the remaining probability mass is dropped.
+
+    A TopKProba supports the same (read-only) indexing as a ChunkedProba, e.g. `proba[i]`, `proba[selected_models, :, :]` or `proba[:, start:end, :]`, in which case the requested part is densified. Metrics can work directly on the stored entries via `argmax`, `dot` and `rdot` so that their runtime scales with the number of stored entries instead of C. Predictions are written via `proba[i, start:end] = p` where p is the dense (end - start, C) prediction.
+
+    Attributes
+    ----------
+    indices : numpy array
+        The (M,N,k) matrix of class indices (see label_dtype).
+    values : numpy array
+        The (M,N,k) matrix of class probabilities.
+    k : int
+        The number of stored probabilities per prediction.
+    shape : tuple of ints
+        The shape (M,N,C) of the prediction tensor.
+    dtype : numpy dtype
+        The dtype of the predictions.
+    '''
+    def __init__(self, shape, k, dtype = np.float32):
+        """
+        Creates a new, zero-initialized TopKProba.
+
+        Parameters
+        ----------
+        shape : tuple of ints
+            The shape (M,N,C) of the prediction tensor.
+        k : int
+            The number of stored probabilities per prediction. If k is larger than C, only C probabilities are stored.
+        dtype : numpy dtype, default is np.float32
+            The dtype of the predictions.
+        """
+        assert len(shape) == 3, "TopKProba expects a shape (M,N,C), but you supplied {}".format(shape)
+        assert k >= 1, "k must be at-least 1"
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.k = min(k, self.shape[2])
+        self.indices = np.zeros((self.shape[0], self.shape[1], self.k), dtype=label_dtype(self.shape[2]))
+        self.values = np.zeros((self.shape[0], self.shape[1], self.k), dtype=self.dtype)
+
+    @classmethod
+    def from_arrays(cls, indices, values, n_classes):
+        '''
+        Creates a TopKProba from existing (M,N,k) indices and values, e.g. memory-mapped arrays. The entries of each prediction must be sorted as described above.
+        '''
+        proba = cls.__new__(cls)
+        proba.shape = (indices.shape[0], indices.shape[1], n_classes)
+        proba.dtype = values.dtype
+        proba.k = indices.shape[2]
+        proba.indices = indices
+        proba.values = values
+        return proba
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype = None, copy = None):
+        # This materializes the entire tensor and should only be used as a last resort
+        proba = self[:, :, :]
+        return proba if dtype is None else proba.astype(dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        assert len(key) <= 3 and not any(k is Ellipsis for k in key), "TopKProba only supports indexing of the form [models, rows, classes]"
+        models, rows, classes = key + (slice(None),) * (3 - len(key))
+
+        indices = self.indices[models, rows]
+        proba = np.zeros(indices.shape[:-1] + (self.shape[2],), dtype=self.dtype)
+        np.put_along_axis(proba, indices.astype(np.intp), self.values[models, rows], axis=-1)
+        return proba[..., classes]
+
+    def __setitem__(self, key, value):
+        i, rows = key if isinstance(key, tuple) else (key, slice(None))
+        assert np.ndim(i) == 0 and isinstance(rows, slice), "TopKProba only supports writing consecutive predictions of a single model at once, e.g. proba[i] = p or proba[i, start:end] = p"
+
+        value = np.asarray(value, dtype=self.dtype)
+        if self.k < self.shape[2]:
+            indices = np.argpartition(-value, self.k - 1, axis=1)[:, :self.k]
+        else:
+            indices = np.broadcast_to(np.arange(self.shape[2]), value.shape)
+        values = np.take_along_axis(value, indices, axis=1)
+
+        # argpartition does not respect the class order of ties. If all stored entries tie with the maximum, other classes with the maximum might have been dropped and we fall back to a stable sort of these rows
+        ties = (values.min(axis=1) == values.max(axis=1)) & (self.k < self.shape[2])
+        if ties.any():
+            indices = np.array(indices)
+            indices[ties] = np.argsort(-value[ties], axis=1, kind="stable")[:, :self.k]
+            values[ties] = np.take_along_axis(value[ties], indices[ties], axis=1)
+
+        order = np.lexsort((indices, -values), axis=-1)
+        self.indices[i, rows] = np.take_along_axis(indices, order, axis=1)
+        self.values[i, rows] = np.take_along_axis(values, order, axis=1)
+
+    def argmax(self, models, offset = None):
+        '''
+        Computes the (len(models), N) class predictions of the given models. If offset is given, the dense (N,C) matrix offset is added to each prediction before taking the argmax. Just as for numpy's argmax, ties are broken in favor of the smaller class.
+        '''
+        indices = self.indices[models]
+        if offset is None:
+            return indices[..., 0]
+
+        values = offset[np.arange(self.shape[1])[:, np.newaxis], indices] + self.values[models]
+        best = values.max(axis=-1)
+        best_class = np.where(values == best[..., np.newaxis], indices, self.shape[2]).min(axis=-1)
+
+        # All other classes keep their value from offset. If the best stored class ties with the best class of offset, the smaller class wins
+        offset_best, offset_class = offset.max(axis=1), offset.argmax(axis=1)
+        return np.where(best > offset_best, best_class, np.where(best < offset_best, offset_class, np.minimum(best_class, offset_class)))
+
+    def dot(self, w, start = 0, end = None):
+        '''
+        Computes the (end - start, C) weighted sum sum_i w[i] * proba[i, start:end, :] of all predictions.
+        '''
+        end = self.shape[1] if end is None else end
+        n, c = end - start, self.shape[2]
+        flat = self.indices[:, start:end, :].astype(np.intp) + c * np.arange(n)[np.newaxis, :, np.newaxis]
+        weights = np.asarray(w, dtype=np.float64)[:, np.newaxis, np.newaxis] * self.values[:, start:end, :]
+        return np.bincount(flat.ravel(), weights=weights.ravel(), minlength=n * c).reshape(n, c)
+
+    def rdot(self, x, start = 0, end = None):
+        '''
+        Computes the M inner products sum_{j,c} proba[i, start + j, c] * x[j, c] of each model's predictions with the dense (end - start, C) matrix x.
+        '''
+        end = self.shape[1] if end is None else end
+        indices = self.indices[:, start:end, :]
+        gathered = x[np.arange(end - start)[np.newaxis, :, np.newaxis], indices]
+        return (gathered * self.values[:, start:end, :]).sum(axis=(1, 2), dtype=np.float64)
+
+def create_proba(shape, storage = None, path = None, dtype = np.float32, chunk_size = CHUNK_SIZE, top_k = 16):
+    '''
+    Creates a zero-initialized (M,N,C) prediction tensor with the given storage backend.
+
+    Parameters
+    ----------
+    shape : tuple of ints
+        The shape (M,N,C) of the prediction tensor.
+    storage : str, default is None
+        The storage backend. Should be one of `{None, "memmap", "chunks", "topk"}`. None allocates a regular numpy array in memory, "memmap" stores the tensor in a single memory-mapped file, "chunks" stores the tensor in a directory of chunk files (see ChunkedProba) and "topk" only stores the top_k largest probabilities of each prediction in memory (see TopKProba).
+    path : str, default is None
+        The file ("memmap") or directory ("chunks") in which the predictions are stored. If None, a temporary file / directory is used which is removed once it is not needed anymore.
+    dtype : numpy dtype, default is np.float32
+        The dtype of the predictions.
+    chunk_size : int, default is CHUNK_SIZE
+        The maximum number of entries stored in a single chunk file. Only used for storage = "chunks".
+    top_k : int, default is 16
+        The number of probabilities stored per prediction. Only used for storage = "topk".
+
+    Returns
+    -------
+    The prediction tensor.
+    '''
+    assert storage is None or storage in ["memmap", "chunks", "topk"], "Currently only the storage backends {{None, memmap, chunks, topk}} are supported, but you provided: {}".format(storage)
+
+    if storage is None:
+        return np.zeros(shape=shape, dtype=dtype)
+    elif storage == "memmap":
+        if path is None:
+            # The temporary file is already unlinked, so the space is freed once the memmap is closed
+            path = tempfile.TemporaryFile(prefix="pypruning_")
+        return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    elif storage == "topk":
+        return TopKProba(shape, top_k, dtype=dtype)
+    else:
+        return ChunkedProba(path, shape, dtype=dtype, chunk_size=chunk_size)
+
+def chunk_bounds(proba, chunk_size = CHUNK_SIZE):
+    '''
+    Computes the (start, end) indices of the N-chunks in which a prediction tensor should be processed. Regular in-memory arrays are processed as a single chunk, memory-mapped arrays and TopKProba objects are split into chunks with at most chunk_size (dense) entries and ChunkedProba objects use their chunk files. Use `proba[:, start:end, :]` to access a chunk.
+
+    Parameters
+    ----------
+    proba : numpy array, numpy memmap, ChunkedProba or TopKProba
+        The (M,N,C) prediction tensor.
+    chunk_size : int, default is CHUNK_SIZE
+        The maximum number of entries per chunk for memory-mapped arrays.
+
+    Returns
+    -------
+    A list of (start, end) tuples.
+    '''
+    n = proba.shape[1]
+    if isinstance(proba, ChunkedProba):
+        return list(proba.bounds)
+    elif isinstance(proba, LabelPredictions):
+        rows = max(1, chunk_size // max(1, proba.shape[0]))
+        return [(start, min(start + rows, n)) for start in range(0, n, rows)]
+    elif isinstance(proba, (np.memmap, TopKProba)):
+        rows = max(1, chunk_size // max(1, proba.shape[0] * proba.shape[2]))
+        return [(start, min(start + rows, n)) for start in range(0, n, rows)]
+    else:
+        return [(0, n)]
+
+def label_dtype(n_classes):
+    '''
+    Returns the smallest unsigned integer dtype which can store the class labels 0,...,n_classes-1.
+    '''
+    if n_classes <= 2**8:
+        return np.uint8
+    elif n_classes <= 2**16:
+        return np.uint16
+    else:
+        return np.uint32
+
+def class_predictions(proba):
+    '''
+    Computes the (M,N) matrix of class predictions, i.e. the argmax over the class axis, chunk by chunk.
+
+    Parameters
+    ----------
+    proba : numpy array, numpy memmap, ChunkedProba or TopKProba
+        The (M,N,C) prediction tensor.
+
+    Returns
+    -------
+    A (M,N) numpy array of unsigned ints (see label_dtype).
+    '''
+    if isinstance(proba, TopKProba):
+        return proba.argmax(slice(None)).astype(label_dtype(proba.shape[2]))
+
+    predictions = np.zeros(proba.shape[:2], dtype=label_dtype(proba.shape[2]))
+    for start, end in chunk_bounds(proba):
+        predictions[:, start:end] = np.asarray(proba[:, start:end, :]).argmax(axis=2)
+    return predictions
+
+def argmax_predictions(proba, models, offset = None):
+    '''
+    Computes the (len(models), N) class predictions of the given models, i.e. the argmax over the class axis. If offset is given, the (N,C) matrix offset is added to each prediction before taking the argmax. For a TopKProba only the stored entries of the models are accessed.
+    '''
+    if isinstance(proba, TopKProba):
+        return proba.argmax(models, offset)
+
+    pred = proba[models, :, :]
+    if offset is not None:
+        pred = pred + offset[np.newaxis, :, :]
+    return pred.argmax(axis=2)
+
+def vote_counts(predictions, n_classes):
+    '''
+    Computes the (N,C) vote matrix V where V[j,c] is the number of classifiers which predict class c for the j-th example. predictions is the (M,N) matrix of the individual class predictions.
+    '''
+    n = predictions.shape[1]
+    offsets = n_classes * np.arange(n)[np.newaxis,:]
+    return np.bincount((predictions + offsets).ravel(), minlength=n*n_classes).reshape(n, n_classes).astype(np.float64)
+
+# Number of set bits for each possible byte. Used if numpy does not offer np.bitwise_count (numpy < 2.0)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount(bits, axis = -1):
+    '''
+    Counts the number of set bits in a packed (uint8) bitset along the given axis.
+    '''
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=axis, dtype=np.int64)
+    else:
+        return _POPCOUNT[bits].sum(axis=axis, dtype=np.int64)
+
+class LabelPredictions:
+    ''' A compact, label-only representation of the ensemble predictions.
+
+    Many metrics only use the class predictions (the argmax over the class axis) of each ensemble member. For these, it is enough to store the (M,N) matrix of class predictions with the smallest possible unsigned dtype and a packed bitset which marks the correct predictions. This requires 4*C times less memory than the full (M,N,C) float32 tensor. Pairwise counts such as the number of common errors are computed via popcounts over the bitsets.
+
+    Metrics declare that they work on this representation by setting `representation = "labels"` on their vectorized form. In this case, the vectorized form receives a LabelPredictions object in place of `ensemble_proba`.
+
+    Attributes
+    ----------
+    predictions : numpy array
+        The (M,N) matrix of class predictions.
+    correct : numpy array
+        The (M, ceil(N/8)) packed bitset where the j-th bit of the i-th row is set if the i-th classifier correctly classifies the j-th example.
+    n_classes : int
+        The number of classes C.
+    shape : tuple of ints
+        The shape (M,N,C) of the full prediction tensor this object represents.
+    '''
+    def __init__(self, predictions, target, n_classes):
+        """
+        Creates a new LabelPredictions object.
+
+        Parameters
+        ----------
+        predictions : numpy array
+            The (M,N) matrix of class predictions.
+        target : numpy array of ints
+            The N class targets.
+        n_classes : int
+            The number of classes C.
+        """
+        target = np.asarray(target)
+        self.n_classes = n_classes
+        self.predictions = np.asarray(predictions).astype(label_dtype(n_classes), copy=False)
+        self.correct = np.packbits(self.predictions == target[np.newaxis,:], axis=1)
+        self.shape = (self.predictions.shape[0], self.predictions.shape[1], n_classes)
+        self.votes_ = None
+
+    @classmethod
+    def from_proba(cls, proba, target):
+        '''
+        Creates a LabelPredictions object from a (M,N,C) prediction tensor.
+        '''
+        return cls(class_predictions(proba), target, proba.shape[2])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def correctness(self, start = 0, end = None):
+        '''
+        Unpacks the (M, end - start) boolean matrix of correct predictions for the examples start,...,end-1.
+        '''
+        end = self.shape[1] if end is None else end
+        # Only unpack the bytes which contain the requested examples
+        first = start // 8
+        bits = np.unpackbits(self.correct[:, first:(end + 7) // 8], axis=1)
+        return bits[:, start - 8*first:end - 8*first].astype(bool)
+
+    def votes(self, start = 0, end = None):
+        '''
+        Returns the (end - start, C) vote matrix (see `vote_counts`) for the examples start,...,end-1. The vote matrix of all examples is computed once and then re-used.
+        '''
+        if self.votes_ is None:
+            self.votes_ = np.zeros((self.shape[1], self.n_classes))
+            for cstart, cend in chunk_bounds(self):
+                self.votes_[cstart:cend] = vote_counts(self.predictions[:, cstart:cend], self.n_classes)
+        end = self.shape[1] if end is None else end
+        return self.votes_[start:end]
+
+    def n_correct(self):
+        '''
+        Returns the number of correct predictions of each classifier.
+        '''
+        return popcount(self.correct)
+
+    def _pairwise_popcount(self, bits, start = 0, end = None):
+        m, width = bits.shape
+        end = m if end is None else end
+        counts = np.zeros((end - start, m), dtype=np.int64)
+        block = max(1, CHUNK_SIZE // max(1, m * width))
+        for bstart in range(start, end, block):
+            bend = min(bstart + block, end)
+            counts[bstart - start:bend - start] = popcount(bits[bstart:bend, np.newaxis, :] & bits[np.newaxis, :, :])
+        return counts
+
+    def co_correct(self, start = 0, end = None):
+        '''
+        Returns the (M,M) matrix with the number of examples which are correctly classified by both classifiers i and j. If start and end are given, only the rows start,...,end-1 of this matrix are computed.
+        '''
+        return self._pairwise_popcount(self.correct, start, end)
+
+    def _errors(self):
+        # packbits pads the last byte with zeros, which must not be counted as errors 
+        valid = np.packbits(np.ones(self.shape[1], dtype=bool))
+        return np.invert(self.correct) & valid[np.newaxis, :]
+
+    def co_errors(self, start = 0, end = None):
+        '''
+        Returns the (M,M) matrix with the number of examples which are wrongly classified by both classifiers i and j. If start and end are given, only the rows start,...,end-1 of this matrix are computed.
+        '''
+        return self._pairwise_popcount(self._errors(), start, end)
+
+    def error_factors(self, rank, n_oversamples = 10, n_iter = 2, seed = 0):
+        '''
+        Computes a (M, rank) matrix A so that A A^T approximates the co_errors() matrix, which is the Gram matrix E E^T of the (M,N) error matrix E. The factors are computed via a randomized eigendecomposition (Halko, Martinsson & Tropp 2011) which only multiplies E and E^T with (M, rank + n_oversamples) matrices chunk by chunk. Thus, it requires O(M * rank) instead of O(M^2) memory and O(M * N * rank) time. If rank + n_oversamples >= M, A A^T equals co_errors() up to rounding errors.
+
+        Parameters
+        ----------
+        rank : int
+            The number of columns of A.
+        n_oversamples : int, default is 10
+            The number of additional random directions, which improves the accuracy of the approximation.
+        n_iter : int, default is 2
+            The number of power iterations, which improves the accuracy if the eigenvalues of E E^T decay slowly.
+        seed : int, default is 0
+            The random seed.
+        '''
+        m = self.shape[0]
+        n_columns = min(m, rank + n_oversamples)
+        # The unpacked chunks are stored as float64, hence use 8 times smaller chunks
+        bounds = chunk_bounds(self, CHUNK_SIZE // 8)
+
+        def gram(X):
+            Y = np.zeros(X.shape)
+            for start, end in bounds:
+                E = (~self.correctness(start, end)).astype(np.float64)
+                Y += E @ (E.T @ X)
+            return Y
+
+        Q = np.linalg.qr(gram(np.random.RandomState(seed).standard_normal((m, n_columns))))[0]
+        for _ in range(n_iter):
+            Q = np.linalg.qr(gram(Q))[0]
+
+        B = Q.T @ gram(Q)
+        eigenvalues, W = np.linalg.eigh(0.5 * (B + B.T))
+        top = np.argsort(eigenvalues)[::-1][:rank]
+        return (Q @ W[:, top]) * np.sqrt(np.clip(eigenvalues[top], 0, None))[np.newaxis, :]
+
+    def agreements(self):
+        '''
+        Returns the (M,M) matrix with the number of examples for which classifiers i and j predict the same class.
+        '''
+        m = self.shape[0]
+        counts = np.zeros((m, m))
+        for start, end in chunk_bounds(self):
+            cpredictions = self.predictions[:, start:end]
+            for c in range(self.n_classes):
+                is_c = (cpredictions == c).astype(np.float64)
+                counts += is_c @ is_c.T
+        return counts
+
+    def class_counts(self):
+        '''
+        Returns the (M,C) matrix with the number of examples for which classifier i predicts class c.
+        '''
+        m = self.shape[0]
+        offsets = self.n_classes * np.arange(m)[:, np.newaxis]
+        return np.bincount((self.predictions + offsets).ravel(), minlength=m*self.n_classes).reshape(m, self.n_classes).astype(np.float64)
+
+class LabelStatistics:
+    ''' Aggregated statistics of the class predictions of an ensemble which are accumulated over a stream of pruning data.
+
+    Some metrics only depend on counts over all examples, e.g. the number of correct predictions of each classifier or the number of common errors of each pair of classifiers. These counts can be accumulated chunk by chunk via `update` so that neither the pruning set nor the predictions on it have to be kept. A LabelStatistics object offers the same counts as `LabelPredictions` and thus can be passed to metrics which only use these counts (see `PruningClassifier.metric_stream`). It requires O(M*C) memory and O(M^2) memory if pairwise counts are accumulated, regardless of the number of examples.
+
+    Attributes
+    ----------
+    n_examples : int
+        The number of examples seen so far.
+    n_classes : int
+        The number of classes C.
+    pairwise : boolean
+        True if the pairwise counts (co_correct, co_errors and agreements) are accumulated.
+    shape : tuple of ints
+        The shape (M,N,C) of the full prediction tensor on all examples seen so far.
+    '''
+    def __init__(self, n_models, n_classes, pairwise = True):
+        """
+        Creates a new, empty LabelStatistics object.
+
+        Parameters
+        ----------
+        n_models : int
+            The number of classifiers M.
+        n_classes : int
+            The number of classes C.
+        pairwise : boolean, default is True
+            If true, the pairwise counts are accumulated which requires O(M^2) memory and time per example.
+        """
+        self.n_examples = 0
+        self.n_classes = n_classes
+        self.pairwise = pairwise
+        self.n_correct_ = np.zeros(n_models, dtype=np.int64)
+        self.class_counts_ = np.zeros((n_models, n_classes))
+        self.co_correct_ = np.zeros((n_models, n_models), dtype=np.int64) if pairwise else None
+        self.agreements_ = np.zeros((n_models, n_models)) if pairwise else None
+
+    @property
+    def shape(self):
+        return (len(self.n_correct_), self.n_examples, self.n_classes)
+
+    def __len__(self):
+        return len(self.n_correct_)
+
+    def update(self, predictions):
+        '''
+        Adds the counts of the LabelPredictions of a chunk of examples.
+        '''
+        self.n_examples += predictions.shape[1]
+        self.n_correct_ += predictions.n_correct()
+        self.class_counts_ += predictions.class_counts()
+        if self.pairwise:
+            self.co_correct_ += predictions.co_correct()
+            self.agreements_ += predictions.agreements()
+
+    def merge(self, other):
+        '''
+        Returns the statistics of the examples of this and the other LabelStatistics object.
+        '''
+        merged = copy.copy(self)
+        merged.n_examples = self.n_examples + other.n_examples
+        merged.n_correct_ = self.n_correct_ + other.n_correct_
+        merged.class_counts_ = self.class_counts_ + other.class_counts_
+        if self.pairwise:
+            merged.co_correct_ = self.co_correct_ + other.co_correct_
+            merged.agreements_ = self.agreements_ + other.agreements_
+        return merged
+
+    def scale(self, factor):
+        '''
+        Returns the statistics where each example is weighted by factor, e.g. to let old examples decay. Note that the counts are no integers anymore afterwards.
+        '''
+        scaled = copy.copy(self)
+        scaled.n_examples = factor * self.n_examples
+        scaled.n_correct_ = factor * self.n_correct_
+        scaled.class_counts_ = factor * self.class_counts_
+        if self.pairwise:
+            scaled.co_correct_ = factor * self.co_correct_
+            scaled.agreements_ = factor * self.agreements_
+        return scaled
+
+    def _assert_pairwise(self):
+        assert self.pairwise, "The pairwise counts have not been accumulated. Create the LabelStatistics with pairwise = True"
+
+    def n_correct(self):
+        ''' Returns the number of correct predictions of each classifier. '''
+        return self.n_correct_
+
+    def class_counts(self):
+        ''' Returns the (M,C) matrix with the number of examples for which classifier i predicts class c. '''
+        return self.class_counts_
+
+    def co_correct(self, start = 0, end = None):
+        ''' Returns the (M,M) matrix with the number of examples which are correctly classified by both classifiers i and j or only its rows start,...,end-1. '''
+        self._assert_pairwise()
+        return self.co_correct_[start:end]
+
+    def co_errors(self, start = 0, end = None):
+        ''' Returns the (M,M) matrix with the number of examples which are wrongly classified by both classifiers i and j or only its rows start,...,end-1. '''
+        self._assert_pairwise()
+        return self.n_examples - self.n_correct_[start:end, np.newaxis] - self.n_correct_[np.newaxis, :] + self.co_correct_[start:end]
+
+    def agreements(self):
+        ''' Returns the (M,M) matrix with the number of examples for which classifiers i and j predict the same class. '''
+        self._assert_pairwise()
+        return self.agreements_
+
+def proba_nbytes(proba):
+    '''
+    Returns the number of bytes occupied by the predictions. For file-backed predictions (memmap, ChunkedProba) this is the size on disk, of which only the accessed parts are paged into memory.
+    '''
+    if isinstance(proba, TopKProba):
+        return proba.indices.nbytes + proba.values.nbytes
+    elif isinstance(proba, LabelPredictions):
+        return proba.predictions.nbytes + proba.correct.nbytes
+    else:
+        return int(np.prod(proba.shape)) * np.dtype(proba.dtype).itemsize
+
+def _to_memmap(a):
+    # Copies a into a named temporary .npy file which is removed once the returned memmap is garbage collected
+    fd, path = tempfile.mkstemp(prefix="pypruning_", suffix=".npy")
+    os.close(fd)
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=a.dtype, shape=a.shape)
+    out[...] = a
+    out.flush()
+    weakref.finalize(out, os.remove, path)
+    return out
+
+def shared_proba(proba):
+    '''
+    Returns the predictions in a form which can be shared with worker processes without copying. Process-based joblib backends pass file-backed memmaps by reference, i.e. each worker maps the same file instead of receiving a pickled copy. Thus, in-memory arrays are copied into a temporary memory-mapped file once, whereas file-backed memmaps and ChunkedProba objects are returned as they are. For LabelPredictions the class predictions and the bitset and for TopKProba the indices and values are memory-mapped.
+
+    Parameters
+    ----------
+    proba : numpy array, numpy memmap, ChunkedProba, TopKProba or LabelPredictions
+        The predictions.
+
+    Returns
+    -------
+    The shareable predictions.
+    '''
+    if isinstance(proba, ChunkedProba):
+        return proba
+    elif isinstance(proba, TopKProba):
+        shared = copy.copy(proba)
+        shared.indices = shared_proba(proba.indices)
+        shared.values = shared_proba(proba.values)
+        return shared
+    elif isinstance(proba, LabelPredictions):
+        shared = copy.copy(proba)
+        shared.predictions = shared_proba(proba.predictions)
+        shared.correct = shared_proba(proba.correct)
+        return shared
+    elif isinstance(proba, np.memmap) and proba.filename is not None:
+        return proba
+    else:
+        return _to_memmap(np.asarray(proba))
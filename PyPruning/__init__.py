@@ -29,6 +29,10 @@ for a free solver or if you want to use a commercial solver and use Anaconda you
 
 For more information on setting the solver for `MIQPPruningClassifier` have a look [here](https://www.cvxpy.org/tutorial/advanced/index.html#solve-method-options).
 
+If no MIQP solver is installed, the `MIQPPruningClassifier` uses a built-in heuristic solver which only requires numpy (greedy initialization followed by a local and a tabu search). It also respects a time limit, e.g. `MIQPPruningClassifier(n_estimators = 10, solver = "heuristic", time_limit = 60)`, and returns the best solution found so far. If a MIQP solver is installed, the heuristic solution is used as starting point for the exact solve. Alternatively, `solver = "relaxation"` solves the convex relaxation of the MIQP with any QP solver of cvxpy (e.g. OSQP or Clarabel) and rounds its solution. The gap between the objective of the rounded solution and the objective of the relaxation (a lower bound) is reported in `stats_.solver`.
+
+The dense pairwise matrix of the `MIQPPruningClassifier` requires O(M^2) memory, e.g. 800 MB for M = 10000 estimators. For larger ensembles, `pairwise_form = "lowrank"` stores a low-rank factorization of the pairwise matrix (`rank` columns per estimator), which `combined_error` computes from the Gram matrix of the error indicators without ever forming the (M,M) matrix. `pairwise_form = "knn"` keeps only the `n_neighbors` largest entries of each row as sparse matrix and works with any pairwise metric. Both forms are approximations and are used by the heuristic solver and by `solver = "relaxation"`, e.g. `MIQPPruningClassifier(n_estimators = 100, pairwise_form = "lowrank", rank = 64, solver = "heuristic")`.
+
 Pruning an ensemble
 -------------------
 
@@ -136,7 +140,7 @@ def individual_error(i, ensemble_proba, target):
 
 ### Implementing a custom pruner
 
-You can implement your own pruner as a well. In this case you just have to implement the `PruningClassifier` class. To do so, you just need to implement the `prune_(self, proba, target)` function which receives a list of all predictions of all classifiers as well as the corresponding data and targets. The function is supposed to return a list of indices corresponding to the chosen estimators as well as the corresponding weights. If you need access to the estimators as well (and not just their predictions) you can access `self.estimators_` which already contains a copy of each classier. For more details have a look at the `PruningClassifier.py` interface. An example implementation could be:
+You can implement your own pruner as a well. In this case you just have to implement the `PruningClassifier` class. To do so, you just need to implement the `prune_(self, proba, target)` function which receives a list of all predictions of all classifiers as well as the corresponding data and targets. The function is supposed to return a list of indices corresponding to the chosen estimators as well as the corresponding weights. If you need access to the estimators as well (and not just their predictions) you can access `self.estimators_` which contains a reference to each classifier. If your pruner changes the classifiers, override `_mutates_estimators` to return `True` so that `self.estimators_` contains a copy of each classifier instead. For more details have a look at the `PruningClassifier.py` interface. An example implementation could be:
 
 
 ```Python
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+'''
+Benchmarks all pruning methods on synthetic ensembles of growing size and writes the results as JSON lines, so that the runtime, memory consumption and accuracy of the pruners can be compared between commits.
+
+For each configuration (M estimators, N pruning examples, C classes) a classification problem is generated via make_classification and an ExtraTreesClassifier with M trees is fitted on a separate training set. Then each pruner prunes this ensemble on the N pruning examples in a fresh process, so that the peak RSS of one run is not affected by the other runs and a run which exceeds the time limit or the available memory does not take down the benchmark. For each run the following is recorded:
+
+- `build_time`: The time for computing the predictions of all estimators on the pruning set (the prediction tensor or the class predictions), i.e. the "predict" phase of `PruningClassifier.stats_`.
+- `select_time`: The remaining time of `prune`, i.e. the actual selection.
+- `wall_time`: The total time of `prune`.
+- `peak_rss`: The peak resident set size of the process in bytes, including the data and the base ensemble.
+- `phases`, `n_metric_evaluations`, `peak_tensor_bytes`: The profiling report of the pruner, see `PruningStats`.
+- `accuracy`: The accuracy of the pruned ensemble on a test set. `full_accuracy` is the accuracy of the base ensemble.
+- `status`: One of `ok`, `error` (the pruner raised an exception, see `error`), `timeout`, `killed` (e.g. by the OOM killer) or `skipped` (the dense prediction tensor would exceed --max_tensor_bytes).
+
+By default, each of M, N and C is scaled separately while the other two are kept at a base value. Use `--grid full` for all combinations. Examples:
+
+    python PyPruning/tests/benchmark.py --quick --out quick.jsonl
+    python PyPruning/tests/benchmark.py --methods reduced_error individual_error prox --M 64 256 1024 4096 --out results.jsonl
+    python PyPruning/tests/benchmark.py --compare old.jsonl new.jsonl
+'''
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import sklearn
+
+from sklearn.datasets import make_classification
+from sklearn.ensemble import ExtraTreesClassifier
+
+from PyPruning.RandomPruningClassifier import RandomPruningClassifier
+from PyPruning.ProxPruningClassifier import ProxPruningClassifier
+from PyPruning.Papers import create_pruner
+
+PAPERS_METHODS = [
+    "individual_margin_diversity", "individual_contribution", "individual_error", "individual_kappa_statistic", "reduced_error", "complementariness",
+    "drep", "margin_distance", "combined", "combined_error", "reference_vector", "error_ambiguity"
+]
+METHODS = PAPERS_METHODS + ["prox", "random"]
+
+AXES = {"M" : [64, 256, 1024, 4096], "N" : [1000, 10000, 100000, 1000000], "C" : [2, 10, 100, 1000]}
+BASE = {"M" : 128, "N" : 10000, "C" : 10}
+
+QUICK_AXES = {"M" : [16, 32, 64], "N" : [500, 1000, 2000], "C" : [2, 5, 10]}
+QUICK_BASE = {"M" : 32, "N" : 1000, "C" : 5}
+
+def create(method, n_estimators, n_jobs):
+    ''' Creates the pruner for the given method. '''
+    if method == "prox":
+        return ProxPruningClassifier(ensemble_regularizer = "hard-L1", l_ensemble_reg = n_estimators, loss = "mse", step_size = 1e-2, epochs = 1, n_jobs = n_jobs)
+    elif method == "random":
+        return RandomPruningClassifier(n_estimators = n_estimators, seed = 0, n_jobs = n_jobs)
+    else:
+        return create_pruner(method, n_estimators = n_estimators, n_jobs = n_jobs)
+
+def configurations(axes, base, grid):
+    ''' Returns the (M, N, C) configurations of the benchmark. '''
+    if grid == "full":
+        return list(itertools.product(axes["M"], axes["N"], axes["C"]))
+
+    configs = []
+    for axis in ["M", "N", "C"]:
+        for value in axes[axis]:
+            config = dict(base, **{axis : value})
+            config = (config["M"], config["N"], config["C"])
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+def peak_rss():
+    ''' Returns the peak resident set size of this process in bytes. '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)), capture_output = True, text = True)
+        return out.stdout.strip() if out.returncode == 0 else None
+    except OSError:
+        return None
+
+def generate(path, M, N, C, max_depth, n_jobs, seed):
+    '''
+    Generates the data of a configuration, fits the base ensemble and stores both in path. Returns the accuracy of the base ensemble.
+    '''
+    n_informative = max(5, int(np.ceil(np.log2(C))) + 2)
+    n_train = max(2000, 20 * C)
+    n_test = max(2000, 5 * C)
+    X, y = make_classification(
+        n_samples = n_train + N + n_test, n_features = max(20, 2 * n_informative), n_informative = n_informative,
+        n_classes = C, n_clusters_per_class = 1, random_state = seed
+    )
+    X = X.astype(np.float32)
+
+    model = ExtraTreesClassifier(n_estimators = M, max_depth = max_depth, random_state = seed, n_jobs = n_jobs)
+    model.fit(X[:n_train], y[:n_train])
+
+    np.save(os.path.join(path, "Xprune.npy"), X[n_train:n_train + N])
+    np.save(os.path.join(path, "yprune.npy"), y[n_train:n_train + N])
+    np.save(os.path.join(path, "Xtest.npy"), X[n_train + N:])
+    np.save(os.path.join(path, "ytest.npy"), y[n_train + N:])
+    with open(os.path.join(path, "estimators.pkl"), "wb") as f:
+        pickle.dump(model.estimators_, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+    return float((model.predict(X[n_train + N:]) == y[n_train + N:]).mean())
+
+def run(path, method, n_prune, C, storage, n_jobs):
+    ''' Prunes the ensemble stored in path with the given method and returns the measurements. '''
+    Xprune, yprune = np.load(os.path.join(path, "Xprune.npy")), np.load(os.path.join(path, "yprune.npy"))
+    Xtest, ytest = np.load(os.path.join(path, "Xtest.npy")), np.load(os.path.join(path, "ytest.npy"))
+    with open(os.path.join(path, "estimators.pkl"), "rb") as f:
+        estimators = pickle.load(f)
+
+    pruner = create(method, n_prune, n_jobs)
+
+    start = time.perf_counter()
+    pruner.prune(Xprune, yprune, estimators, classes = np.arange(C), n_classes = C, storage = storage, copy_estimators = False)
+    wall_time = time.perf_counter() - start
+    build_time = pruner.stats_.phases.get("predict", 0.0)
+
+    return {
+        "status" : "ok",
+        "build_time" : build_time,
+        "select_time" : wall_time - build_time,
+        "wall_time" : wall_time,
+        "accuracy" : float((pruner.predict(Xtest) == ytest).mean()),
+        "n_selected" : len(pruner.estimators_),
+        "phases" : pruner.stats_.phases,
+        "n_metric_evaluations" : pruner.stats_.n_metric_evaluations,
+        "peak_tensor_bytes" : pruner.stats_.peak_tensor_bytes
+    }
+
+def worker(conn, *args):
+    try:
+        result = run(*args)
+    except Exception as e:
+        result = {"status" : "error", "error" : "{}: {}".format(type(e).__name__, e)}
+    result["peak_rss"] = peak_rss()
+    conn.send(result)
+    conn.close()
+
+def run_isolated(timeout, *args):
+    ''' Runs `run` in a fresh process and returns its measurements. '''
+    ctx = multiprocessing.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex = False)
+    process = ctx.Process(target = worker, args = (sender,) + args)
+    process.start()
+    sender.close()
+
+    # poll returns early if the worker sends its result or dies
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = None
+    else:
+        process.terminate()
+        result = {"status" : "timeout"}
+    process.join()
+
+    if result is None:
+        result = {"status" : "killed", "error" : "exit code {}".format(process.exitcode)}
+    return result
+
+def benchmark(args):
+    axes, base = (dict(QUICK_AXES), dict(QUICK_BASE)) if args.quick else (dict(AXES), dict(BASE))
+    for axis in ["M", "N", "C"]:
+        if getattr(args, axis) is not None:
+            axes[axis] = getattr(args, axis)
+    configs = configurations(axes, base, args.grid)
+    methods = args.methods or METHODS
+
+    meta = {
+        "type" : "meta",
+        "commit" : git_commit(),
+        "date" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "sklearn" : sklearn.__version__,
+        "platform" : platform.platform(),
+        "cpu_count" : os.cpu_count(),
+        "args" : vars(args)
+    }
+
+    with open(args.out, "w") as out:
+        out.write(json.dumps(meta) + "\n")
+
+        for M, N, C in configs:
+            tensor_bytes = M * N * C * np.dtype(np.float32).itemsize
+            path = tempfile.mkdtemp(prefix = "pypruning-benchmark-")
+            try:
+                full_accuracy = None
+                for method in methods:
+                    record = {
+                        "type" : "run", "method" : method, "M" : M, "N" : N, "C" : C, "n_prune" : args.n_prune, "storage" : args.storage, "tensor_bytes" : tensor_bytes
+                    }
+                    if tensor_bytes > args.max_tensor_bytes and args.storage is None:
+                        record["status"] = "skipped"
+                    else:
+                        if full_accuracy is None:
+                            full_accuracy = generate(path, M, N, C, args.max_depth, args.n_jobs, args.seed)
+                        record["full_accuracy"] = full_accuracy
+                        record.update(run_isolated(args.timeout, path, method, args.n_prune, C, args.storage, args.n_jobs))
+
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+                    print("M={:<5} N={:<8} C={:<5} {:<28} {:<8} wall={:>9} rss={:>9} acc={}".format(
+                        M, N, C, method, record["status"],
+                        "{:.3f}s".format(record["wall_time"]) if "wall_time" in record else "-",
+                        "{:.0f}MB".format(record["peak_rss"] / 2**20) if "peak_rss" in record else "-",
+                        "{:.4f}".format(record["accuracy"]) if "accuracy" in record else "-"
+                    ), flush = True)
+            finally:
+                shutil.rmtree(path, ignore_errors = True)
+
+def load(path):
+    ''' Loads a result file and returns its meta data and its runs by configuration. '''
+    meta, runs = {}, {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "meta":
+                meta = record
+            else:
+                runs[(record["method"], record["M"], record["N"], record["C"], record["n_prune"], record["storage"])] = record
+    return meta, runs
+
+def compare(old_path, new_path, threshold):
+    '''
+    Compares two result files and prints the relative change of the wall time and the peak RSS as well as the change of the accuracy of each run. Returns the number of regressions, i.e. runs which became slower or used more memory by more than the threshold or which failed in the new, but not in the old results.
+    '''
+    old_meta, old_runs = load(old_path)
+    new_meta, new_runs = load(new_path)
+    print("old: {} ({})".format(old_meta.get("commit"), old_path))
+    print("new: {} ({})".format(new_meta.get("commit"), new_path))
+
+    regressions = 0
+    for key in sorted(set(old_runs) & set(new_runs), key = lambda k: (k[0], k[1], k[2], k[3])):
+        old, new = old_runs[key], new_runs[key]
+        method, M, N, C = key[:4]
+        prefix = "M={:<5} N={:<8} C={:<5} {:<28}".format(M, N, C, method)
+
+        if new["status"] != "ok" or old["status"] != "ok":
+            regressed = old["status"] == "ok" and new["status"] != "ok"
+            regressions += regressed
+            print("{} {} -> {}{}".format(prefix, old["status"], new["status"], "  REGRESSION" if regressed else ""))
+            continue
+
+        time_ratio = new["wall_time"] / max(old["wall_time"], 1e-9)
+        rss_ratio = new["peak_rss"] / max(old["peak_rss"], 1)
+        regressed = time_ratio > 1 + threshold or rss_ratio > 1 + threshold
+        regressions += regressed
+        print("{} time x{:.2f} rss x{:.2f} accuracy {:+.4f}{}".format(
+            prefix, time_ratio, rss_ratio, new["accuracy"] - old["accuracy"], "  REGRESSION" if regressed else ""
+        ))
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks the pruning methods on synthetic ensembles of growing size.")
+    parser.add_argument("--methods", nargs = "+", choices = METHODS, help = "The pruning methods. Default are all methods.")
+    parser.add_argument("--M", nargs = "+", type = int, help = "The ensemble sizes. Default is {}".format(AXES["M"]))
+    parser.add_argument("--N", nargs = "+", type = int, help = "The pruning set sizes. Default is {}".format(AXES["N"]))
+    parser.add_argument("--C", nargs = "+", type = int, help = "The number of classes. Default is {}".format(AXES["C"]))
+    parser.add_argument("--grid", choices = ["axes", "full"], default = "axes", help = "Scale one of M, N and C at a time (axes) or use all combinations (full).")
+    parser.add_argument("--quick", action = "store_true", help = "Use a small grid, e.g. as smoke test.")
+    parser.add_argument("--n_prune", type = int, default = 8, help = "The size of the pruned ensembles.")
+    parser.add_argument("--storage", choices = ["memmap", "chunks", "topk"], default = None, help = "The storage of the prediction tensor.")
+    parser.add_argument("--max_depth", type = int, default = 10, help = "The maximum depth of the trees.")
+    parser.add_argument("--max_tensor_bytes", type = int, default = 4 * 2**30, help = "Skip configurations whose dense prediction tensor exceeds this size (unless --storage is set).")
+    parser.add_argument("--timeout", type = float, default = 3600, help = "The time limit of a single run in seconds.")
+    parser.add_argument("--n_jobs", type = int, default = 1, help = "The number of jobs used for fitting, predicting and pruning.")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--out", default = "benchmark.jsonl", help = "The file the results are written to.")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), help = "Compare two result files instead of running the benchmark.")
+    parser.add_argument("--threshold", type = float, default = 0.25, help = "The relative slowdown / memory increase which is reported as regression by --compare.")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) > 0 else 0)
+    else:
+        benchmark(args)